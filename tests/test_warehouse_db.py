@@ -0,0 +1,92 @@
+"""数据库迁移和交易时间的测试"""
+import sqlite3
+
+import pytest
+
+from warehouse_db import MIGRATIONS, Database, migrate, parse_timestamp, schema_version
+from warehouse_import import import_transactions
+from warehouse_service import WarehouseError, WarehouseService
+
+# 第一个版本的表结构（迁移之前的旧数据库），日期是手工输入的文本
+LEGACY_SCHEMA = [
+    '''
+    CREATE TABLE products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        price REAL,
+        category TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER,
+        type TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        operator TEXT NOT NULL,
+        date TEXT NOT NULL,
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )
+    ''',
+]
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'warehouse.db'))
+    yield database
+    database.close()
+
+
+def test_migrate_legacy_dates(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    for sql in LEGACY_SCHEMA:
+        conn.execute(sql)
+    conn.execute("INSERT INTO products (id, name, quantity) VALUES (1, '螺丝', 30)")
+    conn.executemany("INSERT INTO transactions (product_id, type, quantity, operator, date) VALUES (1, ?, ?, ?, ?)",
+                     [('入库', 20, '', '2024-03-05'),
+                      ('入库', 20, '', '2024/03/06'),
+                      ('出库', 5, '张三', '0202-01-05'),  # 2020 误输成 0202，早于 1970 年
+                      ('出库', 5, '张三', '不是日期')])
+    conn.commit()
+    conn.close()
+
+    database = Database(path)
+    try:
+        migrate(database)
+        assert schema_version(database) == MIGRATIONS[-1][0]
+        rows = database.fetchall('SELECT date FROM transactions ORDER BY id')
+        assert [date for date, in rows] == ['2024-03-05', '2024-03-06', '1970-01-01', '1970-01-01']
+    finally:
+        database.close()
+
+
+def test_parse_timestamp_range():
+    assert parse_timestamp('1970-01-01') == 0
+    with pytest.raises(ValueError):
+        parse_timestamp('1969-12-31')
+    with pytest.raises(ValueError):
+        parse_timestamp('0202-01-05')
+
+
+def test_post_transaction_before_1970(db):
+    migrate(db)
+    service = WarehouseService(db)
+    service.add_product(1, '螺丝')
+    with pytest.raises(WarehouseError):
+        service.post_transaction(1, '入库', 10, '', '1960-01-01')
+    assert service.get_product(1)[2] == 0
+
+
+def test_import_reports_date_before_1970(db, tmp_path):
+    migrate(db)
+    WarehouseService(db).add_product(1, '螺丝')
+    path = tmp_path / '入库单.csv'
+    path.write_text('商品ID,类型,数量,经办人,日期\n'
+                    '1,入库,5,张三,2024-01-02\n'
+                    '1,入库,5,张三,1969-05-01\n', encoding='utf-8')
+    result = import_transactions(db, str(path))
+    assert [line_no for line_no, message in result.errors] == [3]
+    assert result.imported == 0
@@ -0,0 +1,38 @@
+"""诊断统计的测试"""
+from warehouse_db import Database
+from warehouse_diagnostics import Instrumentation, percentile
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 11))
+    assert percentile(values, 0.50) == 5
+    assert percentile(values, 0.90) == 9
+    assert percentile(values, 0.95) == 10
+    assert percentile(values, 0.10) == 1
+    assert percentile(values, 0.0) == 1
+    assert percentile(values, 1.0) == 10
+    assert percentile(list(range(1, 101)), 0.07) == 7
+    assert percentile(list(range(1, 101)), 0.99) == 99
+    assert percentile([3.0], 0.5) == 3.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_streamed_select_counts_rows(tmp_path):
+    instrumentation = Instrumentation(slow_query_ms=10000)
+    db = Database(str(tmp_path / 'diag.db'), instrumentation=instrumentation)
+    try:
+        db.execute('CREATE TABLE t (x INTEGER)')
+        db.executemany('INSERT INTO t VALUES (?)', [(i,) for i in range(25)])
+        cursor = db.execute('SELECT x FROM t')
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(10)
+            if not rows:
+                break
+            chunks.append(len(rows))
+        assert chunks == [10, 10, 5]
+        summary = {item['name']: item for item in instrumentation.query_summary()}
+        assert summary['SELECT x FROM t']['count'] == 1
+        assert summary['SELECT x FROM t']['rows'] == 25
+    finally:
+        db.close()
@@ -0,0 +1,47 @@
+"""商品搜索的测试"""
+import pytest
+
+from warehouse_db import Database, migrate
+from warehouse_service import WarehouseService
+
+
+@pytest.fixture
+def service(tmp_path):
+    database = Database(str(tmp_path / 'warehouse.db'))
+    migrate(database)
+    service = WarehouseService(database)
+    service.add_product(1, '不锈钢螺丝M6', 1.5, '五金')
+    service.add_product(2, 'LED灯管', 12.0, '照明')
+    service.add_product(3, '螺母', None, None)
+    service.add_product(4, '50%_标签', None, 'a_b')
+    yield service
+    database.close()
+
+
+def search_ids(service, text):
+    return [row[0] for row in service.search_products(text)]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('螺丝', [1]),
+    ('螺', [3, 1]),  # 匹配位置靠前的在前
+    ('丝', [1]),
+    ('m6', [1]),
+    ('6', [1]),
+    ('照明', [2]),  # 类别
+    ('%', [4]),
+    ('_', [4]),
+    ('不锈钢 丝', [1]),  # 长词和短词同时使用
+    ('灯 L', [2]),
+    ('钉子', []),
+])
+def test_search_short_words(service, text, expected):
+    assert search_ids(service, text) == expected
+
+
+def test_search_follows_product_changes(service):
+    service.update_product(3, {'id': 30, 'name': '垫片'})
+    assert search_ids(service, '螺母') == []
+    assert search_ids(service, '垫') == [30]
+    service.update_product(30, {'category': '紧固件'})
+    assert search_ids(service, '紧固') == [30]
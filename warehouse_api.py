@@ -0,0 +1,346 @@
+"""仓库管理系统本地 HTTP/JSON 接口
+
+供扫码枪、MES 等不能操作图形界面的程序使用，与图形界面和命令行共用
+同一个数据库和同一套业务规则（warehouse_service）。只用标准库的 asyncio 实现，
+不依赖其他软件，默认只监听本机：
+
+    python warehouse_api.py
+    python warehouse_api.py --host 0.0.0.0 --port 8765 --db D:/仓库/warehouse.db
+
+接口（请求和响应都是 UTF-8 的 JSON，出错时返回 {"error": 原因}）：
+    GET  /health
+    GET  /products                          全部商品
+    GET  /products?q=灯管&limit=50           按名称或类别搜索
+    GET  /products?as_of=2024-03-31         各商品在该日期结束时的库存
+    GET  /products/1001                     一个商品
+    POST /transactions                      入库或出库，返回 {"id": 交易ID}
+         {"product_id": 1001, "type": "out", "quantity": 5, "operator": "张三", "date": "2024-01-05"}
+    GET  /transactions?limit=200&product_id=1001&start=2024-01-01&end=2024-01-31&type=out&operator=张三
+         按时间倒序分页，下一页带上响应中 next 的 after_ts 和 after_id
+    GET  /stats/product/1001?start=2024-01-01&end=2024-12-31
+    GET  /stats/operator/张三?start=2024-01-01&end=2024-12-31
+
+SQLite 同一时间只有一个写事务：写操作排队交给一个写任务逐个执行，
+不会在多个线程间争抢写锁；读操作在几个读线程中并发执行，
+每个线程持有自己的连接（Database 按线程复用连接）。
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from warehouse_db import Database, DatabaseBusyError, migrate
+from warehouse_import import TYPE_ALIASES
+from warehouse_service import PRODUCT_SEARCH_LIMIT, TRANSACTION_PAGE_SIZE, WarehouseError, WarehouseService
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# 读线程数（每个线程一个数据库连接）
+READ_THREADS = 4
+
+# 请求体的最大字节数
+MAX_BODY_SIZE = 64 * 1024
+
+# 交易记录每页最多的行数
+MAX_PAGE_SIZE = 1000
+
+# 空闲的长连接保持多久（秒）
+KEEP_ALIVE_TIMEOUT = 30
+
+STATUS_TEXT = {
+    200: 'OK',
+    201: 'Created',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+PRODUCT_FIELDS = ('id', 'name', 'quantity', 'price', 'category')
+TRANSACTION_FIELDS = ('id', 'product_id', 'name', 'type', 'quantity', 'operator', 'date', 'ts')
+
+
+class ApiError(Exception):
+    """请求错误，带有 HTTP 状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _int_value(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name}必须为整数")
+
+
+def _query_int(query, key, default, name):
+    return _int_value(query[key], name) if query.get(key) else default
+
+
+def _trans_type(value):
+    trans_type = TYPE_ALIASES.get(str(value or '').lower())
+    if trans_type is None:
+        raise ApiError(400, "类型只能是入库（in）或出库（out）")
+    return trans_type
+
+
+def _stats(rows, total, headers):
+    total_quantity, total_count = total
+    return {'rows': [dict(zip(headers, row)) for row in rows],
+            'total_quantity': total_quantity or 0,
+            'total_count': total_count}
+
+
+class WarehouseApi:
+    """HTTP 请求的解析、路由和读写调度"""
+
+    def __init__(self, service, read_threads=READ_THREADS):
+        self.service = service
+        self._readers = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix='api-reader')
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='api-writer')
+        self._writes = None
+        self._writer_task = None
+        # (方法, 路径, 处理函数)，路径中的命名组作为参数
+        self.routes = [
+            ('GET', re.compile(r'/health'), self.health),
+            ('GET', re.compile(r'/products'), self.list_products),
+            ('GET', re.compile(r'/products/(?P<product_id>[^/]+)'), self.get_product),
+            ('POST', re.compile(r'/transactions'), self.post_transaction),
+            ('GET', re.compile(r'/transactions'), self.list_transactions),
+            ('GET', re.compile(r'/stats/product/(?P<product_id>[^/]+)'), self.product_stats),
+            ('GET', re.compile(r'/stats/operator/(?P<operator>[^/]+)'), self.operator_stats),
+        ]
+
+    # ---------- 读写调度 ----------
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """启动写任务和监听，返回 asyncio.Server"""
+        self._writes = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._write_loop())
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self):
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+        self._readers.shutdown(wait=False)
+        self._writer.shutdown(wait=False)
+
+    async def _write_loop(self):
+        """写任务：按提交顺序逐个执行写操作"""
+        loop = asyncio.get_running_loop()
+        while True:
+            func, args, future = await self._writes.get()
+            try:
+                result = await loop.run_in_executor(self._writer, func, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def write(self, func, *args):
+        """把写操作交给写任务，等待执行结果"""
+        future = asyncio.get_running_loop().create_future()
+        await self._writes.put((func, args, future))
+        return await future
+
+    async def read(self, func, *args):
+        """在读线程中执行查询"""
+        return await asyncio.get_running_loop().run_in_executor(self._readers, func, *args)
+
+    # ---------- HTTP ----------
+
+    async def handle_connection(self, reader, writer):
+        """处理一个连接上的请求（HTTP/1.1 默认保持连接）"""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError):
+                    return
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(':')
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0 or length > MAX_BODY_SIZE:
+                    status, payload = 413, {'error': "请求内容太大"}
+                    keep_alive = False
+                else:
+                    try:
+                        body = await reader.readexactly(length) if length else b''
+                    except (asyncio.IncompleteReadError, ConnectionError):
+                        return
+                    status, payload = await self.dispatch(method, target, body)
+
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                writer.write((f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}\r\n'
+                              f'Content-Type: application/json; charset=utf-8\r\n'
+                              f'Content-Length: {len(data)}\r\n'
+                              f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+                              f'\r\n').encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, body):
+        """按路径和方法调用处理函数，返回 (状态码, 响应内容)"""
+        # 有的客户端不对路径中的中文编码，直接发送 UTF-8
+        url = urlsplit(target.encode('latin-1').decode('utf-8', 'replace'))
+        path = unquote(url.path).rstrip('/') or '/'
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        path_matched = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if match is None:
+                continue
+            path_matched = True
+            if route_method != method:
+                continue
+            try:
+                return await handler(query, body, **match.groupdict())
+            except ApiError as e:
+                return e.status, {'error': str(e)}
+            except WarehouseError as e:
+                return 400, {'error': str(e)}
+            except DatabaseBusyError as e:
+                return 503, {'error': str(e)}
+            except Exception as e:
+                traceback.print_exc()
+                return 500, {'error': f"服务器内部错误：{e}"}
+        if path_matched:
+            return 405, {'error': "不支持的请求方法"}
+        return 404, {'error': "接口不存在"}
+
+    # ---------- 接口 ----------
+
+    async def health(self, query, body):
+        return 200, {'status': 'ok'}
+
+    async def list_products(self, query, body):
+        if query.get('as_of'):
+            # 补写库存检查点是写操作，交给写任务；查询本身在读线程中执行
+            await self.write(self.service.update_stock_checkpoints)
+            rows = await self.read(self.service.stock_as_of, query['as_of'], False)
+        elif query.get('q'):
+            limit = _query_int(query, 'limit', PRODUCT_SEARCH_LIMIT, "limit")
+            rows = await self.read(self.service.search_products, query['q'], limit)
+        else:
+            rows = await self.read(self.service.list_products)
+        return 200, {'products': [dict(zip(PRODUCT_FIELDS, row)) for row in rows]}
+
+    async def get_product(self, query, body, product_id):
+        row = await self.read(self.service.get_product, _int_value(product_id, "商品ID"))
+        if row is None:
+            raise ApiError(404, "商品不存在")
+        return 200, dict(zip(PRODUCT_FIELDS, row))
+
+    async def post_transaction(self, query, body):
+        """入库或出库，校验规则与图形界面相同（WarehouseService.post_transaction）"""
+        try:
+            data = json.loads(body.decode('utf-8') or '{}')
+        except (UnicodeDecodeError, ValueError):
+            raise ApiError(400, "请求内容不是有效的JSON")
+        if not isinstance(data, dict):
+            raise ApiError(400, "请求内容必须是JSON对象")
+        product_id = _int_value(data.get('product_id'), "商品ID")
+        quantity = _int_value(data.get('quantity'), "数量")
+        trans_date = data.get('date') or None
+        if trans_date is not None and not isinstance(trans_date, str):
+            raise ApiError(400, "日期必须是 YYYY-MM-DD 格式的字符串")
+        trans_id = await self.write(self.service.post_transaction, product_id, _trans_type(data.get('type')),
+                                    quantity, str(data.get('operator') or ''), trans_date)
+        return 201, {'id': trans_id}
+
+    async def list_transactions(self, query, body):
+        limit = min(max(_query_int(query, 'limit', TRANSACTION_PAGE_SIZE, "limit"), 1), MAX_PAGE_SIZE)
+        last_key = None
+        if query.get('after_ts') or query.get('after_id'):
+            last_key = (_query_int(query, 'after_ts', None, "after_ts"),
+                        _query_int(query, 'after_id', None, "after_id"))
+            if None in last_key:
+                raise ApiError(400, "after_ts 和 after_id 需要同时指定")
+        filters = {key: query.get(key) for key in ('start', 'end', 'operator', 'product_id',
+                                                   'min_quantity', 'max_quantity')}
+        if query.get('type'):
+            filters['trans_type'] = _trans_type(query['type'])
+        rows = await self.read(self.service.transactions_page, last_key, limit, filters)
+        next_key = None
+        if len(rows) == limit:
+            next_key = {'after_ts': rows[-1][-1], 'after_id': rows[-1][0]}
+        return 200, {'transactions': [dict(zip(TRANSACTION_FIELDS, row)) for row in rows], 'next': next_key}
+
+    async def product_stats(self, query, body, product_id):
+        if bool(query.get('start')) != bool(query.get('end')):
+            raise ApiError(400, "商品统计的 start 和 end 需要同时指定（都不指定时统计全部）")
+        rows, total = await self.read(self.service.product_outbound_stats, _int_value(product_id, "商品ID"),
+                                      query.get('start'), query.get('end'))
+        return 200, _stats(rows, total, ('operator', 'quantity', 'count'))
+
+    async def operator_stats(self, query, body, operator):
+        if not query.get('start') or not query.get('end'):
+            raise ApiError(400, "经办人统计需要指定 start 和 end")
+        rows, total = await self.read(self.service.operator_stats, operator, query['start'], query['end'])
+        return 200, _stats(rows, total, ('product_id', 'name', 'quantity', 'count'))
+
+
+async def serve(db, host=DEFAULT_HOST, port=DEFAULT_PORT, read_threads=READ_THREADS):
+    """启动接口并一直运行"""
+    api = WarehouseApi(WarehouseService(db), read_threads)
+    server = await api.start(host, port)
+    print(f"接口已启动：http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        api.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='warehouse_api', description="仓库管理系统本地 HTTP/JSON 接口")
+    parser.add_argument('--db', help="数据库文件路径（默认与图形界面相同）")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"监听地址，默认 {DEFAULT_HOST}（只允许本机访问）")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--readers', type=int, default=READ_THREADS, help="读线程数")
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    try:
+        migrate(db)
+        asyncio.run(serve(db, args.host, args.port, args.readers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
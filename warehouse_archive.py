@@ -0,0 +1,235 @@
+"""交易记录归档
+
+已经结束的年份可以把交易记录和按日汇总移到按年份分开的归档文件
+（与数据库同目录的 warehouse_archive_2023.db），主数据库只保留近期的数据，
+体积小，能整个放进页缓存，备份也快。
+
+归档文件登记在主数据库的 archives 表中，需要时用 ATTACH DATABASE 附加：
+统计、导出、交易记录列表和历史库存只在日期范围涉及已归档年份时才读取归档文件，
+各个来源的时间范围互不重叠，结果按来源拼接（UNION ALL）即可。
+
+已归档的年份视为已结账，不能再登记或导入这些年份的交易记录。
+"""
+import os
+import time
+from datetime import datetime
+
+from warehouse_db import SECONDS_PER_DAY, timestamp
+
+# 归档文件名，放在主数据库所在目录
+ARCHIVE_FILENAME = 'warehouse_archive_{year}.db'
+
+# 主数据库的模式名
+MAIN_SCHEMA = 'main'
+
+# SQLite 默认最多同时附加 10 个数据库，一次查询最多读取这么多个归档年份
+MAX_ATTACHED_ARCHIVES = 10
+
+# 归档文件的表结构，与主数据库中的 transactions、daily_stats 相同（不含触发器），
+# 索引用于按日期、商品、经办人筛选和统计
+ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS {schema}.transactions (
+        id INTEGER PRIMARY KEY,
+        product_id INTEGER,
+        type TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        operator TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        date TEXT GENERATED ALWAYS AS (strftime('%Y-%m-%d', ts, 'unixepoch')) VIRTUAL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_ts ON transactions (ts)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_product_ts ON transactions (product_id, ts)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_operator_ts ON transactions (operator, ts)',
+    '''
+    CREATE TABLE IF NOT EXISTS {schema}.daily_stats (
+        product_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        day INTEGER NOT NULL,
+        operator TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (product_id, type, day, operator)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS {schema}.idx_daily_stats_operator_type_day
+    ON daily_stats (operator, type, day, product_id, quantity, count)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS {schema}.idx_daily_stats_day
+    ON daily_stats (day, product_id, type, quantity)
+    ''',
+]
+
+# 从主数据库删除已归档的记录时暂停的触发器：按日汇总整批删除，
+# 不需要逐行扣减；库存检查点在归档后清空重建；变更版本号最后加一次
+SUSPENDED_TRIGGERS = ('trg_transactions_version_delete', 'trg_daily_stats_delete',
+                      'trg_stock_checkpoints_delete')
+
+
+def year_start(year):
+    """某年1月1日0点的整数秒"""
+    return timestamp(datetime(year, 1, 1))
+
+
+def schema_name(year):
+    return f'archive_{int(year)}'
+
+
+def archive_path(db, filename):
+    """归档文件的完整路径（登记表中只保存文件名）"""
+    return os.path.join(os.path.dirname(os.path.abspath(db.path)), filename)
+
+
+def list_archives(db):
+    """已归档的年份，返回 [(年份, 文件路径, 行数)]，从新到旧"""
+    return [(year, archive_path(db, filename), rows)
+            for year, filename, rows in db.fetchall('SELECT year, filename, rows FROM archives ORDER BY year DESC')]
+
+
+def archive_cutoff(db):
+    """归档的截止时间（整数秒）：这之前的交易记录都在归档文件中，没有归档时返回 None"""
+    year = db.scalar('SELECT MAX(year) FROM archives')
+    return None if year is None else year_start(year + 1)
+
+
+def archived_rows(db):
+    """归档文件中的交易记录总数"""
+    return db.scalar('SELECT SUM(rows) FROM archives', default=0)
+
+
+def ledger_sources(db, start_ts=None, end_ts=None):
+    """日期范围 [start_ts, end_ts) 涉及的数据来源，返回 [(模式名, 归档文件路径)]，从新到旧
+
+    主数据库的路径为 None。不指定起止时间时表示不限。
+    """
+    archives = db.fetchall('SELECT year, filename FROM archives ORDER BY year DESC')
+    sources = []
+    if not archives or end_ts is None or end_ts > year_start(archives[0][0] + 1):
+        sources.append((MAIN_SCHEMA, None))
+    for year, filename in archives:
+        if ((start_ts is None or start_ts < year_start(year + 1))
+                and (end_ts is None or end_ts > year_start(year))):
+            sources.append((schema_name(year), archive_path(db, filename)))
+    return sources
+
+
+def _make_room(db, needed):
+    """附加 needed 之前，已附加的加上 needed 超过上限时分离用不到的归档文件"""
+    attached = db.attached()
+    if len(attached | needed) > MAX_ATTACHED_ARCHIVES:
+        for schema in sorted(attached - needed):
+            db.detach(schema)
+
+
+def attach_sources(db, sources):
+    """附加 sources 中的归档文件（不能在事务中调用），返回模式名列表
+
+    连接上附加的归档文件会保留给之后的查询使用，加上这次要附加的超过
+    MAX_ATTACHED_ARCHIVES 时，先分离这次用不到的。
+    归档文件丢失时抛出 ValueError，而不是附加一个新的空文件。
+    """
+    needed = {schema for schema, path in sources if path is not None}
+    if len(needed) > MAX_ATTACHED_ARCHIVES:
+        raise ValueError(f"日期范围涉及的归档年份太多（最多 {MAX_ATTACHED_ARCHIVES} 年），请缩小日期范围")
+    _make_room(db, needed)
+    for schema, path in sources:
+        if path is not None:
+            if not os.path.exists(path):
+                raise ValueError(f"归档文件不存在：{path}")
+            db.attach(schema, path)
+    return [schema for schema, path in sources]
+
+
+def attach_ledger(db, start_ts=None, end_ts=None):
+    """附加日期范围涉及的归档文件，返回模式名列表（从新到旧）"""
+    return attach_sources(db, ledger_sources(db, start_ts, end_ts))
+
+
+def _archive_year(db, year):
+    """把一年的交易记录和按日汇总移到归档文件，返回归档的行数"""
+    start, end = year_start(year), year_start(year + 1)
+    first_day, end_day = start // SECONDS_PER_DAY, end // SECONDS_PER_DAY
+    schema = schema_name(year)
+    filename = ARCHIVE_FILENAME.format(year=year)
+    _make_room(db, {schema})
+    db.attach(schema, archive_path(db, filename))
+    # 先复制并提交到归档文件，再从主数据库删除。复制前清空归档文件中的数据，
+    # 上次中途失败时可以重新执行
+    with db.transaction('IMMEDIATE'):
+        for sql in ARCHIVE_SCHEMA:
+            db.execute(sql.format(schema=schema))
+        db.execute(f'DELETE FROM {schema}.transactions')
+        db.execute(f'DELETE FROM {schema}.daily_stats')
+        db.execute(f'''
+        INSERT INTO {schema}.transactions (id, product_id, type, quantity, operator, ts)
+        SELECT id, product_id, type, quantity, operator, ts
+        FROM main.transactions
+        WHERE ts >= ? AND ts < ?
+        ''', (start, end))
+
+    with db.transaction('IMMEDIATE'):
+        # 复制之后其他终端可能又补录了这一年的记录，在同一写事务中补上
+        db.execute(f'''
+        INSERT OR IGNORE INTO {schema}.transactions (id, product_id, type, quantity, operator, ts)
+        SELECT id, product_id, type, quantity, operator, ts
+        FROM main.transactions
+        WHERE ts >= ? AND ts < ?
+        ''', (start, end))
+        db.execute(f'''
+        INSERT OR REPLACE INTO {schema}.daily_stats (product_id, type, day, operator, quantity, count)
+        SELECT product_id, type, day, operator, quantity, count
+        FROM main.daily_stats
+        WHERE day >= ? AND day < ?
+        ''', (first_day, end_day))
+        rows = db.scalar(f'SELECT COUNT(*) FROM {schema}.transactions', default=0)
+
+        triggers = db.fetchall(
+            f"SELECT sql FROM main.sqlite_master WHERE type = 'trigger' "
+            f"AND name IN ({', '.join('?' * len(SUSPENDED_TRIGGERS))})", SUSPENDED_TRIGGERS)
+        for name in SUSPENDED_TRIGGERS:
+            db.execute(f'DROP TRIGGER IF EXISTS main.{name}')
+        db.execute('DELETE FROM main.transactions WHERE ts >= ? AND ts < ?', (start, end))
+        db.execute('DELETE FROM main.daily_stats WHERE day >= ? AND day < ?', (first_day, end_day))
+        for sql, in triggers:
+            db.execute(sql)
+        # 检查点是从最早的记录开始累计的，归档后改为只累计主数据库中的记录
+        db.execute('DELETE FROM main.stock_checkpoints')
+        db.execute('''
+        INSERT OR REPLACE INTO archives (year, filename, rows, archived_at)
+        VALUES (?, ?, ?, ?)
+        ''', (year, filename, rows, int(time.time())))
+        db.execute("UPDATE change_versions SET version = version + 1 WHERE name = 'transactions'")
+    return rows
+
+
+def archive_before(db, year, progress=None, vacuum=True):
+    """把 year 年以前（不含 year 年）的交易记录按年份移到归档文件，返回 [(年份, 行数)]
+
+    只能归档已经结束的年份，从最早的年份开始逐年归档。
+    progress(已完成年数, 总年数) 用于报告进度。vacuum 为 True 时归档后
+    压缩主数据库文件，释放删除记录后留下的空间。
+    """
+    if year > datetime.now().year:
+        raise ValueError("只能归档已经结束的年份")
+    first = db.scalar('SELECT MIN(ts) FROM transactions')
+    if first is None or time.gmtime(first).tm_year >= year:
+        return []
+    years = range(time.gmtime(first).tm_year, year)
+    results = []
+    for done, archive_year in enumerate(years, 1):
+        # 没有交易记录的年份不建归档文件
+        if db.fetchone('SELECT 1 FROM transactions WHERE ts >= ? AND ts < ? LIMIT 1',
+                       (year_start(archive_year), year_start(archive_year + 1))):
+            try:
+                results.append((archive_year, _archive_year(db, archive_year)))
+            finally:
+                # 一次归档多个年份时逐年分离，不会超过可以附加的数量
+                db.detach(schema_name(archive_year))
+        if progress is not None:
+            progress(done, len(years))
+    if vacuum:
+        db.execute('VACUUM main')
+    return results
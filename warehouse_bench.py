@@ -0,0 +1,411 @@
+"""性能基准测试
+
+用固定随机种子生成模拟的仓库数据（商品、经办人和日期的分布都有偏斜，
+接近实际使用情况），在不同数据规模下测量主要操作的耗时，
+结果写入 JSON 文件，便于比较不同版本之间的性能变化。
+
+示例：
+    python warehouse_bench.py run --scales 10k,1m --output bench_new.json
+    python warehouse_bench.py run --scales 10m --only stats,catalog
+    python warehouse_bench.py compare bench_old.json bench_new.json
+
+生成的数据库缓存在 --workdir 目录中，同样的规模和种子下次直接复用；
+会写数据库的测试在临时副本上运行，不改动缓存的数据库。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from warehouse_catalog import ProductCatalog
+from warehouse_db import (Database, SCHEMA_VERSION, SECONDS_PER_DAY, migrate,
+                          rebuild_daily_stats, timestamp)
+from warehouse_service import WarehouseService
+
+RESULT_FORMAT_VERSION = 1
+
+# 生成的数据截止到这一天（固定日期，保证同一种子每次生成的数据相同）
+GENERATE_END = datetime(2024, 12, 31)
+GENERATE_DAYS = 730
+GENERATE_CHUNK = 50000
+
+OPERATOR_COUNT = 40
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+GIVEN_NAMES = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚'
+CATEGORIES = ('五金', '电料', '劳保', '工具', '办公', '清洁', '包装', '化工')
+MATERIALS = ('不锈钢', '镀锌', '铜', '铝合金', '塑料', '橡胶', '尼龙', '碳钢')
+ITEMS = ('螺丝', '螺母', '垫片', '扳手', '钳子', '胶带', '手套', '电缆', '开关', '插座',
+         '灯管', '刷子', '纸箱', '水管', '阀门', '轴承', '链条', '钻头', '砂纸', '胶水')
+
+# 偏斜程度：越大越集中在少数商品/经办人上
+PRODUCT_SKEW = 1.1
+OPERATOR_SKEW = 1.3
+
+
+def parse_scale(text):
+    """'10k' / '1m' / '10m' / '5000' -> 交易记录行数"""
+    text = text.strip().lower()
+    factor = 1
+    if text.endswith('k'):
+        factor, text = 1000, text[:-1]
+    elif text.endswith('m'):
+        factor, text = 1000000, text[:-1]
+    return int(float(text) * factor)
+
+
+def _zipf_cum_weights(n, skew):
+    cum = []
+    total = 0.0
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** skew
+        cum.append(total)
+    return cum
+
+
+def _day_weights(days):
+    """按日的交易量权重：越近的日期越多，周末很少"""
+    weights = []
+    for day in range(days):
+        weight = 0.5 + day / days  # 业务量逐渐增长
+        if (GENERATE_END.toordinal() - days + 1 + day) % 7 in (6, 0):  # 周六、周日
+            weight *= 0.15
+        weights.append(weight)
+    return weights
+
+
+def generate(db, products, transactions, seed=0, progress=None):
+    """生成 products 个商品和大约 transactions 条交易记录
+
+    交易记录按时间顺序生成（ID 与时间一致），最终库存由交易记录汇总，
+    不会出现负库存。生成期间暂时删除交易记录表的触发器和索引，
+    插入完成后重新创建并重建按日汇总统计，全部在一个事务中完成。
+    """
+    rng = random.Random(seed)
+    migrate(db)
+
+    names = set()
+    product_rows = []
+    for product_id in range(1, products + 1):
+        while True:
+            name = f"{rng.choice(MATERIALS)}{rng.choice(ITEMS)}{rng.randint(1, 999)}号"
+            if name not in names:
+                break
+        names.add(name)
+        product_rows.append((product_id, name, 0, round(rng.uniform(0.5, 500), 2), rng.choice(CATEGORIES)))
+    # 商品的受欢迎程度与ID无关
+    popularity = list(range(1, products + 1))
+    rng.shuffle(popularity)
+    product_cum = _zipf_cum_weights(products, PRODUCT_SKEW)
+
+    operators = []
+    while len(operators) < OPERATOR_COUNT:
+        name = rng.choice(SURNAMES) + rng.choice(GIVEN_NAMES) + rng.choice(('', rng.choice(GIVEN_NAMES)))
+        if name not in operators:
+            operators.append(name)
+    operator_cum = _zipf_cum_weights(OPERATOR_COUNT, OPERATOR_SKEW)
+
+    day_weights = _day_weights(GENERATE_DAYS)
+    weight_total = sum(day_weights)
+    first_day = timestamp(GENERATE_END) - (GENERATE_DAYS - 1) * SECONDS_PER_DAY
+
+    with db.transaction('IMMEDIATE'):
+        saved = db.fetchall("""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name = 'transactions' AND type IN ('trigger', 'index') AND sql IS NOT NULL
+        """)
+        for kind, name, sql in saved:
+            db.execute(f'DROP {kind.upper()} {name}')
+
+        db.execute('DELETE FROM transactions')
+        db.execute('DELETE FROM products')
+        db.executemany('INSERT INTO products (id, name, quantity, price, category) VALUES (?, ?, ?, ?, ?)',
+                       product_rows)
+
+        stock = [0] * (products + 1)
+        batch = []
+        done = 0
+
+        def flush():
+            db.executemany('INSERT INTO transactions (product_id, type, quantity, operator, ts) VALUES (?, ?, ?, ?, ?)',
+                           batch)
+            batch.clear()
+
+        for day, weight in enumerate(day_weights):
+            count = int(transactions * weight / weight_total + rng.random())
+            if not count:
+                continue
+            day_ts = first_day + day * SECONDS_PER_DAY
+            # 工作时间 8:00 - 18:00
+            times = sorted(rng.randrange(8 * 3600, 18 * 3600) for _ in range(count))
+            picks = rng.choices(popularity, cum_weights=product_cum, k=count)
+            for seconds, product_id in zip(times, picks):
+                if rng.random() < 0.3:
+                    quantity = rng.randint(10, 200)
+                    row = (product_id, "入库", quantity, "", day_ts + seconds)
+                    stock[product_id] += quantity
+                else:
+                    quantity = rng.randint(1, 20)
+                    # 库存不够时先补一笔入库
+                    if stock[product_id] < quantity:
+                        refill = quantity + rng.randint(50, 200)
+                        batch.append((product_id, "入库", refill, "", day_ts + seconds))
+                        stock[product_id] += refill
+                    operator = operators[rng.choices(range(OPERATOR_COUNT), cum_weights=operator_cum)[0]]
+                    row = (product_id, "出库", quantity, operator, day_ts + seconds)
+                    stock[product_id] -= quantity
+                batch.append(row)
+                if len(batch) >= GENERATE_CHUNK:
+                    done += len(batch)
+                    flush()
+                    if progress is not None:
+                        progress(done, transactions)
+        if batch:
+            flush()
+
+        db.executemany('UPDATE products SET quantity = ? WHERE id = ?',
+                       ((stock[product_id], product_id) for product_id in range(1, products + 1)))
+
+        for kind, name, sql in saved:
+            db.execute(sql)
+        rebuild_daily_stats(db)
+        db.execute("UPDATE change_versions SET version = version + 1")
+    db.execute('ANALYZE')
+
+
+class Bench:
+    """计时：每个操作重复若干次，记录最短、中位数、平均和最长耗时"""
+
+    def __init__(self, scale, rows, only=None):
+        self.scale = scale
+        self.rows = rows
+        self.only = only
+        self.results = []
+
+    def enabled(self, name):
+        return not self.only or any(name.startswith(prefix) for prefix in self.only)
+
+    def run(self, name, func, repeat=5):
+        if not self.enabled(name):
+            return
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        result = {
+            'name': name,
+            'scale': self.scale,
+            'rows': self.rows,
+            'repeat': repeat,
+            'min_ms': round(min(timings), 3),
+            'median_ms': round(statistics.median(timings), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'max_ms': round(max(timings), 3),
+        }
+        self.results.append(result)
+        print(f"  {name:<32}{result['median_ms']:>12.2f} ms  (min {result['min_ms']:.2f})", flush=True)
+
+
+def run_benchmarks(db, bench, workdir, repeat=5):
+    service = WarehouseService(db)
+    rows = bench.rows
+
+    top_product = db.scalar("SELECT product_id FROM daily_stats WHERE type = '出库' "
+                            "GROUP BY product_id ORDER BY SUM(count) DESC LIMIT 1")
+    top_operator = db.scalar("SELECT operator FROM daily_stats WHERE type = '出库' "
+                             "GROUP BY operator ORDER BY SUM(count) DESC LIMIT 1")
+    year_start = f"{GENERATE_END.year}-01-01"
+    year_end = GENERATE_END.strftime('%Y-%m-%d')
+    month_start = f"{GENERATE_END.year}-{GENERATE_END.month:02d}-01"
+
+    # 商品列表（refresh_products）
+    bench.run('products.list', service.list_products, repeat)
+
+    # 交易记录（refresh_transactions：总数 + 第一页，以及滚动到很深的一页）
+    bench.run('transactions.first_page',
+              lambda: (service.count_transactions(), service.transactions_page()), repeat)
+    deep = service.transactions_page(None, min(rows // 2, 10000) or 1)
+    deep_key = (deep[-1][7], deep[-1][0]) if deep else None
+    bench.run('transactions.deep_page', lambda: service.transactions_page(deep_key), repeat)
+
+    # 出入库（add_transaction）：每次一笔入库和一笔出库（记录留在测试用的副本中）
+    def post():
+        service.post_transaction(top_product, "入库", 10, "", year_end)
+        service.post_transaction(top_product, "出库", 10, top_operator, year_end)
+    bench.run('transactions.post', post, repeat)
+
+    # 统计窗口：不使用缓存（每次新建业务对象）和命中缓存
+    bench.run('stats.product_all',
+              lambda: WarehouseService(db).product_outbound_stats(top_product), repeat)
+    bench.run('stats.product_year',
+              lambda: WarehouseService(db).product_outbound_stats(top_product, year_start, year_end), repeat)
+    bench.run('stats.operator_year',
+              lambda: WarehouseService(db).operator_stats(top_operator, year_start, year_end), repeat)
+    service.operator_stats(top_operator, year_start, year_end)
+    bench.run('stats.operator_year_cached',
+              lambda: service.operator_stats(top_operator, year_start, year_end), repeat)
+
+    # 历史库存（审计要的季末库存）：库存检查点在第一次查询时写入，不计入耗时
+    service.stock_as_of(year_end)
+    bench.run('stock.as_of_quarter', lambda: service.stock_as_of(f"{GENERATE_END.year}-09-30"), repeat)
+    bench.run('stock.as_of_last_year', lambda: service.stock_as_of(f"{GENERATE_END.year - 1}-06-30"), repeat)
+
+    # 商品名称自动补全
+    catalog = ProductCatalog(db)
+    catalog.load()
+    bench.run('catalog.load', catalog.load, repeat)
+    bench.run('catalog.search_prefix', lambda: catalog.search('不锈钢'), repeat)
+    bench.run('catalog.search_substring', lambda: catalog.search('螺丝'), repeat)
+    catalog.search('bxg')  # 首次按拼音搜索时生成拼音索引
+    bench.run('catalog.search_pinyin', lambda: catalog.search('bxg'), repeat)
+
+    # 导出（export_to_excel）：整表超过Excel行数上限时只导出最近一个月
+    path = os.path.join(workdir, 'bench_export')
+    month = {'start': month_start, 'end': year_end}
+    bench.run('export.products_xlsx', lambda: service.export('products', path + '.xlsx'), 1)
+    bench.run('export.month_xlsx', lambda: service.export('transactions', path + '.xlsx', month), 1)
+    if rows < 1000000:
+        bench.run('export.full_xlsx', lambda: service.export('transactions', path + '.xlsx'), 1)
+    bench.run('export.full_csv', lambda: service.export('transactions', path + '.csv'), 1)
+    for ext in ('.xlsx', '.csv'):
+        if os.path.exists(path + ext):
+            os.remove(path + ext)
+
+
+def environment():
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'schema_version': SCHEMA_VERSION,
+    }
+
+
+def working_copy(path, workdir):
+    """把缓存的数据库复制一份（用SQLite备份接口，WAL中的内容也一起复制），返回副本路径"""
+    fd, copy = tempfile.mkstemp(suffix='.db', prefix='bench_run_', dir=workdir)
+    os.close(fd)
+    source = sqlite3.connect(path)
+    target = sqlite3.connect(copy)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return copy
+
+
+def cmd_run(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    only = [name.strip() for name in args.only.split(',')] if args.only else None
+    output = {
+        'format': RESULT_FORMAT_VERSION,
+        'seed': args.seed,
+        'products': args.products,
+        'environment': environment(),
+        'results': [],
+    }
+    for scale in args.scales.split(','):
+        rows = parse_scale(scale)
+        path = os.path.join(args.workdir, f'bench_{scale}_{args.products}_{args.seed}_v{SCHEMA_VERSION}.db')
+        if args.regenerate:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        db = Database(path)
+        try:
+            migrate(db)
+            if not db.scalar('SELECT COUNT(*) FROM products'):
+                print(f"生成 {scale} 数据：{path}", flush=True)
+                start = time.perf_counter()
+                generate(db, args.products, rows, args.seed,
+                         lambda done, total: print(f"  {done}/{total}", end='\r', flush=True))
+                print(f"\n  生成用时 {time.perf_counter() - start:.1f} s", flush=True)
+            actual = db.scalar('SELECT COUNT(*) FROM transactions', default=0)
+        finally:
+            db.close()
+        print(f"规模 {scale}（{actual} 条交易记录）", flush=True)
+        # 出入库和库存检查点会写数据库，在副本上测试，缓存的数据库保持生成时的状态
+        copy = working_copy(path, args.workdir)
+        db = Database(copy)
+        try:
+            bench = Bench(scale, actual, only)
+            run_benchmarks(db, bench, args.workdir, args.repeat)
+            output['results'].extend(bench.results)
+        finally:
+            db.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(copy + suffix):
+                    os.remove(copy + suffix)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+    return 0
+
+
+def cmd_compare(args):
+    """按 (规模, 名称) 比较两次结果的中位数，变慢超过阈值时返回 1
+
+    很快的操作计时误差较大，只有变慢的绝对值超过 --min-ms 时才计入。
+    """
+    with open(args.old, encoding='utf-8') as f:
+        old = {(r['scale'], r['name']): r for r in json.load(f)['results']}
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)['results']
+    regressions = 0
+    print(f"{'规模':<8}{'操作':<32}{'旧(ms)':>12}{'新(ms)':>12}{'倍数':>8}")
+    for result in new:
+        before = old.get((result['scale'], result['name']))
+        if before is None:
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+        flag = ''
+        if ratio > args.threshold and result['median_ms'] - before['median_ms'] > args.min_ms:
+            flag = '  <-- 变慢'
+            regressions += 1
+        print(f"{result['scale']:<8}{result['name']:<32}{before['median_ms']:>12.2f}"
+              f"{result['median_ms']:>12.2f}{ratio:>8.2f}{flag}")
+    return 1 if regressions else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='warehouse_bench', description="仓库管理系统性能基准测试")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('run', help="生成数据并运行基准测试")
+    p.add_argument('--scales', default='10k', help="交易记录规模，逗号分隔，例如 10k,1m,10m")
+    p.add_argument('--products', type=int, default=5000, help="商品数")
+    p.add_argument('--seed', type=int, default=0, help="随机种子")
+    p.add_argument('--repeat', type=int, default=5, help="每个操作重复次数")
+    p.add_argument('--only', help="只运行名称以这些前缀开头的操作，逗号分隔，例如 stats,catalog")
+    p.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'warehouse_bench'),
+                   help="生成的数据库存放目录")
+    p.add_argument('--regenerate', action='store_true', help="重新生成数据")
+    p.add_argument('--output', default='bench_results.json', help="结果文件（JSON）")
+    p.set_defaults(func=cmd_run)
+
+    p = commands.add_parser('compare', help="比较两次基准测试结果")
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=1.2, help="中位数变慢超过该倍数时视为性能下降")
+    p.add_argument('--min-ms', type=float, default=0.5, help="变慢的绝对值小于该毫秒数时忽略")
+    p.set_defaults(func=cmd_compare)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
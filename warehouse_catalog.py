@@ -0,0 +1,228 @@
+"""商品目录缓存
+
+商品ID和名称的互查、下拉列表都从内存中读取，输入时不访问数据库。
+本程序写商品时直接修补缓存；其他终端的修改通过 PRAGMA data_version
+和 change_versions 表中的商品版本号发现，发现后整体重新加载。
+
+商品名称搜索依次匹配：名称前缀（有序列表二分查找）、名称中任意位置的
+子串（按字建立的倒排索引）、拼音首字母（需要安装 pypinyin，可选）。
+"""
+import bisect
+import heapq
+import threading
+
+# pypinyin 导入时要加载拼音词典，第一次按拼音搜索时才导入
+_pinyin = None
+
+
+def _load_pinyin():
+    """返回 (lazy_pinyin, Style)，没有安装 pypinyin 时返回 False"""
+    global _pinyin
+    if _pinyin is None:
+        try:
+            from pypinyin import lazy_pinyin, Style
+            _pinyin = (lazy_pinyin, Style)
+        except ImportError:
+            _pinyin = False
+    return _pinyin
+
+
+# 单字拼音首字母缓存：商品名称用到的汉字有限，逐字缓存比整句转换快得多
+_initial_cache = {}
+
+
+def pinyin_initials(name):
+    """返回名称的拼音首字母（小写），非汉字原样保留"""
+    lazy_pinyin, Style = _load_pinyin()
+    initials = []
+    for char in name:
+        initial = _initial_cache.get(char)
+        if initial is None:
+            initial = ''.join(lazy_pinyin(char, style=Style.FIRST_LETTER)).lower()
+            _initial_cache[char] = initial
+        initials.append(initial)
+    return ''.join(initials)
+
+
+class ProductCatalog:
+    def __init__(self, db):
+        self.db = db
+        self.id_to_name = {}
+        self.name_to_id = {}
+        self.ids = []  # 按ID排序
+        self.names = []  # 按名称排序
+        self.generation = 0  # 缓存内容每变化一次加一，界面据此判断是否需要更新下拉列表
+        self._char_index = {}  # 字 -> 包含该字的名称集合
+        self._initials = None  # 按拼音首字母排序的 (首字母, 名称) 列表，首次用到时生成
+        self._data_versions = {}  # 连接 -> 上次检查时的 PRAGMA data_version
+        self._products_version = None
+        self._id_strings = None
+        self._lock = threading.RLock()
+
+    def load(self):
+        """从数据库重新加载全部商品ID和名称
+
+        可以在工作线程中调用：先在锁外建好新的索引，再一次性替换。
+        """
+        conn = self.db.connection()
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        products_version = self._read_products_version()
+        rows = self.db.fetchall('SELECT id, name FROM products')
+        id_to_name = {product_id: name for product_id, name in rows}
+        name_to_id = {name: product_id for product_id, name in rows}
+        names = sorted(name_to_id)
+        char_index = {}
+        for name in names:
+            for char in set(name):
+                char_index.setdefault(char, set()).add(name)
+        with self._lock:
+            self._data_versions[id(conn)] = data_version
+            self._products_version = products_version
+            self.id_to_name = id_to_name
+            self.name_to_id = name_to_id
+            self.ids = sorted(id_to_name)
+            self.names = names
+            self._char_index = char_index
+            self._initials = None
+            self._changed()
+
+    def refresh(self):
+        """其他连接修改过商品时重新加载，返回是否重新加载
+
+        PRAGMA data_version 只在其他连接提交后变化，开销很小；
+        变化时再比较商品版本号，只有商品表本身变了才重新加载。
+        data_version 只能和同一连接上次的值比较，所以按连接分别记录。
+        """
+        conn = self.db.connection()
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if self._data_versions.get(id(conn)) == data_version:
+            return False
+        self._data_versions[id(conn)] = data_version
+        if self._products_version is not None and self._read_products_version() == self._products_version:
+            return False
+        self.load()
+        return True
+
+    def _read_products_version(self):
+        return self.db.scalar("SELECT version FROM change_versions WHERE name='products'", default=0)
+
+    def _changed(self):
+        self._id_strings = None
+        self.generation += 1
+
+    def name_of(self, product_id):
+        """根据商品ID返回名称，找不到时返回 None"""
+        try:
+            return self.id_to_name.get(int(product_id))
+        except (TypeError, ValueError):
+            return None
+
+    def id_of(self, name):
+        """根据商品名称返回ID，找不到时返回 None"""
+        return self.name_to_id.get(name)
+
+    def id_strings(self):
+        """按ID排序的商品ID字符串列表（用于下拉列表）"""
+        if self._id_strings is None:
+            self._id_strings = [str(product_id) for product_id in self.ids]
+        return self._id_strings
+
+    def put(self, product_id, name, old_id=None):
+        """新增或修改商品后更新缓存，old_id 为修改前的ID"""
+        with self._lock:
+            self._discard(product_id if old_id is None else old_id)
+            self._discard(product_id)
+            self.id_to_name[product_id] = name
+            self.name_to_id[name] = product_id
+            bisect.insort(self.ids, product_id)
+            bisect.insort(self.names, name)
+            self._index_name(name)
+            self._changed()
+
+    def remove(self, product_id):
+        """删除商品后更新缓存"""
+        with self._lock:
+            self._discard(product_id)
+            self._changed()
+
+    def _discard(self, product_id):
+        name = self.id_to_name.pop(product_id, None)
+        if name is None:
+            return
+        index = bisect.bisect_left(self.ids, product_id)
+        if index < len(self.ids) and self.ids[index] == product_id:
+            del self.ids[index]
+        if self.name_to_id.get(name) == product_id:
+            del self.name_to_id[name]
+            index = bisect.bisect_left(self.names, name)
+            if index < len(self.names) and self.names[index] == name:
+                del self.names[index]
+            self._unindex_name(name)
+
+    def _index_name(self, name):
+        for char in set(name):
+            self._char_index.setdefault(char, set()).add(name)
+        if self._initials is not None:
+            bisect.insort(self._initials, (pinyin_initials(name), name))
+
+    def _unindex_name(self, name):
+        for char in set(name):
+            names = self._char_index.get(char)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._char_index[char]
+        if self._initials is not None:
+            entry = (pinyin_initials(name), name)
+            index = bisect.bisect_left(self._initials, entry)
+            if index < len(self._initials) and self._initials[index] == entry:
+                del self._initials[index]
+
+    def search(self, text, limit=50):
+        """按输入内容搜索商品名称，最多返回 limit 个
+
+        先返回以输入内容开头的名称，再返回包含输入内容的名称，
+        输入为字母时最后返回拼音首字母匹配的名称。
+        """
+        text = text.strip()
+        if not text:
+            return self.names[:limit]
+        with self._lock:
+            results = []
+            seen = set()
+            
+            # 1. 名称前缀
+            index = bisect.bisect_left(self.names, text)
+            while index < len(self.names) and len(results) < limit:
+                name = self.names[index]
+                if not name.startswith(text):
+                    break
+                results.append(name)
+                seen.add(name)
+                index += 1
+            
+            # 2. 名称子串：取输入中每个字对应的名称集合的交集，再逐个确认
+            if len(results) < limit:
+                sets = [self._char_index.get(char, ()) for char in set(text)]
+                sets.sort(key=len)
+                candidates = set(sets[0]).intersection(*sets[1:]) if sets[0] else set()
+                matches = [name for name in candidates if name not in seen and text in name]
+                for name in heapq.nsmallest(limit - len(results), matches):
+                    results.append(name)
+                    seen.add(name)
+            
+            # 3. 拼音首字母前缀
+            if len(results) < limit and text.isascii() and text.isalpha() and _load_pinyin():
+                if self._initials is None:
+                    self._initials = sorted((pinyin_initials(name), name) for name in self.names)
+                key = text.lower()
+                index = bisect.bisect_left(self._initials, (key,))
+                while index < len(self._initials) and len(results) < limit:
+                    initials, name = self._initials[index]
+                    if not initials.startswith(key):
+                        break
+                    if name not in seen:
+                        results.append(name)
+                        seen.add(name)
+                    index += 1
+            return results
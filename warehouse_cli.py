@@ -0,0 +1,271 @@
+"""仓库管理系统命令行工具
+
+不需要图形界面，可以在服务器、计划任务或脚本中使用，
+与图形界面共用同一个数据库和同一套业务规则（warehouse_service）。
+
+示例：
+    python warehouse_cli.py stock
+    python warehouse_cli.py stock --as-of 2024-03-31
+    python warehouse_cli.py search 灯管
+    python warehouse_cli.py add-product 1001 螺丝 --price 0.5 --category 五金
+    python warehouse_cli.py post in 1001 100
+    python warehouse_cli.py post out 1001 20 --operator 张三 --date 2024-01-05
+    python warehouse_cli.py ledger --limit 50
+    python warehouse_cli.py ledger --product-id 1001 --start 2024-01-01 --end 2024-01-07 --type out
+    python warehouse_cli.py stats product 1001 --start 2024-01-01 --end 2024-12-31
+    python warehouse_cli.py stats operator 张三 --start 2024-01-01 --end 2024-12-31
+    python warehouse_cli.py export transactions 交易记录.xlsx
+    python warehouse_cli.py export transactions ledger.parquet --start 2024-01-01 --type out
+    python warehouse_cli.py import 入库单.csv
+    python warehouse_cli.py rebuild-stats
+    python warehouse_cli.py check-stock 2024-03-31
+    python warehouse_cli.py archive 2024
+    python warehouse_cli.py archives
+
+加 --json 时以 JSON 格式输出，便于其他程序读取。
+"""
+import argparse
+import json
+import sys
+
+from warehouse_db import Database, DatabaseBusyError, migrate
+from warehouse_import import write_error_report
+from warehouse_service import WarehouseService, WarehouseError, PRODUCT_SEARCH_LIMIT, TRANSACTION_PAGE_SIZE
+
+
+def _print_table(headers, rows):
+    print('\t'.join(headers))
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+
+def _output(args, headers, rows):
+    if args.json:
+        json.dump([dict(zip(headers, row)) for row in rows], sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        _print_table(headers, rows)
+
+
+def cmd_stock(service, args):
+    if args.as_of:
+        rows = service.stock_as_of(args.as_of)
+        if args.product_id is not None:
+            rows = [row for row in rows if row[0] == args.product_id]
+            if not rows:
+                raise WarehouseError("商品不存在")
+    elif args.product_id is not None:
+        row = service.get_product(args.product_id)
+        if row is None:
+            raise WarehouseError("商品不存在")
+        rows = [row]
+    else:
+        rows = service.list_products()
+    _output(args, ('id', 'name', 'quantity', 'price', 'category'), rows)
+
+
+def cmd_search(service, args):
+    rows = service.search_products(' '.join(args.text), args.limit)
+    _output(args, ('id', 'name', 'quantity', 'price', 'category'), rows)
+
+
+def cmd_add_product(service, args):
+    service.add_product(args.product_id, args.name.strip(), args.price, args.category)
+    print("商品添加成功")
+
+
+def cmd_post(service, args):
+    trans_type = "入库" if args.type == 'in' else "出库"
+    trans_id = service.post_transaction(args.product_id, trans_type, args.quantity,
+                                        args.operator, args.date)
+    if args.json:
+        print(json.dumps({'id': trans_id}))
+    else:
+        print(f"{trans_type}成功，交易ID：{trans_id}")
+
+
+def _transaction_filters(args):
+    return {'start': args.start, 'end': args.end, 'operator': args.operator,
+            'product_id': args.product_id,
+            'trans_type': {'in': "入库", 'out': "出库"}.get(args.type),
+            'min_quantity': args.min_quantity, 'max_quantity': args.max_quantity}
+
+
+def cmd_ledger(service, args):
+    rows = service.transactions_page(None, args.limit, _transaction_filters(args))
+    _output(args, ('id', 'product_id', 'name', 'type', 'quantity', 'operator', 'date', 'ts'), rows)
+
+
+def cmd_stats(service, args):
+    if args.kind == 'product':
+        try:
+            product_id = int(args.key)
+        except ValueError:
+            raise WarehouseError("商品ID必须为数字")
+        rows, total = service.product_outbound_stats(product_id, args.start, args.end)
+        headers = ('operator', 'quantity', 'count')
+    else:
+        if args.start is None or args.end is None:
+            raise WarehouseError("经办人统计需要指定 --start 和 --end")
+        rows, total = service.operator_stats(args.key, args.start, args.end)
+        headers = ('product_id', 'name', 'quantity', 'count')
+    total_quantity, total_count = total
+    if args.json:
+        json.dump({'rows': [dict(zip(headers, row)) for row in rows],
+                   'total_quantity': total_quantity or 0,
+                   'total_count': total_count},
+                  sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        _print_table(headers, rows)
+        print(f"总计：数量 {total_quantity or 0}，次数 {total_count}")
+
+
+def cmd_export(service, args):
+    filters = None
+    if args.table == 'transactions':
+        filters = _transaction_filters(args)
+    count = service.export(args.table, args.file, filters)
+    print(f"已导出 {count} 行到 {args.file}")
+
+
+def cmd_import(service, args):
+    result = service.import_transactions(args.file)
+    if result.errors:
+        if args.report:
+            write_error_report(result, args.report)
+        for line_no, message in sorted(result.errors):
+            print(f"第 {line_no} 行：{message}", file=sys.stderr)
+        raise WarehouseError(f"共 {result.total} 行，发现 {len(result.errors)} 处错误，未导入任何数据")
+    print(f"成功导入 {result.imported} 条出入库记录")
+
+
+def cmd_rebuild_stats(service, args):
+    count = service.rebuild_daily_stats()
+    print(f"已重新生成按日汇总统计，共 {count} 行")
+
+
+def cmd_check_stock(service, args):
+    mismatches = service.check_stock_as_of(args.dates)
+    if args.json or mismatches:
+        _output(args, ('date', 'product_id', 'as_of', 'replay'), mismatches)
+    if mismatches:
+        raise WarehouseError(f"发现 {len(mismatches)} 处历史库存与交易记录不一致")
+    if not args.json:
+        print("历史库存与交易记录一致")
+
+
+def cmd_archive(service, args):
+    results = service.archive_before(args.year)
+    if args.json:
+        print(json.dumps([{'year': year, 'rows': rows} for year, rows in results]))
+        return
+    if not results:
+        print(f"{args.year}年以前没有需要归档的交易记录")
+    for year, rows in results:
+        print(f"已归档 {year} 年的 {rows} 条交易记录")
+
+
+def cmd_archives(service, args):
+    _output(args, ('year', 'file', 'rows'), service.list_archives())
+
+
+def _add_filter_arguments(p):
+    p.add_argument('--start', help="交易记录的开始日期 YYYY-MM-DD")
+    p.add_argument('--end', help="交易记录的结束日期 YYYY-MM-DD")
+    p.add_argument('--type', choices=('in', 'out'), help="交易类型")
+    p.add_argument('--operator', help="经办人")
+    p.add_argument('--product-id', type=int, help="商品ID")
+    p.add_argument('--min-quantity', type=int, help="最小数量")
+    p.add_argument('--max-quantity', type=int, help="最大数量")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='warehouse_cli', description="仓库管理系统命令行工具")
+    parser.add_argument('--db', help="数据库文件路径（默认与图形界面相同）")
+    parser.add_argument('--json', action='store_true', help="以 JSON 格式输出")
+    parser.add_argument('--busy-timeout', type=int,
+                        help="其他终端正在写入时的最长等待时间（毫秒），默认 5000")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('stock', help="查看库存")
+    p.add_argument('product_id', type=int, nargs='?', help="只查看指定商品")
+    p.add_argument('--as-of', help="查看该日期（YYYY-MM-DD）结束时的库存")
+    p.set_defaults(func=cmd_stock)
+
+    p = commands.add_parser('search', help="按名称或类别搜索商品")
+    p.add_argument('text', nargs='+')
+    p.add_argument('--limit', type=int, default=PRODUCT_SEARCH_LIMIT)
+    p.set_defaults(func=cmd_search)
+
+    p = commands.add_parser('add-product', help="新增商品")
+    p.add_argument('product_id', type=int)
+    p.add_argument('name')
+    p.add_argument('--price', type=float)
+    p.add_argument('--category')
+    p.set_defaults(func=cmd_add_product)
+
+    p = commands.add_parser('post', help="入库或出库")
+    p.add_argument('type', choices=('in', 'out'))
+    p.add_argument('product_id', type=int)
+    p.add_argument('quantity', type=int)
+    p.add_argument('--operator', default='', help="经办人（出库时必填）")
+    p.add_argument('--date', help="日期 YYYY-MM-DD 或时间 YYYY-MM-DD HH:MM[:SS]，默认当前时间")
+    p.set_defaults(func=cmd_post)
+
+    p = commands.add_parser('ledger', help="查看最近的交易记录（可以筛选）")
+    p.add_argument('--limit', type=int, default=TRANSACTION_PAGE_SIZE)
+    _add_filter_arguments(p)
+    p.set_defaults(func=cmd_ledger)
+
+    p = commands.add_parser('stats', help="出库统计")
+    p.add_argument('kind', choices=('product', 'operator'))
+    p.add_argument('key', help="商品ID或经办人")
+    p.add_argument('--start', help="开始日期 YYYY-MM-DD")
+    p.add_argument('--end', help="结束日期 YYYY-MM-DD")
+    p.set_defaults(func=cmd_stats)
+
+    p = commands.add_parser('export', help="导出到Excel/CSV/Parquet/Feather（按扩展名）")
+    p.add_argument('table', choices=('products', 'transactions'))
+    p.add_argument('file')
+    _add_filter_arguments(p)
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser('import', help="从CSV或Excel批量导入出入库记录")
+    p.add_argument('file')
+    p.add_argument('--report', help="有错误时把错误报告写入该CSV文件")
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser('rebuild-stats', help="从交易记录重新生成按日汇总统计")
+    p.set_defaults(func=cmd_rebuild_stats)
+
+    p = commands.add_parser('check-stock', help="用逐笔累计的交易记录核对历史库存查询")
+    p.add_argument('dates', nargs='*', help="核对的日期 YYYY-MM-DD，默认核对每个库存检查点前后")
+    p.set_defaults(func=cmd_check_stock)
+
+    p = commands.add_parser('archive', help="把该年份以前（不含该年）的交易记录移到按年份的归档文件")
+    p.add_argument('year', type=int)
+    p.set_defaults(func=cmd_archive)
+
+    p = commands.add_parser('archives', help="查看已归档的年份")
+    p.set_defaults(func=cmd_archives)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    db = Database(args.db, busy_timeout=args.busy_timeout)
+    try:
+        migrate(db)
+        args.func(WarehouseService(db), args)
+    except (WarehouseError, ValueError, DatabaseBusyError) as e:
+        print(f"错误：{e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
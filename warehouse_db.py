@@ -0,0 +1,1043 @@
+"""仓库管理系统数据访问层
+
+所有数据库操作都通过 Database 对象进行：每个线程持有一个长连接，
+连接建立时统一设置 WAL 日志、同步级别、忙等待超时和语句缓存。
+
+多个终端共用一个数据库文件时，写事务一开始就取得写锁（BEGIN IMMEDIATE），
+其他终端正在写入时先按忙等待超时等待，仍然拿不到写锁时随机退避后重试几次，
+事务内的语句不会因为锁冲突而执行到一半失败。
+"""
+import calendar
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# 数据库文件名，默认放在程序所在目录，而不是当前工作目录
+DB_FILENAME = 'warehouse.db'
+
+# 可以通过环境变量指定数据库文件位置（例如共享盘上的路径）
+DB_PATH_ENV = 'WAREHOUSE_DB'
+
+# 忙等待超时（毫秒）和日志模式也可以通过环境变量设置。
+# WAL 模式要求所有终端在同一台电脑上访问数据库文件（共享内存），
+# 通过网络共享盘访问时请设置 WAREHOUSE_JOURNAL_MODE=DELETE
+BUSY_TIMEOUT_ENV = 'WAREHOUSE_BUSY_TIMEOUT'
+JOURNAL_MODE_ENV = 'WAREHOUSE_JOURNAL_MODE'
+BUSY_TIMEOUT = 5000
+JOURNAL_MODE = 'WAL'
+
+# 忙等待超时后拿不到写锁时的重试次数和第一次重试前的平均等待时间（秒），
+# 之后每次加倍，并随机浮动，避免多个终端同时重试再次冲突
+WRITE_RETRIES = 3
+WRITE_RETRY_DELAY = 0.05
+
+
+def default_db_path():
+    """返回默认的数据库路径"""
+    path = os.environ.get(DB_PATH_ENV)
+    if path:
+        return os.path.abspath(path)
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), DB_FILENAME)
+
+
+# 交易时间存为整数秒：本地时间直接按 UTC 换算（不做时区转换），
+# SQLite 中 datetime(ts, 'unixepoch') 得到的就是录入时的本地时间
+SECONDS_PER_DAY = 86400
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+# 交易时间的范围（1970-01-01 至 9999-12-31 23:59:59），与 transactions.ts 的 CHECK 约束一致
+MIN_TIMESTAMP = 0
+MAX_TIMESTAMP = 253402300799
+
+
+def timestamp(value):
+    """datetime（本地时间）转换为存储用的整数秒"""
+    return calendar.timegm(value.timetuple())
+
+
+def parse_timestamp(text):
+    """把 YYYY-MM-DD 或 YYYY-MM-DD HH:MM[:SS] 转换为整数秒
+
+    格式错误或早于 1970 年时抛出 ValueError。
+    """
+    text = text.strip()
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            value = timestamp(datetime.strptime(text, fmt))
+        except ValueError:
+            continue
+        if not MIN_TIMESTAMP <= value <= MAX_TIMESTAMP:
+            break
+        return value
+    raise ValueError(f"日期格式错误：{text}")
+
+
+class DatabaseBusyError(sqlite3.OperationalError):
+    """重试后仍然拿不到写锁"""
+
+
+def is_busy_error(error):
+    """是否为数据库被其他连接锁定的错误"""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+
+def day_range(start, end):
+    """YYYY-MM-DD 格式的起止日期（含当天）转换为 [开始秒, 结束秒) 区间"""
+    return parse_timestamp(start), parse_timestamp(end) + SECONDS_PER_DAY
+
+
+def month_start_day(year, month):
+    """某月1日的日序号（ts / 86400）"""
+    return timestamp(datetime(year, month, 1)) // SECONDS_PER_DAY
+
+
+class _TimedCursor:
+    """记录诊断信息的游标：耗时包括逐行读取的时间，读完或关闭时记录一次"""
+
+    def __init__(self, instrumentation, conn, sql, params, cursor, seconds):
+        self._instrumentation = instrumentation
+        self._conn = conn
+        self._sql = sql
+        self._params = params
+        self._cursor = cursor
+        self._seconds = seconds
+        self._rows = 0
+        self._site = instrumentation.call_site()
+        self._recorded = False
+
+    def _record(self):
+        if not self._recorded:
+            self._recorded = True
+            self._instrumentation.record_query(self._conn, self._sql, self._params, self._seconds, self._rows,
+                                               site=self._site)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._seconds += time.perf_counter() - start
+        if row is None:
+            self._record()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = size or self._cursor.arraysize
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(size)
+        self._seconds += time.perf_counter() - start
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._record()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._seconds += time.perf_counter() - start
+        self._rows += len(rows)
+        self._record()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._cursor.close()
+        self._record()
+
+    def __del__(self):
+        # 没有读完就丢弃的游标，记录已读取部分的耗时
+        self._record()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class Database:
+    """按线程复用连接的 SQLite 访问对象
+
+    主线程和每个工作线程各自持有一个连接（sqlite3 连接不能跨线程共享），
+    连接在首次使用时创建，直到 close() 才关闭。
+    """
+
+    def __init__(self, path=None, journal_mode=None, synchronous='NORMAL',
+                 busy_timeout=None, cache_size=-16000, cached_statements=256,
+                 instrumentation=None, write_retries=WRITE_RETRIES):
+        self.path = path or default_db_path()
+        if journal_mode is None:
+            journal_mode = os.environ.get(JOURNAL_MODE_ENV) or JOURNAL_MODE
+        if busy_timeout is None:
+            busy_timeout = int(os.environ.get(BUSY_TIMEOUT_ENV) or BUSY_TIMEOUT)
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout  # 毫秒
+        self.write_retries = write_retries
+        self.cache_size = cache_size  # 负数表示KB
+        self.cached_statements = cached_statements
+        # 可选的 warehouse_diagnostics.Instrumentation，记录每条语句的耗时
+        self.instrumentation = instrumentation
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _connect(self):
+        # isolation_level=None：由 transaction() 显式控制事务，
+        # 普通查询不会隐式开启事务而长时间占用读快照
+        conn = sqlite3.connect(self.path,
+                               timeout=self.busy_timeout / 1000,
+                               isolation_level=None,
+                               cached_statements=self.cached_statements)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        if self.journal_mode:
+            conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        if self.synchronous:
+            conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        if self.cache_size:
+            conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def connection(self):
+        """返回当前线程的连接，不存在时创建"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.attached = set()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def attach(self, name, path):
+        """在当前线程的连接上附加数据库文件，模式名为 name（已附加时不重复附加）
+
+        不能在事务中调用。
+        """
+        conn = self.connection()
+        if name in self._local.attached:
+            return
+        if conn.in_transaction:
+            raise RuntimeError("不能在事务中附加数据库")
+        conn.execute(f'ATTACH DATABASE ? AS {name}', (path,))
+        self._local.attached.add(name)
+
+    def detach(self, name):
+        """从当前线程的连接上分离附加的数据库（未附加时忽略），不能在事务中调用"""
+        conn = self.connection()
+        if name not in self._local.attached:
+            return
+        if conn.in_transaction:
+            raise RuntimeError("不能在事务中分离数据库")
+        conn.execute(f'DETACH DATABASE {name}')
+        self._local.attached.discard(name)
+
+    def attached(self):
+        """当前线程的连接上已附加的模式名"""
+        self.connection()
+        return set(self._local.attached)
+
+    def execute(self, sql, params=()):
+        if self.instrumentation is None:
+            return self.connection().execute(sql, params)
+        conn = self.connection()
+        start = time.perf_counter()
+        cursor = conn.execute(sql, params)
+        seconds = time.perf_counter() - start
+        if cursor.description is not None:
+            # 返回行的语句：调用方逐块读取，读完时才记录耗时和行数
+            return _TimedCursor(self.instrumentation, conn, sql, params, cursor, seconds)
+        self.instrumentation.record_query(conn, sql, params, seconds, cursor.rowcount)
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        if self.instrumentation is None:
+            return self.connection().executemany(sql, seq_of_params)
+        conn = self.connection()
+        start = time.perf_counter()
+        cursor = conn.executemany(sql, seq_of_params)
+        self.instrumentation.record_query(conn, sql, None, time.perf_counter() - start, cursor.rowcount,
+                                          many=True)
+        return cursor
+
+    def fetchone(self, sql, params=()):
+        if self.instrumentation is None:
+            return self.connection().execute(sql, params).fetchone()
+        conn = self.connection()
+        start = time.perf_counter()
+        row = conn.execute(sql, params).fetchone()
+        self.instrumentation.record_query(conn, sql, params, time.perf_counter() - start,
+                                          0 if row is None else 1)
+        return row
+
+    def fetchall(self, sql, params=()):
+        if self.instrumentation is None:
+            return self.connection().execute(sql, params).fetchall()
+        conn = self.connection()
+        start = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        self.instrumentation.record_query(conn, sql, params, time.perf_counter() - start, len(rows))
+        return rows
+
+    def scalar(self, sql, params=(), default=None):
+        """返回第一行第一列，没有结果时返回 default"""
+        row = self.fetchone(sql, params)
+        if row is None or row[0] is None:
+            return default
+        return row[0]
+
+    @contextmanager
+    def transaction(self, mode='DEFERRED'):
+        """事务上下文：正常退出时提交，出现异常时回滚
+
+        mode 可以是 DEFERRED / IMMEDIATE / EXCLUSIVE。
+        已经处于事务中时直接复用外层事务。
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        self._begin(conn, mode)
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            if self.instrumentation is None:
+                conn.commit()
+            else:
+                # 提交时写日志文件，耗时可能较长，单独记录
+                start = time.perf_counter()
+                conn.commit()
+                self.instrumentation.record_query(conn, 'COMMIT', None, time.perf_counter() - start, 0,
+                                                  many=True)
+
+    def _begin(self, conn, mode):
+        """开始事务，拿不到写锁时随机退避后重试
+
+        只重试 BEGIN 本身：这时事务中还没有执行任何语句，重试是安全的。
+        """
+        for attempt in range(self.write_retries + 1):
+            try:
+                conn.execute(f'BEGIN {mode}')
+                return
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e):
+                    raise
+                if attempt == self.write_retries:
+                    raise DatabaseBusyError("数据库正忙：其他终端正在写入，请稍后重试") from e
+            time.sleep(WRITE_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def close(self):
+        """关闭所有线程创建的连接"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # 其他线程创建的连接只能在其所属线程关闭
+                pass
+        self._local = threading.local()
+
+
+# 按日汇总统计表的维护语句（用于触发器），商品ID为空的交易记录不计入。
+# day 为 ts 所在的日序号（ts / 86400）
+DAILY_STATS_ADD_NEW = '''
+            INSERT INTO daily_stats (product_id, type, day, operator, quantity, count)
+            SELECT NEW.product_id, NEW.type, NEW.ts / 86400, NEW.operator, NEW.quantity, 1
+            WHERE NEW.product_id IS NOT NULL
+            ON CONFLICT (product_id, type, day, operator) DO UPDATE
+            SET quantity = quantity + excluded.quantity, count = count + 1;
+'''
+
+DAILY_STATS_REMOVE_OLD = '''
+            UPDATE daily_stats SET quantity = quantity - OLD.quantity, count = count - 1
+            WHERE product_id = OLD.product_id AND type = OLD.type
+                AND day = OLD.ts / 86400 AND operator = OLD.operator;
+            DELETE FROM daily_stats
+            WHERE product_id = OLD.product_id AND type = OLD.type
+                AND day = OLD.ts / 86400 AND operator = OLD.operator AND count <= 0;
+'''
+
+# 从交易记录重新生成按日汇总统计（升级旧数据库或重建统计时使用）
+DAILY_STATS_BACKFILL = '''
+INSERT INTO daily_stats (product_id, type, day, operator, quantity, count)
+SELECT product_id, type, ts / 86400, operator, SUM(quantity), COUNT(*)
+FROM transactions
+WHERE product_id IS NOT NULL
+GROUP BY product_id, type, ts / 86400, operator
+'''
+
+# 商品全文索引的维护语句（用于触发器），外部内容表删除索引时要提供原来的内容
+PRODUCT_SEARCH_ADD_NEW = '''
+            INSERT INTO products_fts (rowid, name, category) VALUES (NEW.id, NEW.name, NEW.category);
+            INSERT INTO products_trigram (rowid, name, category) VALUES (NEW.id, NEW.name, NEW.category);
+'''
+
+PRODUCT_SEARCH_REMOVE_OLD = '''
+            INSERT INTO products_fts (products_fts, rowid, name, category)
+            VALUES ('delete', OLD.id, OLD.name, OLD.category);
+            INSERT INTO products_trigram (products_trigram, rowid, name, category)
+            VALUES ('delete', OLD.id, OLD.name, OLD.category);
+'''
+
+# 删除 products_fts（迁移 12）后只维护 trigram 索引
+PRODUCT_TRIGRAM_ADD_NEW = '''
+            INSERT INTO products_trigram (rowid, name, category) VALUES (NEW.id, NEW.name, NEW.category);
+'''
+
+PRODUCT_TRIGRAM_REMOVE_OLD = '''
+            INSERT INTO products_trigram (products_trigram, rowid, name, category)
+            VALUES ('delete', OLD.id, OLD.name, OLD.category);
+'''
+
+# 商品名称和类别（小写）中从每个位置开始的两个字，最后一个位置只有一个字。
+# 两个字的词按整个片段查找，一个字的词按片段的第一个字（范围）查找
+PRODUCT_NGRAMS_ADD_NEW = '''
+            INSERT OR IGNORE INTO products_ngrams (gram, product_id)
+            WITH RECURSIVE chars (text, i) AS (
+                SELECT text, 1 FROM (SELECT lower(NEW.name) AS text UNION ALL SELECT lower(NEW.category))
+                WHERE text <> ''
+                UNION ALL
+                SELECT text, i + 1 FROM chars WHERE i < length(text)
+            )
+            SELECT substr(text, i, 2), NEW.id FROM chars;
+'''
+
+PRODUCT_NGRAMS_REMOVE_OLD = '''
+            DELETE FROM products_ngrams WHERE product_id = OLD.id;
+'''
+
+# 按日汇总中一行对库存的影响：入库为正，出库为负
+STOCK_DELTA = "CASE type WHEN '入库' THEN quantity WHEN '出库' THEN -quantity ELSE 0 END"
+
+# 库存检查点的维护语句（用于 daily_stats 的触发器）：补录或修改以前的交易记录时，
+# 修正该商品在这一天之后的检查点，检查点始终等于交易记录的累计结果
+STOCK_CHECKPOINTS_ADD_NEW = '''
+            UPDATE stock_checkpoints
+            SET quantity = quantity + CASE NEW.type WHEN '入库' THEN NEW.quantity WHEN '出库' THEN -NEW.quantity ELSE 0 END
+            WHERE product_id = NEW.product_id AND day > NEW.day;
+'''
+
+STOCK_CHECKPOINTS_REMOVE_OLD = '''
+            UPDATE stock_checkpoints
+            SET quantity = quantity - CASE OLD.type WHEN '入库' THEN OLD.quantity WHEN '出库' THEN -OLD.quantity ELSE 0 END
+            WHERE product_id = OLD.product_id AND day > OLD.day;
+'''
+
+# 迁移 13 起的维护语句。检查点行是按日期连续的：商品在某个检查点有行后，之后的检查点
+# 都有行（write_stock_checkpoints 从上个月的检查点累计）。商品还没有行的检查点
+# （例如第一笔交易记录是补录的）视为 0，只 UPDATE 会漏掉，所以先修正已有的行，
+# 再为这一天之后、该商品第一个检查点之前的检查点日期插入新行
+STOCK_CHECKPOINTS_UPSERT_NEW = '''
+            UPDATE stock_checkpoints
+            SET quantity = quantity + CASE NEW.type WHEN '入库' THEN NEW.quantity WHEN '出库' THEN -NEW.quantity ELSE 0 END
+            WHERE product_id = NEW.product_id AND day > NEW.day;
+            INSERT INTO stock_checkpoints (product_id, day, quantity)
+            SELECT DISTINCT NEW.product_id, day,
+                   CASE NEW.type WHEN '入库' THEN NEW.quantity WHEN '出库' THEN -NEW.quantity ELSE 0 END
+            FROM stock_checkpoints
+            WHERE NEW.product_id IS NOT NULL AND day > NEW.day
+              AND day < IFNULL((SELECT MIN(day) FROM stock_checkpoints WHERE product_id = NEW.product_id), 1 << 62);
+'''
+
+STOCK_CHECKPOINTS_UPSERT_OLD = '''
+            UPDATE stock_checkpoints
+            SET quantity = quantity - CASE OLD.type WHEN '入库' THEN OLD.quantity WHEN '出库' THEN -OLD.quantity ELSE 0 END
+            WHERE product_id = OLD.product_id AND day > OLD.day;
+            INSERT INTO stock_checkpoints (product_id, day, quantity)
+            SELECT DISTINCT OLD.product_id, day,
+                   -CASE OLD.type WHEN '入库' THEN OLD.quantity WHEN '出库' THEN -OLD.quantity ELSE 0 END
+            FROM stock_checkpoints
+            WHERE OLD.product_id IS NOT NULL AND day > OLD.day
+              AND day < IFNULL((SELECT MIN(day) FROM stock_checkpoints WHERE product_id = OLD.product_id), 1 << 62);
+'''
+
+# 旧版本中手工输入的日期文本可能使用的格式
+LEGACY_DATE_FORMATS = TIMESTAMP_FORMATS + ('%Y/%m/%d', '%Y.%m.%d', '%Y%m%d', '%Y/%m/%d %H:%M:%S')
+
+
+def _legacy_date_ts(text):
+    """旧数据的日期文本转换为整数秒，无法识别或超出范围的日期（例如把 2020 误输成 0202）
+    记为 0（1970-01-01），便于查找和更正"""
+    if text is None:
+        return 0
+    text = str(text).strip()
+    for fmt in LEGACY_DATE_FORMATS:
+        try:
+            value = timestamp(datetime.strptime(text, fmt))
+        except ValueError:
+            continue
+        return value if MIN_TIMESTAMP <= value <= MAX_TIMESTAMP else 0
+    return 0
+
+
+def _register_legacy_date_function(db):
+    db.connection().create_function('legacy_date_ts', 1, _legacy_date_ts, deterministic=True)
+
+
+# 数据库结构迁移：按版本号顺序执行，当前版本记录在 PRAGMA user_version 中。
+# 已发布的迁移不要修改，新的结构变更追加到列表末尾。
+MIGRATIONS = [
+    (1, '创建商品表和交易记录表', [
+        '''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL,
+            category TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER,
+            type TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            operator TEXT NOT NULL,
+            date TEXT NOT NULL,
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+        ''',
+    ]),
+    (2, '为统计查询和列表排序添加索引', [
+        # 商品出库统计：按商品+类型+日期过滤，按经办人汇总数量（覆盖索引）
+        '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_product_type_date
+        ON transactions (product_id, type, date, operator, quantity)
+        ''',
+        # 经办人统计：按经办人+类型+日期过滤，按商品汇总数量（覆盖索引）
+        '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_operator_type_date
+        ON transactions (operator, type, date, product_id, quantity)
+        ''',
+        # 交易记录按日期排序
+        'CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date)',
+        # 商品名称与ID互查
+        'CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)',
+    ]),
+    (3, '添加变更版本号表，用于发现其他终端对商品目录的修改', [
+        '''
+        CREATE TABLE IF NOT EXISTS change_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "INSERT OR IGNORE INTO change_versions (name, version) VALUES ('products', 0)",
+        # 只有ID和名称的变化影响商品目录，库存数量的变化不计入
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_version_insert AFTER INSERT ON products
+        BEGIN
+            UPDATE change_versions SET version = version + 1 WHERE name = 'products';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_version_update AFTER UPDATE OF id, name ON products
+        BEGIN
+            UPDATE change_versions SET version = version + 1 WHERE name = 'products';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_version_delete AFTER DELETE ON products
+        BEGIN
+            UPDATE change_versions SET version = version + 1 WHERE name = 'products';
+        END
+        ''',
+    ]),
+    (4, '添加按日汇总的出入库统计表，由触发器随交易记录自动更新', [
+        # 统计窗口按 商品+类型+日期 或 经办人+类型+日期 查询，
+        # 一年的统计只需读取几千行汇总数据，而不是几百万条交易记录
+        '''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            product_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            date TEXT NOT NULL,
+            operator TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (product_id, type, date, operator)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_daily_stats_operator_type_date
+        ON daily_stats (operator, type, date, product_id, quantity, count)
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_daily_stats_insert AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO daily_stats (product_id, type, date, operator, quantity, count)
+            SELECT NEW.product_id, NEW.type, NEW.date, NEW.operator, NEW.quantity, 1
+            WHERE NEW.product_id IS NOT NULL
+            ON CONFLICT (product_id, type, date, operator) DO UPDATE
+            SET quantity = quantity + excluded.quantity, count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_daily_stats_delete AFTER DELETE ON transactions
+        BEGIN
+            UPDATE daily_stats SET quantity = quantity - OLD.quantity, count = count - 1
+            WHERE product_id = OLD.product_id AND type = OLD.type
+                AND date = OLD.date AND operator = OLD.operator;
+            DELETE FROM daily_stats
+            WHERE product_id = OLD.product_id AND type = OLD.type
+                AND date = OLD.date AND operator = OLD.operator AND count <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_daily_stats_update
+        AFTER UPDATE OF product_id, type, quantity, operator, date ON transactions
+        BEGIN
+            UPDATE daily_stats SET quantity = quantity - OLD.quantity, count = count - 1
+            WHERE product_id = OLD.product_id AND type = OLD.type
+                AND date = OLD.date AND operator = OLD.operator;
+            DELETE FROM daily_stats
+            WHERE product_id = OLD.product_id AND type = OLD.type
+                AND date = OLD.date AND operator = OLD.operator AND count <= 0;
+            INSERT INTO daily_stats (product_id, type, date, operator, quantity, count)
+            SELECT NEW.product_id, NEW.type, NEW.date, NEW.operator, NEW.quantity, 1
+            WHERE NEW.product_id IS NOT NULL
+            ON CONFLICT (product_id, type, date, operator) DO UPDATE
+            SET quantity = quantity + excluded.quantity, count = count + 1;
+        END
+        ''',
+        '''
+        INSERT INTO daily_stats (product_id, type, date, operator, quantity, count)
+        SELECT product_id, type, date, operator, SUM(quantity), COUNT(*)
+        FROM transactions
+        WHERE product_id IS NOT NULL
+        GROUP BY product_id, type, date, operator
+        ''',
+    ]),
+    (5, '交易记录变更版本号，用于判断统计结果缓存是否过期', [
+        "INSERT OR IGNORE INTO change_versions (name, version) VALUES ('transactions', 0)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_version_insert AFTER INSERT ON transactions
+        BEGIN
+            UPDATE change_versions SET version = version + 1 WHERE name = 'transactions';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_version_update AFTER UPDATE ON transactions
+        BEGIN
+            UPDATE change_versions SET version = version + 1 WHERE name = 'transactions';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_version_delete AFTER DELETE ON transactions
+        BEGIN
+            UPDATE change_versions SET version = version + 1 WHERE name = 'transactions';
+        END
+        ''',
+    ]),
+    (6, '交易日期改为带时间的整数秒（ts），日期文本改为由 ts 生成的列', [
+        _register_legacy_date_function,
+        # ts 有范围检查，date 只用于显示；范围查询和排序都使用 ts
+        '''
+        CREATE TABLE transactions_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER,
+            type TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            operator TEXT NOT NULL,
+            ts INTEGER NOT NULL CHECK (typeof(ts) = 'integer' AND ts BETWEEN 0 AND 253402300799),
+            date TEXT GENERATED ALWAYS AS (strftime('%Y-%m-%d', ts, 'unixepoch')) VIRTUAL,
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+        ''',
+        '''
+        INSERT INTO transactions_new (id, product_id, type, quantity, operator, ts)
+        SELECT id, product_id, type, quantity, operator, legacy_date_ts(date)
+        FROM transactions
+        ''',
+        # 保留自增序号，已删除记录的ID不会被重新使用
+        '''
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'transactions_new', seq FROM sqlite_sequence
+        WHERE name = 'transactions'
+            AND NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'transactions_new')
+        ''',
+        '''
+        UPDATE sqlite_sequence
+        SET seq = MAX(seq, IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'transactions'), 0))
+        WHERE name = 'transactions_new'
+        ''',
+        # 删除旧表时它的索引和触发器一并删除，下面重新创建
+        'DROP TABLE transactions',
+        'ALTER TABLE transactions_new RENAME TO transactions',
+        '''
+        CREATE INDEX idx_transactions_product_type_ts
+        ON transactions (product_id, type, ts, operator, quantity)
+        ''',
+        '''
+        CREATE INDEX idx_transactions_operator_type_ts
+        ON transactions (operator, type, ts, product_id, quantity)
+        ''',
+        # 交易记录按 (ts, id) 排序（索引中隐含 id）
+        'CREATE INDEX idx_transactions_ts ON transactions (ts)',
+        '''
+        CREATE TRIGGER trg_transactions_version_insert AFTER INSERT ON transactions
+        BEGIN
+            UPDATE change_versions SET version = version + 1 WHERE name = 'transactions';
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_transactions_version_update AFTER UPDATE ON transactions
+        BEGIN
+            UPDATE change_versions SET version = version + 1 WHERE name = 'transactions';
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_transactions_version_delete AFTER DELETE ON transactions
+        BEGIN
+            UPDATE change_versions SET version = version + 1 WHERE name = 'transactions';
+        END
+        ''',
+        "UPDATE change_versions SET version = version + 1 WHERE name = 'transactions'",
+        # 按日汇总统计改为按日序号，重新生成
+        'DROP TABLE daily_stats',
+        '''
+        CREATE TABLE daily_stats (
+            product_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            operator TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (product_id, type, day, operator)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE INDEX idx_daily_stats_operator_type_day
+        ON daily_stats (operator, type, day, product_id, quantity, count)
+        ''',
+        '''
+        CREATE TRIGGER trg_daily_stats_insert AFTER INSERT ON transactions
+        BEGIN
+            ''' + DAILY_STATS_ADD_NEW + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_daily_stats_delete AFTER DELETE ON transactions
+        BEGIN
+            ''' + DAILY_STATS_REMOVE_OLD + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_daily_stats_update
+        AFTER UPDATE OF product_id, type, quantity, operator, ts ON transactions
+        BEGIN
+            ''' + DAILY_STATS_REMOVE_OLD + DAILY_STATS_ADD_NEW + '''
+        END
+        ''',
+        DAILY_STATS_BACKFILL,
+    ]),
+    # 统计改用 daily_stats 后，交易记录的索引只用于列表筛选和导出：
+    # 按商品或经办人筛选时直接按 (ts, id) 倒序读取，不需要再排序
+    (7, '按商品、经办人加时间建索引，用于交易记录筛选', [
+        'DROP INDEX IF EXISTS idx_transactions_product_type_ts',
+        'DROP INDEX IF EXISTS idx_transactions_operator_type_ts',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_product_ts ON transactions (product_id, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_operator_ts ON transactions (operator, ts)',
+    ]),
+    # 两个全文索引都只保存索引，内容从 products 表读取（外部内容表）：
+    # products_fts 按词切分，支持一两个字的前缀查询；products_trigram 按连续三个字切分，
+    # 支持名称中任意位置的子串（包括中文）。只在ID、名称、类别变化时更新，
+    # 出入库修改数量时不触发。
+    (8, '添加商品名称和类别的全文索引', [
+        '''
+        CREATE VIRTUAL TABLE products_fts USING fts5(
+            name, category, content='products', content_rowid='id', prefix='1 2'
+        )
+        ''',
+        '''
+        CREATE VIRTUAL TABLE products_trigram USING fts5(
+            name, category, content='products', content_rowid='id', tokenize='trigram'
+        )
+        ''',
+        '''
+        CREATE TRIGGER trg_products_fts_insert AFTER INSERT ON products
+        BEGIN
+            ''' + PRODUCT_SEARCH_ADD_NEW + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_products_fts_delete AFTER DELETE ON products
+        BEGIN
+            ''' + PRODUCT_SEARCH_REMOVE_OLD + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_products_fts_update AFTER UPDATE OF id, name, category ON products
+        BEGIN
+            ''' + PRODUCT_SEARCH_REMOVE_OLD + PRODUCT_SEARCH_ADD_NEW + '''
+        END
+        ''',
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')",
+        "INSERT INTO products_trigram (products_trigram) VALUES ('rebuild')",
+    ]),
+    # 每月1日0点的库存检查点：day 之前全部交易记录的累计结果。
+    # 检查点由 write_stock_checkpoints 按月批量写入，之后由触发器随按日汇总修正
+    (9, '添加按月的库存检查点，用于查询历史日期的库存', [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_daily_stats_day
+        ON daily_stats (day, product_id, type, quantity)
+        ''',
+        '''
+        CREATE TABLE stock_checkpoints (
+            product_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (product_id, day)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE INDEX idx_stock_checkpoints_day
+        ON stock_checkpoints (day, product_id, quantity)
+        ''',
+        '''
+        CREATE TRIGGER trg_stock_checkpoints_insert AFTER INSERT ON daily_stats
+        BEGIN
+            ''' + STOCK_CHECKPOINTS_ADD_NEW + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_stock_checkpoints_delete AFTER DELETE ON daily_stats
+        BEGIN
+            ''' + STOCK_CHECKPOINTS_REMOVE_OLD + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_stock_checkpoints_update AFTER UPDATE ON daily_stats
+        BEGIN
+            ''' + STOCK_CHECKPOINTS_REMOVE_OLD + STOCK_CHECKPOINTS_ADD_NEW + '''
+        END
+        ''',
+    ]),
+    # 已归档年份的登记表，见 warehouse_archive
+    (10, '添加交易记录归档文件的登记表', [
+        '''
+        CREATE TABLE archives (
+            year INTEGER PRIMARY KEY,
+            filename TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            archived_at INTEGER NOT NULL
+        )
+        ''',
+    ]),
+    # 商品的版本号：修改商品信息时加一，用于检查编辑期间是否已被其他终端修改
+    # （出入库只改数量，不改版本号）
+    (11, '商品添加版本号，用于多终端编辑时的冲突检查', [
+        'ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+    ]),
+    # unicode61 分词把连续的中文当作一个词，products_fts 只能匹配词的开头，
+    # “螺丝”查不到“不锈钢螺丝M6”。一两个字的词改为直接按子串查找商品表，
+    # products_fts 不再使用，删除后商品的增删改只需维护 trigram 索引
+    (12, '删除按词切分的商品全文索引，只保留 trigram 索引', [
+        'DROP TRIGGER IF EXISTS trg_products_fts_insert',
+        'DROP TRIGGER IF EXISTS trg_products_fts_delete',
+        'DROP TRIGGER IF EXISTS trg_products_fts_update',
+        'DROP TABLE IF EXISTS products_fts',
+        '''
+        CREATE TRIGGER trg_products_fts_insert AFTER INSERT ON products
+        BEGIN
+            ''' + PRODUCT_TRIGRAM_ADD_NEW + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_products_fts_delete AFTER DELETE ON products
+        BEGIN
+            ''' + PRODUCT_TRIGRAM_REMOVE_OLD + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_products_fts_update AFTER UPDATE OF id, name, category ON products
+        BEGIN
+            ''' + PRODUCT_TRIGRAM_REMOVE_OLD + PRODUCT_TRIGRAM_ADD_NEW + '''
+        END
+        ''',
+    ]),
+    # 旧触发器可能已经漏改了检查点，清空后由 write_stock_checkpoints 从按日汇总重新生成
+    (13, '库存检查点触发器改为插入或累加，补录商品的第一笔交易记录时也能修正检查点', [
+        'DROP TRIGGER IF EXISTS trg_stock_checkpoints_insert',
+        'DROP TRIGGER IF EXISTS trg_stock_checkpoints_delete',
+        'DROP TRIGGER IF EXISTS trg_stock_checkpoints_update',
+        '''
+        CREATE TRIGGER trg_stock_checkpoints_insert AFTER INSERT ON daily_stats
+        BEGIN
+            ''' + STOCK_CHECKPOINTS_UPSERT_NEW + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_stock_checkpoints_delete AFTER DELETE ON daily_stats
+        BEGIN
+            ''' + STOCK_CHECKPOINTS_UPSERT_OLD + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_stock_checkpoints_update AFTER UPDATE ON daily_stats
+        BEGIN
+            ''' + STOCK_CHECKPOINTS_UPSERT_OLD + STOCK_CHECKPOINTS_UPSERT_NEW + '''
+        END
+        ''',
+        'DELETE FROM stock_checkpoints',
+    ]),
+    # trigram 索引只能查三个字以上的子串，一两个字的词原来按 LIKE 扫描整个商品表。
+    # 改为查两字片段表（按片段建主键），和 trigram 索引一样只在ID、名称、类别变化时更新
+    (14, '添加商品名称和类别的两字片段索引，用于一两个字的词的查找', [
+        '''
+        CREATE TABLE products_ngrams (
+            gram TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            PRIMARY KEY (gram, product_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER trg_products_ngrams_insert AFTER INSERT ON products
+        BEGIN
+            ''' + PRODUCT_NGRAMS_ADD_NEW + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_products_ngrams_delete AFTER DELETE ON products
+        BEGIN
+            ''' + PRODUCT_NGRAMS_REMOVE_OLD + '''
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_products_ngrams_update AFTER UPDATE OF id, name, category ON products
+        BEGIN
+            ''' + PRODUCT_NGRAMS_REMOVE_OLD + PRODUCT_NGRAMS_ADD_NEW + '''
+        END
+        ''',
+        '''
+        INSERT OR IGNORE INTO products_ngrams (gram, product_id)
+        WITH RECURSIVE chars (product_id, text, i) AS (
+            SELECT id, text, 1 FROM (
+                SELECT id, lower(name) AS text FROM products
+                UNION ALL
+                SELECT id, lower(category) FROM products
+            )
+            WHERE text <> ''
+            UNION ALL
+            SELECT product_id, text, i + 1 FROM chars WHERE i < length(text)
+        )
+        SELECT substr(text, i, 2), product_id FROM chars
+        ''',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def rebuild_daily_stats(db):
+    """清空并从交易记录重新生成按日汇总统计，返回汇总行数
+
+    库存检查点一并清空，下次查询历史库存时重新生成。
+    """
+    with db.transaction('IMMEDIATE'):
+        db.execute('DELETE FROM stock_checkpoints')
+        db.execute('DELETE FROM daily_stats')
+        db.execute(DAILY_STATS_BACKFILL)
+        return db.scalar('SELECT COUNT(*) FROM daily_stats', default=0)
+
+
+def write_stock_checkpoints(db, until=None):
+    """补写从最早的交易记录到 until（默认今天）之间每月1日的库存检查点，返回写入的月数
+
+    每个月的检查点由上个月的检查点加上这个月的按日汇总得到，每次只读一个月的数据。
+    已经写好的月份不重复计算。
+    """
+    until = until or datetime.now()
+    last_day = month_start_day(until.year, until.month)
+    # 先在读事务中判断是否需要补写，已是最新时不占用写锁
+    previous = db.scalar('SELECT MAX(day) FROM stock_checkpoints')
+    if previous is not None and previous >= last_day:
+        return 0
+    written = 0
+    with db.transaction('IMMEDIATE'):
+        previous = db.scalar('SELECT MAX(day) FROM stock_checkpoints')
+        start = previous if previous is not None else db.scalar('SELECT MIN(day) FROM daily_stats')
+        if start is None:
+            return 0
+        start = time.gmtime(start * SECONDS_PER_DAY)
+        year, month = start.tm_year, start.tm_mon
+        while True:
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            day = month_start_day(year, month)
+            if day > last_day:
+                break
+            if previous is None:
+                db.execute(f'''
+                INSERT INTO stock_checkpoints (product_id, day, quantity)
+                SELECT product_id, ?, SUM({STOCK_DELTA})
+                FROM daily_stats
+                WHERE day < ?
+                GROUP BY product_id
+                ''', (day, day))
+            else:
+                db.execute(f'''
+                INSERT INTO stock_checkpoints (product_id, day, quantity)
+                SELECT product_id, ?, SUM(quantity)
+                FROM (
+                    SELECT product_id, quantity FROM stock_checkpoints WHERE day = ?
+                    UNION ALL
+                    SELECT product_id, {STOCK_DELTA} FROM daily_stats WHERE day >= ? AND day < ?
+                )
+                GROUP BY product_id
+                ''', (day, previous, previous, day))
+            previous = day
+            written += 1
+    return written
+
+
+def schema_version(db):
+    return db.scalar('PRAGMA user_version', default=0)
+
+
+def migrate(db):
+    """把数据库升级到最新结构，返回本次执行的迁移版本列表
+
+    每个迁移在独立的事务中执行，并在同一事务内更新 user_version，
+    中途失败时数据库保持在上一个完整版本。
+    """
+    applied = []
+    current = schema_version(db)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"数据库版本({current})高于程序支持的版本({SCHEMA_VERSION})，请升级程序")
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        with db.transaction('IMMEDIATE'):
+            # 其他终端可能已经完成了同一迁移
+            if schema_version(db) >= version:
+                continue
+            for sql in statements:
+                # 语句也可以是函数（例如注册迁移中用到的 SQL 函数）
+                if callable(sql):
+                    sql(db)
+                else:
+                    db.execute(sql)
+            db.execute(f'PRAGMA user_version = {version}')
+        applied.append(version)
+    if applied:
+        # 新建索引后更新统计信息（限制采样行数，大表也能很快完成）
+        db.execute('PRAGMA analysis_limit = 1000')
+        db.execute('ANALYZE')
+    return applied
@@ -0,0 +1,239 @@
+"""运行诊断：SQL 语句和界面回调的耗时统计
+
+每条 SQL 语句（按语句文本归类）记录执行次数、耗时、返回/修改的行数和
+调用位置，返回行的语句从执行到读完最后一行计时；每个 Tk 回调（按钮、按键、定时器等）记录执行时间。
+超过阈值的慢查询连同 EXPLAIN QUERY PLAN 一起记入慢查询日志。
+
+每次记录只有两次计时和几次字典操作，百分位数在查看时才计算，
+可以在正式使用时一直开启。设置环境变量 WAREHOUSE_DIAGNOSTICS=0 可以关闭。
+"""
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+DIAGNOSTICS_ENV = 'WAREHOUSE_DIAGNOSTICS'
+SLOW_QUERY_ENV = 'WAREHOUSE_SLOW_QUERY_MS'
+
+# 默认的慢查询阈值（毫秒）
+SLOW_QUERY_MS = 100
+
+# 每条语句/每个回调保留最近多少次耗时，用于计算百分位数
+SAMPLE_SIZE = 512
+
+# 慢查询日志保留的条数
+SLOW_LOG_SIZE = 200
+
+# 查找调用位置时跳过的文件（数据访问层本身和 with 语句）
+_SKIP_FILES = {'warehouse_db.py', 'warehouse_diagnostics.py', 'contextlib.py'}
+
+
+def diagnostics_enabled():
+    return os.environ.get(DIAGNOSTICS_ENV, '1') not in ('0', 'false', 'no', 'off')
+
+
+def percentile(sorted_values, fraction):
+    """已排序列表的百分位数（最近秩法：第 ceil(fraction * n) 个值）"""
+    if not sorted_values:
+        return 0.0
+    # 先舍去浮点误差，例如 0.07 * 100 = 7.000000000000001
+    rank = math.ceil(round(fraction * len(sorted_values), 9))
+    return sorted_values[min(len(sorted_values) - 1, max(0, rank - 1))]
+
+
+# 代码对象所在的文件名 -> 不含目录的文件名（跳过的文件为 None）
+_basenames = {}
+
+# (代码对象, 行号) -> 调用位置文本
+_sites = {}
+
+
+def _call_site():
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        name = _basenames.get(filename, '')
+        if name == '':
+            name = os.path.basename(filename)
+            name = _basenames[filename] = None if name in _SKIP_FILES else name
+        if name is not None:
+            break
+        frame = frame.f_back
+    if frame is None:
+        return '?'
+    key = (frame.f_code, frame.f_lineno)
+    site = _sites.get(key)
+    if site is None:
+        site = _sites[key] = f"{name}:{frame.f_lineno} {frame.f_code.co_name}"
+    return site
+
+
+def callback_name(func):
+    """回调的显示名称：方法名，匿名函数附带所在位置"""
+    func = getattr(func, '__func__', func)
+    name = getattr(func, '__qualname__', None)
+    if name is None:
+        return repr(func)
+    code = getattr(func, '__code__', None)
+    if '<lambda>' in name and code is not None:
+        name = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return name
+
+
+class _Stat:
+    __slots__ = ('count', 'total', 'max', 'rows', 'samples', 'sites')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+        self.sites = {}
+
+    def add(self, seconds, rows=0, site=None):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if rows > 0:
+            self.rows += rows
+        self.samples.append(seconds)
+        if site is not None:
+            self.sites[site] = self.sites.get(site, 0) + 1
+
+    def summary(self, name):
+        samples = sorted(self.samples)
+        sites = sorted(self.sites.items(), key=lambda item: -item[1])
+        return {
+            'name': name,
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'max_ms': self.max * 1000,
+            'rows': self.rows,
+            'sites': [site for site, count in sites],
+        }
+
+
+class Instrumentation:
+    """收集 SQL 语句和界面回调的耗时，可以在多个线程中同时记录"""
+
+    def __init__(self, slow_query_ms=None):
+        if slow_query_ms is None:
+            slow_query_ms = float(os.environ.get(SLOW_QUERY_ENV, SLOW_QUERY_MS))
+        self.slow_query_seconds = slow_query_ms / 1000
+        self._queries = {}
+        self._callbacks = {}
+        self._slow_log = deque(maxlen=SLOW_LOG_SIZE)
+        self._plans = {}  # 语句 -> 查询计划文本，每条语句只分析一次
+        self._normalized = {}  # 原始语句文本 -> 去掉多余空白后的文本
+        self._lock = threading.Lock()
+
+    def _normalize(self, sql):
+        text = self._normalized.get(sql)
+        if text is None:
+            text = ' '.join(sql.split())
+            self._normalized[sql] = text
+        return text
+
+    def call_site(self):
+        """调用数据访问层的位置（文件:行号 函数）"""
+        return _call_site()
+
+    def record_query(self, conn, sql, params, seconds, rows, many=False, site=None):
+        """记录一次语句执行，超过阈值时记入慢查询日志
+
+        site 为 None 时取当前的调用位置；游标读完时才记录的语句传入执行时的位置。
+        """
+        text = self._normalize(sql)
+        if site is None:
+            site = _call_site()
+        with self._lock:
+            stat = self._queries.get(text)
+            if stat is None:
+                stat = self._queries[text] = _Stat()
+            stat.add(seconds, rows, site)
+        if seconds >= self.slow_query_seconds:
+            plan = self._plans.get(text)
+            if plan is None and not many:
+                plan = self._plans[text] = self._explain(conn, sql, params)
+            self._slow_log.append({
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'ms': seconds * 1000,
+                'sql': text,
+                'params': repr(params)[:200],
+                'rows': rows,
+                'site': site,
+                'thread': threading.current_thread().name,
+                'plan': plan or '',
+            })
+
+    @staticmethod
+    def _explain(conn, sql, params):
+        """取得语句的查询计划，按层级缩进"""
+        try:
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        except Exception as e:
+            return f"（无法取得查询计划：{e}）"
+        depth = {0: -1}
+        lines = []
+        for node_id, parent, unused, detail in rows:
+            depth[node_id] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node_id] + detail)
+        return '\n'.join(lines)
+
+    def record_callback(self, func, seconds):
+        name = callback_name(func)
+        with self._lock:
+            stat = self._callbacks.get(name)
+            if stat is None:
+                stat = self._callbacks[name] = _Stat()
+            stat.add(seconds)
+
+    def query_summary(self):
+        """按总耗时从高到低排列的语句统计"""
+        with self._lock:
+            items = [stat.summary(name) for name, stat in self._queries.items()]
+        return sorted(items, key=lambda item: -item['total_ms'])
+
+    def callback_summary(self):
+        """按总耗时从高到低排列的回调统计"""
+        with self._lock:
+            items = [stat.summary(name) for name, stat in self._callbacks.items()]
+        return sorted(items, key=lambda item: -item['total_ms'])
+
+    def slow_queries(self):
+        """慢查询日志，最新的在前"""
+        return list(reversed(self._slow_log))
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self._callbacks.clear()
+            self._slow_log.clear()
+
+    def install_tk(self):
+        """给之后注册的所有 Tk 回调加上计时（替换 tkinter.CallWrapper）"""
+        import tkinter
+
+        instrumentation = self
+        base = tkinter.CallWrapper
+        if getattr(base, '_instrumented', False):
+            base = base.__bases__[0]
+
+        class TimedCallWrapper(base):
+            _instrumented = True
+
+            def __call__(self, *args):
+                start = time.perf_counter()
+                try:
+                    return super().__call__(*args)
+                finally:
+                    instrumentation.record_callback(self.func, time.perf_counter() - start)
+
+        tkinter.CallWrapper = TimedCallWrapper
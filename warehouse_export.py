@@ -0,0 +1,315 @@
+"""导出商品列表和交易记录
+
+按块读取查询结果，边读边写，不把整张表读进内存：
+- Excel：写入 openpyxl 的只写（write-only）工作簿，不需要写完后重新打开文件调整格式；
+  Excel 每个工作表最多约 104 万行，更多的记录请导出为 CSV 或 Parquet
+- CSV：UTF-8 带BOM，Excel 可以直接打开
+- Parquet / Feather：列式格式，便于数据分析工具读取，需要安装 pyarrow
+
+交易记录可以按日期范围、类型、经办人和商品筛选；日期范围涉及已归档的年份时
+依次读取主数据库和各个归档文件（见 warehouse_archive）。
+"""
+import csv
+import os
+
+from warehouse_archive import MAIN_SCHEMA, attach_ledger
+from warehouse_db import SECONDS_PER_DAY, parse_timestamp
+
+# 每次从游标读取的行数
+EXPORT_CHUNK_SIZE = 5000
+
+# 列式格式每批的行数（Parquet 的每个行组），太小会降低压缩率和读取速度
+COLUMNAR_CHUNK_SIZE = 100000
+
+# 按前多少行的内容估算列宽（只写工作簿必须在写入数据前设置列宽）
+COLUMN_WIDTH_SAMPLE = EXPORT_CHUNK_SIZE
+MAX_COLUMN_WIDTH = 60
+
+# Excel 工作表的最大行数（含表头）
+XLSX_MAX_ROWS = 1048576
+
+# 文件扩展名 -> 导出格式
+EXPORT_FORMATS = {
+    '.xlsx': 'xlsx',
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+}
+
+# 导出类型 -> (列（表头, 列式格式的类型）, 查询, 排序)，筛选条件插在查询和排序之间，
+# {schema} 为交易记录所在的数据库（主数据库或归档文件）
+EXPORT_QUERIES = {
+    'products': (
+        (('商品ID', 'int64'), ('商品名称', 'string'), ('数量', 'int64'),
+         ('价格', 'float64'), ('类别', 'string')),
+        '''
+        SELECT id, name, quantity, price, category
+        FROM products
+        ''',
+        'ORDER BY id',
+    ),
+    'transactions': (
+        (('交易ID', 'int64'), ('商品ID', 'int64'), ('商品名称', 'string'), ('类型', 'string'),
+         ('数量', 'int64'), ('经办人', 'string'), ('时间', 'string')),
+        '''
+        SELECT t.id, t.product_id, p.name, t.type, t.quantity, t.operator,
+               datetime(t.ts, 'unixepoch')
+        FROM {schema}.transactions t
+        LEFT JOIN products p ON t.product_id = p.id
+        ''',
+        'ORDER BY t.ts DESC, t.id DESC',
+    ),
+}
+
+
+def transactions_where(start=None, end=None, trans_type=None, operator=None, product_id=None,
+                       min_quantity=None, max_quantity=None):
+    """交易记录的筛选条件，返回 (WHERE 子句, 参数)，没有条件时子句为空字符串
+
+    日期为 YYYY-MM-DD，包含起止日期当天，按 ts 做范围查询；
+    数量范围包含上下限。
+    """
+    conditions = []
+    params = []
+    if start:
+        conditions.append('t.ts >= ?')
+        params.append(parse_timestamp(start))
+    if end:
+        conditions.append('t.ts < ?')
+        params.append(parse_timestamp(end) + SECONDS_PER_DAY)
+    if trans_type:
+        conditions.append('t.type = ?')
+        params.append(trans_type)
+    if operator:
+        conditions.append('t.operator = ?')
+        params.append(operator)
+    if product_id is not None:
+        conditions.append('t.product_id = ?')
+        params.append(product_id)
+    if min_quantity is not None:
+        conditions.append('t.quantity >= ?')
+        params.append(min_quantity)
+    if max_quantity is not None:
+        conditions.append('t.quantity <= ?')
+        params.append(max_quantity)
+    if not conditions:
+        return '', ()
+    return 'WHERE ' + ' AND '.join(conditions), tuple(params)
+
+
+def export_query(table_type, filters=None, schemas=(MAIN_SCHEMA,)):
+    """返回 (列, [(查询, 统计行数的查询, 参数)])
+
+    交易记录每个数据来源（schemas，从新到旧）一组查询，按顺序读取即为整体的顺序。
+    """
+    if table_type not in EXPORT_QUERIES:
+        raise ValueError(f"未知的导出类型：{table_type}")
+    columns, select_sql, order_sql = EXPORT_QUERIES[table_type]
+    where, params = '', ()
+    if filters:
+        if table_type != 'transactions':
+            raise ValueError("只有交易记录可以筛选")
+        where, params = transactions_where(**filters)
+    if table_type == 'products':
+        return columns, [(f'{select_sql} {order_sql}', 'SELECT COUNT(*) FROM products', ())]
+    return columns, [(f'{select_sql.format(schema=schema)} {where} {order_sql}',
+                      f'SELECT COUNT(*) FROM {schema}.transactions t {where}',
+                      params)
+                     for schema in schemas]
+
+
+def export_schemas(db, table_type, filters=None):
+    """导出涉及的数据来源，附加需要的归档文件"""
+    if table_type != 'transactions':
+        return [MAIN_SCHEMA]
+    filters = filters or {}
+    start_ts = parse_timestamp(filters['start']) if filters.get('start') else None
+    end_ts = parse_timestamp(filters['end']) + SECONDS_PER_DAY if filters.get('end') else None
+    return attach_ledger(db, start_ts, end_ts)
+
+
+def _count(db, queries):
+    return sum(db.scalar(count_sql, params, default=0) for sql, count_sql, params in queries)
+
+
+def export_format(path):
+    """按文件扩展名判断导出格式"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXPORT_FORMATS:
+        raise ValueError("只支持导出为 Excel(.xlsx)、CSV(.csv)、Parquet(.parquet) 或 Feather(.feather) 文件")
+    return EXPORT_FORMATS[ext]
+
+
+def _text_width(value):
+    """单元格内容的显示宽度，汉字按两个字符计算"""
+    if value is None:
+        return 0
+    text = str(value)
+    return len(text) + sum(1 for char in text if ord(char) > 0x2e80)
+
+
+def iter_chunks(cursor, size=EXPORT_CHUNK_SIZE):
+    """按块读取游标中的行"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+
+def iter_query_chunks(db, queries, size=EXPORT_CHUNK_SIZE):
+    """依次执行各个数据来源的查询，按块读取"""
+    for sql, count_sql, params in queries:
+        yield from iter_chunks(db.execute(sql, params), size)
+
+
+def _remove_partial(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _discard_sheet(ws):
+    """中止导出时关闭只写工作表并删除它的临时文件"""
+    try:
+        ws.close()
+        os.remove(ws._writer.out)
+    except Exception:
+        pass
+
+
+def export_xlsx(db, table_type, path, filters=None, progress=None):
+    """导出到Excel文件，返回导出的行数
+
+    progress(已完成, 总数) 用于报告进度，可以抛出异常中止导出，
+    中止或出错时删除写了一半的文件。
+    """
+    columns, queries = export_query(table_type, filters, export_schemas(db, table_type, filters))
+    total = _count(db, queries)
+    if total >= XLSX_MAX_ROWS:
+        raise ValueError(f"共 {total} 行，超过Excel的最大行数，请导出为CSV或Parquet文件")
+
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font
+    from openpyxl.utils import get_column_letter
+
+    headers = [header for header, kind in columns]
+    done = 0
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('数据')
+    try:
+        chunks = iter_query_chunks(db, queries)
+        first = next(chunks, [])
+
+        # 列宽按表头和第一块数据估算
+        widths = [_text_width(header) for header in headers]
+        for row in first[:COLUMN_WIDTH_SAMPLE]:
+            for i, value in enumerate(row):
+                width = _text_width(value)
+                if width > widths[i]:
+                    widths[i] = width
+        for i, width in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(i)].width = min(width + 2, MAX_COLUMN_WIDTH)
+
+        # 标题行加粗居中
+        font = Font(bold=True)
+        alignment = Alignment(horizontal="center")
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.font = font
+            cell.alignment = alignment
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        rows = first
+        while rows:
+            for row in rows:
+                ws.append(row)
+            done += len(rows)
+            if progress is not None:
+                progress(done, max(total, done))
+            rows = next(chunks, None)
+
+        wb.save(path)
+    except BaseException:
+        _discard_sheet(ws)
+        _remove_partial(path)
+        raise
+    return done
+
+
+def export_csv(db, table_type, path, filters=None, progress=None):
+    """导出到CSV文件（UTF-8 带BOM），返回导出的行数，参数同 export_xlsx"""
+    columns, queries = export_query(table_type, filters, export_schemas(db, table_type, filters))
+    total = _count(db, queries) if progress is not None else 0
+    done = 0
+    try:
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow([header for header, kind in columns])
+            for rows in iter_query_chunks(db, queries):
+                writer.writerows(rows)
+                done += len(rows)
+                if progress is not None:
+                    progress(done, max(total, done))
+    except BaseException:
+        _remove_partial(path)
+        raise
+    return done
+
+
+def export_columnar(db, table_type, path, fmt='parquet', filters=None, progress=None):
+    """导出到 Parquet 或 Feather 文件（需要 pyarrow），返回导出的行数，参数同 export_xlsx
+
+    每块数据写成一个记录批次（Parquet 的一个行组），内存占用与总行数无关。
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ValueError("导出Parquet/Feather文件需要安装pyarrow：pip install pyarrow")
+
+    columns, queries = export_query(table_type, filters, export_schemas(db, table_type, filters))
+    schema = pa.schema([(header, getattr(pa, kind)()) for header, kind in columns])
+    total = _count(db, queries) if progress is not None else 0
+    done = 0
+    writer = None
+    try:
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(path, schema, compression='zstd')
+        else:
+            import pyarrow.ipc as ipc
+            writer = ipc.new_file(path, schema, options=ipc.IpcWriteOptions(compression='zstd'))
+        for rows in iter_query_chunks(db, queries, COLUMNAR_CHUNK_SIZE):
+            arrays = [pa.array(values, type=field.type)
+                      for values, field in zip(zip(*rows), schema)]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            done += len(rows)
+            if progress is not None:
+                progress(done, max(total, done))
+        writer.close()
+        writer = None
+    except BaseException:
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+        _remove_partial(path)
+        raise
+    return done
+
+
+def export_table(db, table_type, path, filters=None, progress=None):
+    """按文件扩展名选择格式导出，返回导出的行数
+
+    filters 为 transactions_where 的参数（只对交易记录有效）。
+    """
+    fmt = export_format(path)
+    if fmt == 'xlsx':
+        return export_xlsx(db, table_type, path, filters, progress)
+    if fmt == 'csv':
+        return export_csv(db, table_type, path, filters, progress)
+    return export_columnar(db, table_type, path, fmt, filters, progress)
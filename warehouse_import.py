@@ -0,0 +1,255 @@
+"""批量导入出入库记录
+
+从 CSV 或 Excel 文件读取入库单/领料单，整批校验后在一个写事务中导入：
+交易记录用 executemany 批量插入，库存按商品汇总后一次性更新。
+任意一行有错误时不导入任何数据，并给出逐行的错误报告，
+修改后可以直接重新导入整份文件而不会重复记账。
+"""
+import csv
+import os
+from datetime import datetime, date
+
+from warehouse_archive import archive_cutoff
+from warehouse_db import parse_timestamp, timestamp
+
+# 表头别名 -> 字段名
+HEADER_ALIASES = {
+    '商品ID': 'product_id', 'ID': 'product_id', 'id': 'product_id', 'product_id': 'product_id',
+    '商品名称': 'name', '名称': 'name', 'name': 'name', 'product_name': 'name',
+    '类型': 'type', 'type': 'type',
+    '数量': 'quantity', 'quantity': 'quantity', 'qty': 'quantity',
+    '经办人': 'operator', 'operator': 'operator',
+    '日期': 'date', 'date': 'date',
+}
+
+# 类型别名 -> 交易类型
+TYPE_ALIASES = {
+    '入库': '入库', 'in': '入库', 'inbound': '入库',
+    '出库': '出库', 'out': '出库', 'outbound': '出库',
+}
+
+# 每处理多少行报告一次进度
+PROGRESS_STEP = 1000
+
+
+class ImportResult:
+    def __init__(self):
+        self.total = 0  # 文件中的数据行数
+        self.imported = 0  # 成功导入的行数
+        self.errors = []  # (行号, 错误信息)
+
+    def add_error(self, line_no, message):
+        self.errors.append((line_no, message))
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        if value.time() != datetime.min.time():
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _read_csv(path):
+    # Excel 另存的 CSV 可能是 UTF-8（带BOM）也可能是 GBK
+    for encoding in ('utf-8-sig', 'gbk'):
+        try:
+            with open(path, newline='', encoding=encoding) as f:
+                return list(csv.reader(f))
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("无法识别CSV文件编码，请另存为UTF-8格式")
+
+
+def _read_xlsx(path):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return [list(row) for row in wb.active.iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+
+def read_rows(path):
+    """读取文件，返回 [(行号, {字段名: 文本})]，行号从表头之后的第2行开始"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        raw = _read_csv(path)
+    elif ext in ('.xlsx', '.xlsm'):
+        raw = _read_xlsx(path)
+    else:
+        raise ValueError("只支持CSV和Excel(.xlsx)文件")
+    if not raw:
+        raise ValueError("文件为空")
+
+    fields = [HEADER_ALIASES.get(_cell_text(header), HEADER_ALIASES.get(_cell_text(header).lower()))
+              for header in raw[0]]
+    if 'product_id' not in fields and 'name' not in fields:
+        raise ValueError("缺少商品ID或商品名称列")
+    for required, title in (('type', '类型'), ('quantity', '数量')):
+        if required not in fields:
+            raise ValueError(f"缺少{title}列")
+
+    rows = []
+    for line_no, values in enumerate(raw[1:], 2):
+        texts = [_cell_text(value) for value in values]
+        # 跳过空行
+        if not any(texts):
+            continue
+        record = {}
+        for field, text in zip(fields, texts):
+            if field:
+                record[field] = text
+        rows.append((line_no, record))
+    return rows
+
+
+def validate_rows(db, rows, result, progress=None):
+    """按商品目录校验所有行，返回可以导入的 (行号, product_id, type, quantity, operator, ts) 列表"""
+    id_to_name = dict(db.fetchall('SELECT id, name FROM products'))
+    name_to_id = {name: product_id for product_id, name in id_to_name.items()}
+    now = timestamp(datetime.now())
+    # 已归档的年份不能再导入
+    cutoff = archive_cutoff(db)
+
+    records = []
+    for count, (line_no, row) in enumerate(rows, 1):
+        if progress is not None and count % PROGRESS_STEP == 0:
+            progress(count, len(rows))
+
+        # 商品：优先按ID，没有ID时按名称；两者都有时必须一致
+        product_id = None
+        id_text = row.get('product_id', '')
+        name = row.get('name', '')
+        if id_text:
+            if not id_text.isdecimal() or int(id_text) not in id_to_name:
+                result.add_error(line_no, f"商品ID不存在：{id_text}")
+                continue
+            product_id = int(id_text)
+            if name and id_to_name[product_id] != name:
+                result.add_error(line_no, f"商品ID {id_text} 与名称“{name}”不一致")
+                continue
+        elif name:
+            product_id = name_to_id.get(name)
+            if product_id is None:
+                result.add_error(line_no, f"商品名称不存在：{name}")
+                continue
+        else:
+            result.add_error(line_no, "缺少商品ID或商品名称")
+            continue
+
+        trans_type = TYPE_ALIASES.get(row.get('type', '').lower())
+        if trans_type is None:
+            result.add_error(line_no, f"类型只能是入库或出库：{row.get('type', '')}")
+            continue
+
+        try:
+            quantity = int(row.get('quantity', ''))
+        except ValueError:
+            result.add_error(line_no, f"数量必须是整数：{row.get('quantity', '')}")
+            continue
+        if quantity <= 0:
+            result.add_error(line_no, "数量必须大于0")
+            continue
+
+        operator = row.get('operator', '')
+        if trans_type == "出库" and not operator:
+            result.add_error(line_no, "出库时请输入经办人")
+            continue
+
+        # 没有日期时取当前时间，只有日期时取当天 0 点
+        trans_date = row.get('date', '')
+        if trans_date:
+            try:
+                ts = parse_timestamp(trans_date)
+            except ValueError:
+                result.add_error(line_no, f"日期格式错误，请使用格式：YYYY-MM-DD：{trans_date}")
+                continue
+        else:
+            ts = now
+        if cutoff is not None and ts < cutoff:
+            result.add_error(line_no, f"该日期所在的年份已归档，不能再导入：{trans_date}")
+            continue
+
+        records.append((line_no, product_id, trans_type, quantity, operator, ts))
+    return records
+
+
+def apply_records(db, records, result):
+    """在一个写事务中导入已校验的记录，库存不足时整批回滚并返回 False"""
+    # 按商品汇总库存变化量
+    deltas = {}
+    for line_no, product_id, trans_type, quantity, operator, ts in records:
+        delta = quantity if trans_type == "入库" else -quantity
+        deltas[product_id] = deltas.get(product_id, 0) + delta
+
+    with db.transaction('IMMEDIATE'):
+        db.execute('CREATE TEMP TABLE IF NOT EXISTS import_deltas (product_id INTEGER PRIMARY KEY, delta INTEGER NOT NULL)')
+        db.execute('DELETE FROM temp.import_deltas')
+        db.executemany('INSERT INTO temp.import_deltas (product_id, delta) VALUES (?, ?)', deltas.items())
+
+        # 在写锁内检查库存，保证和其他终端的出库不冲突
+        shortages = db.fetchall('''
+        SELECT p.id, p.quantity, d.delta
+        FROM temp.import_deltas d
+        JOIN products p ON p.id = d.product_id
+        WHERE p.quantity + d.delta < 0
+        ''')
+        if shortages:
+            first_line = {}
+            for line_no, product_id, trans_type, quantity, operator, ts in records:
+                if trans_type == "出库":
+                    first_line.setdefault(product_id, line_no)
+            for product_id, current, delta in shortages:
+                result.add_error(first_line.get(product_id, 0),
+                                 f"商品 {product_id} 库存不足（当前库存 {current}，导入后为 {current + delta}）")
+            db.execute('DELETE FROM temp.import_deltas')
+            return False
+
+        db.executemany('''
+        INSERT INTO transactions (product_id, type, quantity, operator, ts)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (record[1:] for record in records))
+
+        # 按商品一次性更新库存
+        db.execute('''
+        UPDATE products
+        SET quantity = quantity + (SELECT delta FROM temp.import_deltas d WHERE d.product_id = products.id)
+        WHERE id IN (SELECT product_id FROM temp.import_deltas)
+        ''')
+        db.execute('DELETE FROM temp.import_deltas')
+
+    result.imported = len(records)
+    return True
+
+
+def import_transactions(db, path, progress=None):
+    """从文件导入出入库记录，返回 ImportResult
+
+    progress(已完成, 总数) 用于报告进度，可以抛出异常中止导入。
+    """
+    result = ImportResult()
+    rows = read_rows(path)
+    result.total = len(rows)
+    records = validate_rows(db, rows, result, progress)
+    if result.errors or not records:
+        return result
+    if progress is not None:
+        progress(len(rows), len(rows))
+    apply_records(db, records, result)
+    return result
+
+
+def write_error_report(result, path):
+    """把错误逐行写入 CSV 文件（UTF-8 带BOM，Excel 可以直接打开）"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['行号', '错误'])
+        writer.writerows(sorted(result.errors))
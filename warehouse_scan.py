@@ -0,0 +1,96 @@
+"""扫码枪输入
+
+键盘式扫码枪把条码当作键盘输入：在很短的时间内连续“按键”，最后按回车。
+按相邻两次按键的间隔区分扫码和手工输入：扫码枪的字符间隔通常只有几毫秒，
+人手输入一般在 50 毫秒以上。扫码时只记录按键时间，回车后才查找商品
+（在内存中的商品目录里），扫到的商品先放进待提交列表，同一商品的数量累加，
+再一次性在一个写事务中提交，扫码速度不受数据库和界面刷新的影响。
+"""
+
+# 扫码枪相邻两个字符的最大间隔（毫秒），超过时认为是手工输入
+SCAN_MAX_GAP_MS = 35
+
+# 条码的最短长度：只有一个字符时无法按间隔判断
+SCAN_MIN_LENGTH = 2
+
+# 默认每隔多少秒自动提交一次待提交列表，0 表示只手动提交
+SCAN_COMMIT_INTERVAL = 10
+
+
+class BurstDetector:
+    """按按键间隔判断输入是否来自扫码枪
+
+    每个字符按键调用 key()，回车时调用 finish()。输入框中先有手工输入的
+    内容、再扫码时，只有最后一段连续快速输入的字符算作条码。
+    """
+
+    def __init__(self, max_gap_ms=SCAN_MAX_GAP_MS, min_length=SCAN_MIN_LENGTH):
+        self.max_gap_ms = max_gap_ms
+        self.min_length = min_length
+        self._last = None
+        self._run = 0  # 最后一段连续快速输入的字符数
+
+    def key(self, time_ms):
+        """记录一个字符按键（time_ms 为按键事件的时间，毫秒）"""
+        if self._last is None or time_ms - self._last > self.max_gap_ms:
+            self._run = 0
+        self._run += 1
+        self._last = time_ms
+
+    def finish(self, time_ms):
+        """回车：返回最后一段快速输入的字符数，不是扫码时返回 0，然后重新开始"""
+        run = self._run
+        if run < self.min_length or self._last is None or time_ms - self._last > self.max_gap_ms:
+            run = 0
+        self.reset()
+        return run
+
+    def reset(self):
+        self._last = None
+        self._run = 0
+
+
+class PendingScans:
+    """待提交的扫码结果：商品ID -> 数量，同一商品累加，按第一次扫到的顺序排列"""
+
+    def __init__(self):
+        self._items = {}
+
+    def add(self, product_id, quantity=1):
+        """累加数量，返回该商品累计的数量"""
+        total = self._items.get(product_id, 0) + quantity
+        self._items[product_id] = total
+        return total
+
+    def remove(self, product_id):
+        self._items.pop(product_id, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def take(self):
+        """取出全部待提交的 [(商品ID, 数量)] 并清空"""
+        items = list(self._items.items())
+        self._items.clear()
+        return items
+
+    def restore(self, items):
+        """提交失败时放回取出的记录（排在提交期间新扫到的记录之前）"""
+        current = self._items
+        self._items = {}
+        for product_id, quantity in items:
+            self.add(product_id, quantity)
+        for product_id, quantity in current.items():
+            self.add(product_id, quantity)
+
+    def items(self):
+        return list(self._items.items())
+
+    def quantity(self, product_id):
+        return self._items.get(product_id, 0)
+
+    def total(self):
+        return sum(self._items.values())
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,703 @@
+"""仓库业务逻辑（不依赖图形界面）
+
+商品增删改、出入库、统计、导入导出都在这里实现，图形界面和命令行
+共用同一套校验规则。校验失败时抛出 WarehouseError，消息可以直接
+显示给用户。
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from warehouse_archive import (MAIN_SCHEMA, MAX_ATTACHED_ARCHIVES, archive_before, archive_cutoff, archived_rows,
+                               attach_sources, ledger_sources, list_archives)
+from warehouse_db import (Database, SECONDS_PER_DAY, STOCK_DELTA, day_range, parse_timestamp,
+                          rebuild_daily_stats, timestamp, write_stock_checkpoints)
+from warehouse_export import export_table, transactions_where
+from warehouse_import import ImportResult, import_transactions
+
+# 交易类型
+INBOUND = "入库"
+OUTBOUND = "出库"
+TRANSACTION_TYPES = (INBOUND, OUTBOUND)
+
+# 交易记录每页的行数
+TRANSACTION_PAGE_SIZE = 200
+
+# 商品搜索最多返回的结果数
+PRODUCT_SEARCH_LIMIT = 200
+
+# trigram 全文索引能匹配的最短子串（字数）
+TRIGRAM_MIN_LENGTH = 3
+
+# 交易记录列表查询，分页条件和排序由调用处拼接，{schema} 为主数据库或归档文件。
+# date 是由 ts 生成的显示用日期，排序和分页使用 (ts, id)
+TRANSACTION_LIST_SQL = '''
+SELECT t.id, t.product_id, p.name, t.type, t.quantity, t.operator, t.date, t.ts
+FROM {schema}.transactions t
+LEFT JOIN products p ON t.product_id = p.id
+'''
+
+# 缓存的统计结果数（按 类型、商品ID或经办人、起止日期 区分）
+STATS_CACHE_SIZE = 64
+
+# (id, name, quantity, price, category)
+ProductRow = Tuple[int, str, int, Optional[float], Optional[str]]
+# (id, product_id, name, type, quantity, operator, date, ts)
+TransactionRow = Tuple[int, int, Optional[str], str, int, str, str, int]
+# (总数量, 次数)
+StatsTotal = Tuple[Optional[int], int]
+
+Progress = Optional[Callable[[int, Optional[int]], None]]
+
+
+class WarehouseError(Exception):
+    """业务校验失败"""
+
+
+class ProductConflictError(WarehouseError):
+    """商品在编辑期间已被其他终端修改或删除"""
+
+
+def _fts_phrase(word: str) -> str:
+    """把输入的词转为 FTS5 短语，引号转义后不会被当作查询语法"""
+    return '"' + word.replace('"', '""') + '"'
+
+
+def check_date(value: str) -> str:
+    """校验 YYYY-MM-DD 格式的日期"""
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+        parse_timestamp(value)  # 早于 1970 年的日期超出交易时间的范围
+    except (TypeError, ValueError):
+        raise WarehouseError("日期格式错误，请使用格式：YYYY-MM-DD")
+    return value
+
+
+def check_date_range(start: str, end: str) -> Tuple[int, int]:
+    """校验起止日期，返回 [开始秒, 结束秒) 区间"""
+    check_date(start)
+    check_date(end)
+    return day_range(start, end)
+
+
+def transaction_timestamp(trans_date: Optional[str] = None) -> int:
+    """交易时间：不指定或指定为今天时取当前时间，指定其他日期时取当天 0 点
+
+    也可以指定 YYYY-MM-DD HH:MM[:SS] 格式的时间。
+    """
+    now = datetime.now()
+    if not trans_date or trans_date.strip() == now.strftime('%Y-%m-%d'):
+        return timestamp(now)
+    try:
+        return parse_timestamp(trans_date)
+    except ValueError:
+        raise WarehouseError("日期格式错误，请使用格式：YYYY-MM-DD")
+
+
+class StatsCache:
+    """统计结果的 LRU 缓存，条目带有生成时的变更版本号，版本号变化后全部作废"""
+
+    def __init__(self, maxsize: int = STATS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+                return None
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+            return result
+
+    def put(self, key, generation, result):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class WarehouseService:
+    def __init__(self, db: Database):
+        self.db = db
+        self._stats_cache = StatsCache()
+
+    # ---------- 商品 ----------
+
+    def list_products(self) -> List[ProductRow]:
+        return self.db.fetchall('SELECT id, name, quantity, price, category FROM products ORDER BY id')
+
+    def get_product(self, product_id: int) -> Optional[ProductRow]:
+        return self.db.fetchone('SELECT id, name, quantity, price, category FROM products WHERE id=?',
+                                (product_id,))
+
+    def get_product_version(self, product_id: int) -> Optional[Tuple[ProductRow, int]]:
+        """返回 (商品, 版本号)，编辑前读取，保存时传给 update_product / delete_product"""
+        row = self.db.fetchone('SELECT id, name, quantity, price, category, version FROM products WHERE id=?',
+                               (product_id,))
+        return None if row is None else (row[:5], row[5])
+
+    def _check_version(self, product_id: int, expected_version: Optional[int]) -> None:
+        """在写事务中检查商品的版本号，商品已被其他终端修改或删除时抛出 ProductConflictError"""
+        if expected_version is None:
+            return
+        version = self.db.scalar('SELECT version FROM products WHERE id=?', (product_id,))
+        if version is None:
+            raise ProductConflictError("商品不存在（可能已被其他终端删除）")
+        if version != expected_version:
+            raise ProductConflictError("商品信息已被其他终端修改，请重新选择商品后再操作")
+
+    def find_product_id(self, name: str) -> Optional[int]:
+        return self.db.scalar('SELECT id FROM products WHERE name=?', (name,))
+
+    def search_products(self, text: str, limit: int = PRODUCT_SEARCH_LIMIT) -> List[ProductRow]:
+        """按名称或类别搜索商品，名称匹配优先
+
+        输入按空白分成多个词，每个词都要出现在名称或类别的任意位置（中文也适用）。
+        三个字以上的词用 trigram 索引查找并按相关度排序；一两个字的词用两字片段表
+        （products_ngrams）查找，全是短词时名称中匹配位置靠前、名称较短的排在前面。
+        输入纯数字时同时按商品ID查找，放在最前面。
+        """
+        words = text.split()
+        if not words:
+            return []
+        long_words = [word for word in words if len(word) >= TRIGRAM_MIN_LENGTH]
+        short_words = [word for word in words if len(word) < TRIGRAM_MIN_LENGTH]
+        conditions = []
+        params = []
+        if long_words:
+            conditions.append('products_trigram MATCH ?')
+            params.append(' AND '.join(_fts_phrase(word) for word in long_words))
+        for word in short_words:
+            if len(word) == 2:
+                conditions.append('p.id IN (SELECT product_id FROM products_ngrams WHERE gram = lower(?))')
+                params.append(word)
+            else:
+                # 以这个字开头的片段，char(1114111) 是最大的字符
+                conditions.append('p.id IN (SELECT product_id FROM products_ngrams '
+                                  'WHERE gram >= lower(?) AND gram < lower(?) || char(1114111))')
+                params.extend((word, word))
+        if long_words:
+            sql = f'''
+            SELECT p.id, p.name, p.quantity, p.price, p.category
+            FROM products_trigram
+            JOIN products p ON p.id = products_trigram.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY bm25(products_trigram, 10.0, 1.0)
+            LIMIT ?
+            '''
+        else:
+            # 名称中不含第一个词（只有类别匹配）的排在最后
+            sql = f'''
+            SELECT p.id, p.name, p.quantity, p.price, p.category
+            FROM products p
+            WHERE {' AND '.join(conditions)}
+            ORDER BY instr(lower(p.name), lower(?)) = 0, instr(lower(p.name), lower(?)), length(p.name), p.id
+            LIMIT ?
+            '''
+            params.extend((short_words[0], short_words[0]))
+        rows = self.db.fetchall(sql, tuple(params) + (limit,))
+        if text.strip().isdecimal():
+            row = self.get_product(int(text))
+            if row is not None:
+                rows = [row] + [other for other in rows if other[0] != row[0]][:limit - 1]
+        return rows
+
+    def add_product(self, product_id: int, name: str, price: Optional[float] = None,
+                    category: Optional[str] = None) -> None:
+        """新增商品，新商品的数量为0"""
+        if not name:
+            raise WarehouseError("请输入商品名称")
+        if price is not None and price < 0:
+            raise WarehouseError("价格不能为负数")
+
+        with self.db.transaction('IMMEDIATE'):
+            if self.db.fetchone('SELECT id FROM products WHERE id=?', (product_id,)):
+                raise WarehouseError("该商品ID已存在，请使用其他ID")
+            if self.db.fetchone('SELECT id FROM products WHERE name=?', (name,)):
+                raise WarehouseError("该商品名称已存在，请使用其他名称")
+            self.db.execute('''
+            INSERT INTO products (id, name, quantity, price, category)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (product_id, name, 0, price, category))
+
+    def update_product(self, product_id: int, changes: dict, expected_version: Optional[int] = None) -> int:
+        """修改商品，changes 可以包含 id、name、price、category，返回修改后的商品ID
+
+        修改ID时同时更新交易记录中的商品ID（包括归档文件中的记录）。
+        指定 expected_version（get_product_version 读到的版本号）时，
+        商品在这之后被其他终端修改过则不保存，抛出 ProductConflictError；
+        保存成功后版本号为 expected_version + 1。
+        """
+        new_id = changes.get('id', product_id)
+        updates = []
+        update_values = []
+        # 附加数据库不能在事务中进行
+        archives = []
+        if new_id != product_id:
+            sources = ledger_sources(self.db)
+            # 所有归档文件要在同一个写事务中修改，附加的数量有上限
+            if len(sources) - 1 > MAX_ATTACHED_ARCHIVES:
+                raise WarehouseError(f"已归档的年份超过 {MAX_ATTACHED_ARCHIVES} 年，不能修改商品ID")
+            archives = [schema for schema in self._attach_sources(sources) if schema != MAIN_SCHEMA]
+
+        with self.db.transaction('IMMEDIATE'):
+            self._check_version(product_id, expected_version)
+            if new_id != product_id:
+                if self.db.fetchone('SELECT id FROM products WHERE id=?', (new_id,)):
+                    raise WarehouseError("该商品ID已存在")
+                updates.append("id=?")
+                update_values.append(new_id)
+
+            if 'name' in changes:
+                name = changes['name']
+                if not name:
+                    raise WarehouseError("商品名称不能为空")
+                # 检查新名称是否已存在（排除当前商品）
+                if self.db.fetchone('SELECT id FROM products WHERE name=? AND id!=?', (name, product_id)):
+                    raise WarehouseError("该商品名称已存在")
+                updates.append("name=?")
+                update_values.append(name)
+
+            if 'price' in changes:
+                price = changes['price']
+                if price is not None and price < 0:
+                    raise WarehouseError("价格不能为负数")
+                updates.append("price=?")
+                update_values.append(price)
+
+            if 'category' in changes:
+                updates.append("category=?")
+                update_values.append(changes['category'] or None)
+
+            if not updates:
+                return product_id
+
+            updates.append("version=version+1")
+            update_values.append(product_id)
+            cursor = self.db.execute("UPDATE products SET " + ", ".join(updates) + " WHERE id=?",
+                                     tuple(update_values))
+            if cursor.rowcount == 0:
+                raise WarehouseError("商品不存在")
+
+            # 如果ID被修改了，更新交易记录表中的product_id
+            if new_id != product_id:
+                self.db.execute('UPDATE transactions SET product_id=? WHERE product_id=?',
+                                (new_id, product_id))
+                for schema in archives:
+                    self.db.execute(f'UPDATE {schema}.transactions SET product_id=? WHERE product_id=?',
+                                    (new_id, product_id))
+                    self.db.execute(f'UPDATE {schema}.daily_stats SET product_id=? WHERE product_id=?',
+                                    (new_id, product_id))
+                # 触发器已经把这些交易记录从旧ID的库存检查点移到了新ID，旧ID的检查点都已为0
+                self.db.execute('DELETE FROM stock_checkpoints WHERE product_id=?', (product_id,))
+        return new_id
+
+    def update_stock_checkpoints(self) -> int:
+        """补写到本月为止的库存检查点，返回写入的月数（已是最新时不占用写锁）"""
+        return write_stock_checkpoints(self.db)
+
+    def stock_as_of(self, date: str, update_checkpoints: bool = True) -> List[ProductRow]:
+        """各商品在 date（YYYY-MM-DD）当天结束时的库存，格式同 list_products
+
+        历史库存 = 当前库存 - 该日期之后的变动。之后的变动由库存检查点算出：
+        最近的检查点减去该日期之前最近的检查点，再加上两个检查点之后的按日汇总，
+        只需要读取两个检查点和不超过两个月的按日汇总，与交易记录总数无关。
+        日期在已归档的年份时，再加上归档文件中该日期之后的按日汇总。
+        update_checkpoints 为 False 时只读不写（检查点缺少最近几个月时结果仍然正确，
+        只是多读几个月的按日汇总），由调用方另外调用 update_stock_checkpoints。
+        """
+        check_date(date)
+        boundary = day_range(date, date)[1] // SECONDS_PER_DAY
+        archived = ''
+        archived_params = ()
+        cutoff = archive_cutoff(self.db)
+        if cutoff is not None and boundary * SECONDS_PER_DAY < cutoff:
+            # 之后的变动 = 归档文件中该日期之后的变动 + 主数据库中的全部变动
+            schemas = [schema for schema in self._attach_ledger(boundary * SECONDS_PER_DAY, cutoff)
+                       if schema != MAIN_SCHEMA]
+            archived = ''.join(f'''
+            UNION ALL
+            SELECT product_id, {STOCK_DELTA} FROM {schema}.daily_stats WHERE day >= ?
+            ''' for schema in schemas)
+            archived_params = (boundary,) * len(schemas)
+            boundary = cutoff // SECONDS_PER_DAY
+        if update_checkpoints:
+            write_stock_checkpoints(self.db)
+        latest = self.db.scalar('SELECT MAX(day) FROM stock_checkpoints')
+        if latest is None or boundary >= latest:
+            changes = f'SELECT product_id, {STOCK_DELTA} AS quantity FROM daily_stats WHERE day >= ?'
+            params = (boundary,)
+        else:
+            base = self.db.scalar('SELECT MAX(day) FROM stock_checkpoints WHERE day <= ?', (boundary,))
+            # 之后的变动 = (最近的检查点 + 之后的变动) - (之前的检查点 + 到该日期为止的变动)
+            changes = f'''
+            SELECT product_id, quantity FROM stock_checkpoints WHERE day = ?
+            UNION ALL
+            SELECT product_id, {STOCK_DELTA} FROM daily_stats WHERE day >= ?
+            UNION ALL
+            SELECT product_id, -quantity FROM stock_checkpoints WHERE day = ?
+            UNION ALL
+            SELECT product_id, -({STOCK_DELTA}) FROM daily_stats WHERE day >= ? AND day < ?
+            '''
+            # 日期早于第一个检查点时从头累计（第一个检查点之前不超过一个月）
+            params = (latest, latest, base, base if base is not None else 0, boundary)
+        return self.db.fetchall(f'''
+        SELECT p.id, p.name, p.quantity - IFNULL(c.quantity, 0), p.price, p.category
+        FROM products p
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) AS quantity FROM ({changes}{archived}) GROUP BY product_id
+        ) c ON c.product_id = p.id
+        ORDER BY p.id
+        ''', params + archived_params)
+
+    def replay_stock_as_of(self, date: str) -> List[ProductRow]:
+        """逐笔累计交易记录得到的历史库存，不使用按日汇总和检查点，用于核对 stock_as_of"""
+        check_date(date)
+        boundary_ts = day_range(date, date)[1]
+        schemas = self._attach_ledger(boundary_ts, None)
+        changes = ' UNION ALL '.join(f'''
+            SELECT product_id, {STOCK_DELTA} AS quantity FROM {schema}.transactions WHERE ts >= ?
+            ''' for schema in schemas)
+        return self.db.fetchall(f'''
+        SELECT p.id, p.name, p.quantity - IFNULL(c.quantity, 0), p.price, p.category
+        FROM products p
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) AS quantity FROM ({changes}) GROUP BY product_id
+        ) c ON c.product_id = p.id
+        ORDER BY p.id
+        ''', (boundary_ts,) * len(schemas))
+
+    def check_stock_as_of(self, dates: Optional[List[str]] = None) -> List[Tuple[str, int, int, int]]:
+        """核对 stock_as_of 与逐笔累计的结果，返回不一致的 [(日期, 商品ID, 查询结果, 逐笔结果)]
+
+        不指定日期时核对每个库存检查点的前一天和当天（检查点出错时最先在这里表现出来）。
+        """
+        if not dates:
+            write_stock_checkpoints(self.db)
+            days = self.db.fetchall('SELECT DISTINCT day FROM stock_checkpoints ORDER BY day')
+            dates = sorted({time.strftime('%Y-%m-%d', time.gmtime((day + offset) * SECONDS_PER_DAY))
+                            for day, in days for offset in (-1, 0)})
+        mismatches = []
+        for date in dates:
+            replayed = {row[0]: row[2] for row in self.replay_stock_as_of(date)}
+            for row in self.stock_as_of(date):
+                if row[2] != replayed[row[0]]:
+                    mismatches.append((date, row[0], row[2], replayed[row[0]]))
+        return mismatches
+
+    def delete_product(self, product_id: int, expected_version: Optional[int] = None) -> None:
+        """删除商品，expected_version 同 update_product"""
+        with self.db.transaction('IMMEDIATE'):
+            self._check_version(product_id, expected_version)
+            self.db.execute('DELETE FROM products WHERE id=?', (product_id,))
+
+    # ---------- 出入库 ----------
+
+    def post_transaction(self, product_id: int, trans_type: str, quantity: int,
+                         operator: str = "", trans_date: Optional[str] = None) -> int:
+        """登记一笔入库或出库，返回交易记录ID
+
+        库存更新和交易记录在同一个写事务中完成：出库用带条件的 UPDATE
+        一次完成检查和扣减，多个终端同时出库也不会超扣。
+        """
+        operator, ts = self._check_post(trans_type, operator, trans_date)
+        if quantity <= 0:
+            raise WarehouseError("数量必须大于0")
+
+        with self.db.transaction('IMMEDIATE'):
+            self._check_not_archived(ts)
+            return self._post(product_id, trans_type, quantity, operator, ts)
+
+    def post_transactions(self, items: List[Tuple[int, int]], trans_type: str, operator: str = "",
+                          trans_date: Optional[str] = None) -> List[int]:
+        """在一个写事务中登记多笔同类型的入库或出库，返回交易记录ID列表
+
+        items 为 [(商品ID, 数量)]，例如扫码模式累积的待提交列表。
+        任意一笔失败时全部不登记，错误信息中带有商品ID。
+        """
+        operator, ts = self._check_post(trans_type, operator, trans_date)
+        for product_id, quantity in items:
+            if quantity <= 0:
+                raise WarehouseError(f"商品 {product_id}：数量必须大于0")
+
+        with self.db.transaction('IMMEDIATE'):
+            self._check_not_archived(ts)
+            trans_ids = []
+            for product_id, quantity in items:
+                try:
+                    trans_ids.append(self._post(product_id, trans_type, quantity, operator, ts))
+                except WarehouseError as e:
+                    raise WarehouseError(f"商品 {product_id}：{e}")
+            return trans_ids
+
+    @staticmethod
+    def _check_post(trans_type: str, operator: str, trans_date: Optional[str]) -> Tuple[str, int]:
+        """校验交易类型和经办人，返回 (经办人, 交易时间)"""
+        if trans_type not in TRANSACTION_TYPES:
+            raise WarehouseError("类型只能是入库或出库")
+        operator = operator.strip()
+        # 只在出库时验证经办人
+        if trans_type == OUTBOUND and not operator:
+            raise WarehouseError("出库时请输入经办人")
+        return operator, transaction_timestamp(trans_date)
+
+    def _post(self, product_id: int, trans_type: str, quantity: int, operator: str, ts: int) -> int:
+        """在写事务中更新库存并写入交易记录"""
+        if trans_type == INBOUND:
+            cursor = self.db.execute('UPDATE products SET quantity = quantity + ? WHERE id=?',
+                                     (quantity, product_id))
+        else:
+            cursor = self.db.execute('UPDATE products SET quantity = quantity - ? WHERE id=? AND quantity >= ?',
+                                     (quantity, product_id, quantity))
+
+        if cursor.rowcount == 0:
+            # 没有更新任何行：商品不存在或库存不足，抛出异常时事务回滚
+            current = self.db.scalar('SELECT quantity FROM products WHERE id=?', (product_id,))
+            if current is None:
+                raise WarehouseError("商品不存在")
+            raise WarehouseError(f"库存不足（当前库存 {current}，缺少 {quantity - current}）")
+
+        cursor = self.db.execute('''
+        INSERT INTO transactions (product_id, type, quantity, operator, ts)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (product_id, trans_type, quantity, operator, ts))
+        return cursor.lastrowid
+
+    def _check_not_archived(self, ts: int) -> None:
+        cutoff = archive_cutoff(self.db)
+        if cutoff is not None and ts < cutoff:
+            year = time.gmtime(cutoff).tm_year - 1
+            raise WarehouseError(f"{year}年及以前的交易记录已归档，不能再登记")
+
+    def get_transaction(self, trans_id: int, filters: Optional[dict] = None) -> Optional[TransactionRow]:
+        """返回主数据库中的一条交易记录，指定 filters 时不符合筛选条件的返回 None"""
+        where, params = self._transactions_where(filters, 't.id = ?', (trans_id,))
+        return self.db.fetchone(TRANSACTION_LIST_SQL.format(schema=MAIN_SCHEMA) + where, params)
+
+    def count_transactions(self, filters: Optional[dict] = None) -> int:
+        """符合筛选条件的交易记录数，包括归档文件中的记录"""
+        filters = self.check_transaction_filters(filters)
+        if not filters:
+            # 归档文件的行数在登记表中，不需要附加
+            return self.db.scalar('SELECT COUNT(*) FROM transactions', default=0) + archived_rows(self.db)
+        where, params = self._transactions_where(filters)
+        return sum(self.db.scalar(f'SELECT COUNT(*) FROM {schema}.transactions t {where}', params, default=0)
+                   for schema in self._attach_ledger(*self._filters_range(filters)))
+
+    def transactions_page(self, last_key: Optional[Tuple[int, int]] = None,
+                          limit: int = TRANSACTION_PAGE_SIZE,
+                          filters: Optional[dict] = None) -> List[TransactionRow]:
+        """按 (ts, id) 倒序返回 last_key 之后的一页符合筛选条件的交易记录
+
+        键集分页：从上一页最后一行之后继续读取，不使用 OFFSET。
+        按商品或经办人筛选时使用 (product_id, ts) / (operator, ts) 索引，
+        否则使用 ts 索引，都按索引顺序读取，读满一页就停止。
+        主数据库读完后依次读取较早的归档文件，用到时才附加。
+        """
+        filters = self.check_transaction_filters(filters)
+        start_ts, end_ts = self._filters_range(filters)
+        if last_key is None:
+            where, params = self._transactions_where(filters)
+        else:
+            where, params = self._transactions_where(filters, '(t.ts, t.id) < (?, ?)', tuple(last_key))
+            end_ts = last_key[0] + 1 if end_ts is None else min(end_ts, last_key[0] + 1)
+        rows = []
+        for source in ledger_sources(self.db, start_ts, end_ts):
+            schema, = self._attach_sources([source])
+            rows += self.db.fetchall(TRANSACTION_LIST_SQL.format(schema=schema) + where + '''
+            ORDER BY t.ts DESC, t.id DESC
+            LIMIT ?
+            ''', params + (limit - len(rows),))
+            if len(rows) >= limit:
+                break
+        return rows
+
+    @staticmethod
+    def check_transaction_filters(filters: Optional[dict]) -> dict:
+        """校验交易记录的筛选条件，返回去掉空值后的条件
+
+        可以包含 start、end（YYYY-MM-DD）、trans_type、operator、product_id、
+        min_quantity、max_quantity。
+        """
+        filters = {key: value for key, value in (filters or {}).items() if value not in (None, '')}
+        for key in ('start', 'end'):
+            if key in filters:
+                check_date(filters[key])
+        if 'start' in filters and 'end' in filters:
+            start_ts, end_ts = day_range(filters['start'], filters['end'])
+            if start_ts >= end_ts:
+                raise WarehouseError("开始日期不能晚于结束日期")
+        if filters.get('trans_type') not in (None,) + TRANSACTION_TYPES:
+            raise WarehouseError("类型只能是入库或出库")
+        for key in ('product_id', 'min_quantity', 'max_quantity'):
+            if key in filters:
+                try:
+                    filters[key] = int(filters[key])
+                except (TypeError, ValueError):
+                    raise WarehouseError("商品ID和数量必须为整数")
+        if ('min_quantity' in filters and 'max_quantity' in filters
+                and filters['min_quantity'] > filters['max_quantity']):
+            raise WarehouseError("最小数量不能大于最大数量")
+        return filters
+
+    @staticmethod
+    def _filters_range(filters: dict) -> Tuple[Optional[int], Optional[int]]:
+        """已校验的筛选条件的 [开始秒, 结束秒) 区间，不限时为 None"""
+        start_ts = parse_timestamp(filters['start']) if 'start' in filters else None
+        end_ts = parse_timestamp(filters['end']) + SECONDS_PER_DAY if 'end' in filters else None
+        return start_ts, end_ts
+
+    def _attach_sources(self, sources) -> List[str]:
+        try:
+            return attach_sources(self.db, sources)
+        except ValueError as e:
+            raise WarehouseError(str(e))
+
+    def _attach_ledger(self, start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> List[str]:
+        """附加日期范围涉及的归档文件，返回数据来源的模式名（从新到旧）"""
+        return self._attach_sources(ledger_sources(self.db, start_ts, end_ts))
+
+    def _transactions_where(self, filters: Optional[dict], extra: Optional[str] = None,
+                            extra_params: tuple = ()) -> Tuple[str, tuple]:
+        """筛选条件加上额外条件的 WHERE 子句"""
+        where, params = transactions_where(**self.check_transaction_filters(filters))
+        if extra:
+            where = f'{where} AND {extra}' if where else f'WHERE {extra}'
+            params += extra_params
+        return where, params
+
+    # ---------- 统计 ----------
+
+    def stats_generation(self) -> tuple:
+        """交易记录和商品的变更版本号，任何终端修改后都会变化"""
+        return tuple(self.db.fetchall(
+            "SELECT version FROM change_versions WHERE name IN ('products', 'transactions') ORDER BY name"))
+
+    def _cached_stats(self, kind: str, key, start: Optional[str], end: Optional[str], sql: str,
+                      params: tuple, group_columns: int) -> Tuple[list, StatsTotal]:
+        """执行统计查询并缓存结果
+
+        查询的每一行后面带有用窗口函数算出的总数量和总次数，
+        分组结果和总计只需扫描一次。
+        """
+        # 先读版本号再查询：查询期间有新的修改时缓存的结果会在下次判为过期
+        generation = self.stats_generation()
+        cache_key = (kind, key, start, end)
+        result = self._stats_cache.get(cache_key, generation)
+        if result is not None:
+            return result
+
+        rows = self.db.fetchall(sql, params)
+        if rows:
+            total = (rows[0][-2], rows[0][-1])
+        else:
+            total = (None, 0)
+        result = ([row[:group_columns] for row in rows], total)
+        self._stats_cache.put(cache_key, generation, result)
+        return result
+
+    def product_outbound_stats(self, product_id: int, start: Optional[str] = None,
+                               end: Optional[str] = None) -> Tuple[list, StatsTotal]:
+        """商品按经办人汇总的出库统计，返回 ([(经办人, 数量, 次数)], (总数量, 总次数))
+
+        不指定日期时统计全部记录（不含没有经办人的记录）。
+        从按日汇总表 daily_stats 读取，不扫描交易记录；日期范围涉及已归档的年份时
+        合并归档文件中的按日汇总。
+        """
+        if start is None or end is None:
+            start = end = None
+            start_ts = end_ts = None
+            condition, params = 'AND operator != ""', (product_id,)
+        else:
+            start_ts, end_ts = check_date_range(start, end)
+            condition = 'AND day BETWEEN ? AND ?'
+            params = (product_id, start_ts // SECONDS_PER_DAY, end_ts // SECONDS_PER_DAY - 1)
+        schemas = self._attach_ledger(start_ts, end_ts)
+        daily_stats = ' UNION ALL '.join(f'''
+            SELECT operator, quantity, count
+            FROM {schema}.daily_stats
+            WHERE product_id = ?
+                AND type = '出库'
+                {condition}''' for schema in schemas)
+        return self._cached_stats('product', product_id, start, end, f'''
+        SELECT
+            operator,
+            SUM(quantity) as total_quantity,
+            SUM(count) as transaction_count,
+            SUM(SUM(quantity)) OVER () as grand_quantity,
+            SUM(SUM(count)) OVER () as grand_count
+        FROM ({daily_stats})
+        GROUP BY operator
+        ORDER BY total_quantity DESC
+        ''', params * len(schemas), 3)
+
+    def operator_stats(self, operator: str, start: str, end: str) -> Tuple[list, StatsTotal]:
+        """经办人按商品汇总的出库统计，返回 ([(商品ID, 名称, 数量, 次数)], (总数量, 总次数))"""
+        start_ts, end_ts = check_date_range(start, end)
+        schemas = self._attach_ledger(start_ts, end_ts)
+        daily_stats = ' UNION ALL '.join(f'''
+            SELECT product_id, quantity, count
+            FROM {schema}.daily_stats
+            WHERE operator = ?
+                AND type = '出库'
+                AND day BETWEEN ? AND ?''' for schema in schemas)
+        return self._cached_stats('operator', operator, start, end, f'''
+        SELECT
+            s.product_id,
+            p.name,
+            SUM(s.quantity) as total_quantity,
+            SUM(s.count) as transaction_count,
+            SUM(SUM(s.quantity)) OVER () as grand_quantity,
+            SUM(SUM(s.count)) OVER () as grand_count
+        FROM ({daily_stats}) s
+        LEFT JOIN products p ON s.product_id = p.id
+        GROUP BY s.product_id, p.name
+        ORDER BY total_quantity DESC
+        ''', (operator, start_ts // SECONDS_PER_DAY, end_ts // SECONDS_PER_DAY - 1) * len(schemas), 4)
+
+    def rebuild_daily_stats(self) -> int:
+        """从交易记录重新生成按日汇总统计，返回汇总行数"""
+        return rebuild_daily_stats(self.db)
+
+    # ---------- 归档 ----------
+
+    def list_archives(self) -> List[Tuple[int, str, int]]:
+        """已归档的年份 [(年份, 文件路径, 行数)]，从新到旧"""
+        return list_archives(self.db)
+
+    def archive_before(self, year: int, progress: Progress = None) -> List[Tuple[int, int]]:
+        """把 year 年以前的交易记录按年份移到归档文件，返回 [(年份, 行数)]，见 warehouse_archive"""
+        try:
+            return archive_before(self.db, year, progress)
+        except ValueError as e:
+            raise WarehouseError(str(e))
+
+    # ---------- 导入导出 ----------
+
+    def export(self, table_type: str, file_path: str, filters: Optional[dict] = None,
+               progress: Progress = None) -> int:
+        """导出商品列表（products）或交易记录（transactions），返回导出的行数
+
+        格式按扩展名决定（.xlsx / .csv / .parquet / .feather），
+        filters 见 check_transaction_filters。
+        """
+        if filters:
+            filters = self.check_transaction_filters(filters)
+        try:
+            return export_table(self.db, table_type, file_path, filters, progress)
+        except ValueError as e:
+            raise WarehouseError(str(e))
+
+    def import_transactions(self, file_path: str, progress: Progress = None) -> ImportResult:
+        """从CSV或Excel文件批量导入出入库记录，见 warehouse_import"""
+        return import_transactions(self.db, file_path, progress)
@@ -1,6 +1,11 @@
+import time
+
+# 启动计时的起点：模块开始导入的时间
+STARTUP_T0 = time.perf_counter()
+
 try:
     import tkinter as tk
-    from tkinter import ttk, messagebox, filedialog
+    from tkinter import ttk, messagebox, filedialog, simpledialog
 except ImportError as e:
     print("错误：无法导入tkinter模块。请确保Python正确安装并包含tkinter。")
     print("详细错误信息:", str(e))
@@ -9,30 +14,446 @@ except ImportError as e:
 
 try:
     import sqlite3
+    import bisect
     from datetime import datetime
-    import pandas as pd  # 用于Excel导出
+    from warehouse_db import Database, migrate
+    from warehouse_catalog import ProductCatalog
+    from warehouse_worker import BackgroundWorker
+    from warehouse_diagnostics import Instrumentation, diagnostics_enabled
+    from warehouse_import import write_error_report
+    from warehouse_scan import BurstDetector, PendingScans, SCAN_COMMIT_INTERVAL
+    from warehouse_service import WarehouseService, WarehouseError, ProductConflictError, TRANSACTION_PAGE_SIZE
     import os  # 用于文件操作
 except ImportError as e:
     print("错误：无法导入必要的模块。")
     print("详细错误信息:", str(e))
-    print("请安装所需模块：")
-    print("pip install pandas openpyxl")
     input("按回车键退出...")
     exit(1)
 
-try:
-    from tkcalendar import DateEntry
-except ImportError as e:
-    print("错误：无法导入tkcalendar模块。")
-    print("详细错误信息:", str(e))
-    print("请安装所需模块：")
-    print("pip install tkcalendar")
-    input("按回车键退出...")
-    exit(1)
+# openpyxl（导出）和 tkcalendar（统计窗口的日期选择）导入较慢，
+# 在第一次用到时才导入，不影响启动速度
+
+# 设置该环境变量后，启动完成时在控制台打印各阶段耗时
+STARTUP_TIMING_ENV = 'WAREHOUSE_STARTUP_TIMING'
+
+def load_date_entry():
+    """返回 tkcalendar.DateEntry，没有安装时提示安装并返回 None"""
+    try:
+        from tkcalendar import DateEntry
+    except ImportError as e:
+        messagebox.showerror("错误", f"无法导入tkcalendar模块：{str(e)}\n请安装所需模块：pip install tkcalendar")
+        return None
+    return DateEntry
+
+class StartupTimer:
+    """记录启动各阶段的耗时"""
+    
+    def __init__(self, t0):
+        self.t0 = t0
+        self.marks = []  # (阶段, 距离起点的秒数)
+        self.reported = False
+        
+    def mark(self, stage):
+        self.marks.append((stage, time.perf_counter() - self.t0))
+        
+    def report(self):
+        """返回各阶段耗时的文本报告"""
+        lines = []
+        previous = 0.0
+        for stage, elapsed in self.marks:
+            lines.append(f"{stage:<12}{(elapsed - previous) * 1000:8.1f} ms  (累计 {elapsed * 1000:.1f} ms)")
+            previous = elapsed
+        return "\n".join(lines)
+
+# 商品名称下拉列表最多显示的匹配数，以及停止输入多久后开始搜索（毫秒）
+NAME_SUGGESTION_LIMIT = 50
+NAME_SEARCH_DELAY = 120
+
+# 商品管理页的搜索框停止输入多久后开始搜索（毫秒）
+PRODUCT_SEARCH_DELAY = 250
+
+class ProgressWindow:
+    """后台任务的进度窗口，带取消按钮"""
+    
+    def __init__(self, root, title, text):
+        self.task = None
+        self.text = text
+        
+        self.window = tk.Toplevel(root)
+        self.window.title(title)
+        self.window.resizable(False, False)
+        self.window.transient(root)
+        self.window.protocol("WM_DELETE_WINDOW", self.cancel)
+        
+        # 窗口居中显示在主窗口上
+        x = root.winfo_x() + (root.winfo_width() - 320) // 2
+        y = root.winfo_y() + (root.winfo_height() - 120) // 2
+        self.window.geometry(f"320x120+{x}+{y}")
+        
+        self.label = ttk.Label(self.window, text=text, font=('微软雅黑', 10))
+        self.label.pack(pady=(15, 5))
+        
+        # 还不知道总量时显示来回滚动的进度条
+        self.progressbar = ttk.Progressbar(self.window, length=280, mode='indeterminate')
+        self.progressbar.pack(pady=5)
+        self.progressbar.start(10)
+        
+        ttk.Button(self.window, text="取消", command=self.cancel).pack(pady=5)
+        
+    def update(self, progress):
+        """更新进度，progress 为 (已完成, 总量)"""
+        done, total = progress
+        if not self.window.winfo_exists():
+            return
+        if total:
+            self.progressbar.stop()
+            self.progressbar.config(mode='determinate', maximum=total, value=done)
+            self.label.config(text=f"{self.text} {done}/{total}")
+        else:
+            self.label.config(text=f"{self.text} {done}")
+        
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.close()
+        
+    def close(self):
+        if self.window.winfo_exists():
+            self.window.destroy()
+
+class DiagnosticsWindow:
+    """运行诊断窗口：最耗时的SQL语句和界面回调，以及慢查询日志"""
+    
+    QUERY_COLUMNS = ('语句', '次数', '总耗时', 'P50', 'P95', 'P99', '最大', '行数', '调用位置')
+    CALLBACK_COLUMNS = ('回调', '次数', '总耗时', 'P50', 'P95', 'P99', '最大')
+    SLOW_COLUMNS = ('时间', '耗时', '语句', '行数', '调用位置', '线程')
+    
+    def __init__(self, root, instrumentation):
+        self.instrumentation = instrumentation
+        self.slow_entries = []
+        
+        self.window = tk.Toplevel(root)
+        self.window.title("运行诊断")
+        self.window.geometry("900x500")
+        self.window.transient(root)
+        
+        notebook = ttk.Notebook(self.window)
+        notebook.pack(fill='both', expand=True, padx=5, pady=5)
+        
+        self.query_tree = self._create_tree(notebook, "SQL语句", self.QUERY_COLUMNS, 360)
+        self.callback_tree = self._create_tree(notebook, "界面回调", self.CALLBACK_COLUMNS, 300)
+        
+        # 慢查询：上面是列表，下面显示选中语句的完整文本和查询计划
+        slow_frame = ttk.Frame(notebook)
+        notebook.add(slow_frame, text="慢查询")
+        self.slow_tree = self._create_tree(slow_frame, None, self.SLOW_COLUMNS, 360)
+        self.slow_tree.bind('<<TreeviewSelect>>', self.show_slow_detail)
+        self.slow_detail = tk.Text(slow_frame, height=8, font=('Consolas', 9))
+        self.slow_detail.pack(fill='x', padx=2, pady=2)
+        
+        button_frame = ttk.Frame(self.window)
+        button_frame.pack(fill='x', padx=5, pady=(0, 5))
+        threshold = self.instrumentation.slow_query_seconds * 1000
+        ttk.Label(button_frame, text=f"耗时单位：毫秒；慢查询阈值 {threshold:g} 毫秒").pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="关闭", command=self.window.destroy).pack(side=tk.RIGHT, padx=2)
+        ttk.Button(button_frame, text="清空", command=self.reset).pack(side=tk.RIGHT, padx=2)
+        ttk.Button(button_frame, text="刷新", command=self.refresh).pack(side=tk.RIGHT, padx=2)
+        
+        self.refresh()
+        
+    def _create_tree(self, parent, title, columns, first_width):
+        frame = ttk.Frame(parent)
+        if title is None:
+            frame.pack(fill='both', expand=True)
+        else:
+            parent.add(frame, text=title)
+        tree = ttk.Treeview(frame, columns=columns, show='headings')
+        for i, column in enumerate(columns):
+            tree.heading(column, text=column)
+            if i == 0 or column in ('语句', '调用位置'):
+                tree.column(column, width=first_width if i == 0 else 200, anchor='w')
+            else:
+                tree.column(column, width=70, anchor='e')
+        scrollbar = ttk.Scrollbar(frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill='both', expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill='y')
+        return tree
+        
+    def refresh(self):
+        for tree in (self.query_tree, self.callback_tree, self.slow_tree):
+            tree.delete(*tree.get_children())
+        for item in self.instrumentation.query_summary():
+            self.query_tree.insert('', 'end', values=(
+                item['name'], item['count'], f"{item['total_ms']:.1f}", f"{item['p50_ms']:.2f}",
+                f"{item['p95_ms']:.2f}", f"{item['p99_ms']:.2f}", f"{item['max_ms']:.2f}",
+                item['rows'], '; '.join(item['sites'][:3])))
+        for item in self.instrumentation.callback_summary():
+            self.callback_tree.insert('', 'end', values=(
+                item['name'], item['count'], f"{item['total_ms']:.1f}", f"{item['p50_ms']:.2f}",
+                f"{item['p95_ms']:.2f}", f"{item['p99_ms']:.2f}", f"{item['max_ms']:.2f}"))
+        self.slow_entries = self.instrumentation.slow_queries()
+        for i, entry in enumerate(self.slow_entries):
+            self.slow_tree.insert('', 'end', iid=str(i), values=(
+                entry['time'], f"{entry['ms']:.1f}", entry['sql'], entry['rows'],
+                entry['site'], entry['thread']))
+        self.slow_detail.delete('1.0', tk.END)
+        
+    def show_slow_detail(self, event=None):
+        selection = self.slow_tree.selection()
+        if not selection:
+            return
+        entry = self.slow_entries[int(selection[0])]
+        self.slow_detail.delete('1.0', tk.END)
+        self.slow_detail.insert('1.0', f"{entry['sql']}\n参数：{entry['params']}\n\n"
+                                       f"查询计划：\n{entry['plan'] or '（无）'}")
+        
+    def reset(self):
+        self.instrumentation.reset()
+        self.refresh()
+
+class ScanWindow:
+    """扫码模式：扫码枪连续扫码，商品从内存中的商品目录查找，同一商品的数量
+    累加到待提交列表，手动或定时在一个写事务中提交，扫码期间不访问数据库也不弹出对话框"""
+    
+    COLUMNS = ('商品ID', '商品名称', '数量')
+    
+    def __init__(self, app):
+        self.app = app
+        self.detector = BurstDetector()
+        self.pending = PendingScans()
+        self.pending_since = None  # 待提交列表中最早一次扫码的时间
+        self.next_quantity = 1
+        self.commit_task = None
+        self.closing = False  # 等待提交完成后关闭
+        self.auto_commit_paused = False  # 提交失败后暂停自动提交，用户修改列表或手动提交后恢复
+        
+        self.window = tk.Toplevel(app.root)
+        self.window.title("扫码模式")
+        self.window.geometry("600x520")
+        self.window.transient(app.root)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        
+        options = ttk.Frame(self.window)
+        options.pack(fill='x', padx=10, pady=(10, 5))
+        self.trans_type = tk.StringVar(value="出库")
+        ttk.Radiobutton(options, text="入库", variable=self.trans_type, value="入库").pack(side=tk.LEFT)
+        ttk.Radiobutton(options, text="出库", variable=self.trans_type, value="出库").pack(side=tk.LEFT, padx=(5, 15))
+        ttk.Label(options, text="经办人:").pack(side=tk.LEFT)
+        self.operator = ttk.Entry(options, width=10, justify='center')
+        self.operator.pack(side=tk.LEFT, padx=(2, 15))
+        self.operator.insert(0, app.trans_operator.get())
+        ttk.Label(options, text="自动提交间隔(秒，0为不自动提交):").pack(side=tk.LEFT)
+        self.interval = ttk.Spinbox(options, from_=0, to=600, width=5, justify='center')
+        self.interval.set(SCAN_COMMIT_INTERVAL)
+        self.interval.pack(side=tk.LEFT, padx=2)
+        
+        # 扫码输入框：按键时只记录时间，回车后才查找商品
+        self.entry = ttk.Entry(self.window, font=('微软雅黑', 16), justify='center')
+        self.entry.pack(fill='x', padx=10, pady=5)
+        self.entry.bind('<Key>', self.on_key)
+        self.entry.bind('<Return>', self.on_enter)
+        self.entry.bind('<KP_Enter>', self.on_enter)
+        
+        self.status = ttk.Label(self.window, text="请扫码；手工输入“*数量”后回车可以设置下一次扫码的数量",
+                                font=('微软雅黑', 10))
+        self.status.pack(fill='x', padx=10)
+        
+        tree_frame = ttk.Frame(self.window)
+        tree_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        self.tree = ttk.Treeview(tree_frame, columns=self.COLUMNS, show='headings')
+        for column, width in zip(self.COLUMNS, (100, 300, 100)):
+            self.tree.heading(column, text=column)
+            self.tree.column(column, width=width, anchor='center')
+        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill='both', expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill='y')
+        self.tree.bind('<Delete>', self.remove_selected)
+        
+        button_frame = ttk.Frame(self.window)
+        button_frame.pack(fill='x', padx=10, pady=(0, 10))
+        self.summary = ttk.Label(button_frame, text="")
+        self.summary.pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="关闭", command=self.close).pack(side=tk.RIGHT, padx=2)
+        ttk.Button(button_frame, text="清空", command=self.clear).pack(side=tk.RIGHT, padx=2)
+        ttk.Button(button_frame, text="删除所选", command=self.remove_selected).pack(side=tk.RIGHT, padx=2)
+        ttk.Button(button_frame, text="提交(F5)", command=self.commit).pack(side=tk.RIGHT, padx=2)
+        self.window.bind('<F5>', lambda event: self.commit())
+        
+        self.update_summary()
+        self.entry.focus_set()
+        # 每秒检查一次是否到了自动提交的时间
+        self.window.after(1000, self.on_timer)
+        
+    def on_key(self, event):
+        if len(event.char) == 1 and event.char.isprintable():
+            self.detector.key(event.time)
+        
+    def on_enter(self, event):
+        text = self.entry.get()
+        run = self.detector.finish(event.time)
+        self.entry.delete(0, tk.END)
+        if run:
+            # 扫码：只取最后一段快速输入的字符，之前误按的键不算
+            self.add_scan(text[-run:].strip())
+            return 'break'
+        text = text.strip()
+        if text[:1] == '*' and text[1:].isdecimal() and int(text[1:]) > 0:
+            self.next_quantity = int(text[1:])
+            self.show_status(f"下一次扫码的数量：{self.next_quantity}")
+        elif text:
+            # 条码损坏时可以手工输入商品ID或商品名称
+            self.add_scan(text)
+        return 'break'
+        
+    def add_scan(self, code):
+        catalog = self.app.catalog
+        product_id = int(code) if code.isdecimal() else catalog.id_of(code)
+        name = catalog.name_of(product_id) if product_id is not None else None
+        if name is None:
+            self.show_status(f"未知条码：{code}", error=True)
+            return
+        quantity, self.next_quantity = self.next_quantity, 1
+        total = self.pending.add(product_id, quantity)
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        iid = str(product_id)
+        if self.tree.exists(iid):
+            self.tree.item(iid, values=(product_id, name, total))
+        else:
+            self.tree.insert('', 'end', iid=iid, values=(product_id, name, total))
+        self.tree.see(iid)
+        self.show_status(f"{name}  +{quantity}（共 {total}）")
+        self.update_summary()
+        
+    def show_status(self, text, error=False):
+        self.status.config(text=text, foreground='red' if error else '')
+        if error:
+            self.window.bell()
+        
+    def update_summary(self):
+        self.summary.config(text=f"待提交：{len(self.pending)} 种商品，共 {self.pending.total()} 件")
+        
+    def redraw(self):
+        """按待提交列表重新填充表格"""
+        self.tree.delete(*self.tree.get_children())
+        for product_id, quantity in self.pending.items():
+            self.tree.insert('', 'end', iid=str(product_id),
+                             values=(product_id, self.app.catalog.name_of(product_id) or '', quantity))
+        self.update_summary()
+        
+    def remove_selected(self, event=None):
+        for iid in self.tree.selection():
+            self.pending.remove(int(iid))
+            self.tree.delete(iid)
+            self.auto_commit_paused = False
+        if not len(self.pending):
+            self.pending_since = None
+        self.update_summary()
+        self.entry.focus_set()
+        
+    def clear(self):
+        if len(self.pending) and not messagebox.askyesno("确认", "确定要清空待提交的扫码记录吗？", parent=self.window):
+            return
+        self.pending.clear()
+        self.pending_since = None
+        self.auto_commit_paused = False
+        self.redraw()
+        self.entry.focus_set()
+        
+    def on_timer(self):
+        if not self.window.winfo_exists():
+            return
+        try:
+            interval = int(self.interval.get())
+        except ValueError:
+            interval = 0
+        if (interval > 0 and not self.auto_commit_paused and self.pending_since is not None
+                and time.monotonic() - self.pending_since >= interval):
+            self.commit()
+        self.window.after(1000, self.on_timer)
+        
+    def commit(self):
+        """在后台把待提交列表作为一批交易记录提交，提交期间可以继续扫码
+
+        自动提交暂停时只有手动提交（或关闭窗口时提交）才会调用，调用后恢复自动提交。
+        """
+        if self.commit_task is not None or not len(self.pending):
+            return
+        self.auto_commit_paused = False
+        trans_type = self.trans_type.get()
+        operator = self.operator.get()
+        items = self.pending.take()
+        self.pending_since = None
+        self.redraw()
+        self.show_status(f"正在提交 {len(items)} 种商品...")
+        
+        def on_done(trans_ids):
+            self.commit_task = None
+            # 和单笔出入库一样只更新受影响的商品行和新增的交易记录行
+            for product_id, quantity in items:
+                self.app.refresh_product_row(product_id)
+            if self.app.transactions_tab_created:
+                self.app.insert_transaction_rows(trans_ids)
+            if not self.window.winfo_exists():
+                return
+            self.show_status(f"已{trans_type} {len(items)} 种商品，共 {sum(q for p, q in items)} 件")
+            if self.closing:
+                # 等待提交期间又扫到的记录也提交完再关闭
+                if len(self.pending):
+                    self.commit()
+                else:
+                    self.window.destroy()
+        
+        def on_error(error):
+            self.commit_task = None
+            if not self.window.winfo_exists():
+                messagebox.showerror("错误", f"扫码记录提交失败，{len(items)} 种商品未入账：{error}")
+                return
+            # 放回待提交列表，修改后可以重新提交；同样的记录定时重试还会失败，先暂停自动提交
+            self.pending.restore(items)
+            self.pending_since = time.monotonic()
+            self.auto_commit_paused = True
+            self.redraw()
+            self.show_status(f"提交失败：{error}（已暂停自动提交，修改列表或按F5提交后恢复）", error=True)
+            if self.closing:
+                # 正在关闭时提交失败：不关闭窗口，记录留在列表中
+                self.closing = False
+                messagebox.showerror("错误", f"扫码记录提交失败，窗口没有关闭：{error}", parent=self.window)
+        
+        self.commit_task = self.app.worker.submit(self.app.service.post_transactions, items, trans_type, operator,
+                                                  on_done=on_done, on_error=on_error)
+        
+    def close(self):
+        """关闭窗口：有未提交的记录时询问是否先提交，正在提交时等提交完成后再关闭"""
+        if self.closing:
+            return
+        if len(self.pending):
+            answer = messagebox.askyesnocancel("扫码模式", "还有未提交的扫码记录，是否先提交？", parent=self.window)
+            if answer is None:
+                return
+            if not answer:
+                self.pending.clear()
+                self.pending_since = None
+                self.redraw()
+        if self.commit_task is None and not len(self.pending):
+            self.window.destroy()
+            return
+        self.closing = True
+        self.show_status("正在提交，提交完成后自动关闭...")
+        self.commit()
 
 class WarehouseSystem:
     def __init__(self, root):
         self.root = root
+        self.startup = StartupTimer(STARTUP_T0)
+        self.startup.mark("导入模块")
+        
+        # 运行诊断：记录SQL语句和界面回调的耗时，要在绑定任何回调之前启用
+        self.diagnostics = Instrumentation() if diagnostics_enabled() else None
+        if self.diagnostics is not None:
+            self.diagnostics.install_tk()
         self.root.title("仓库管理系统")
         
         # 设置窗口大小和位置
@@ -84,56 +505,53 @@ class WarehouseSystem:
                                    font=('黑体', 16, 'bold'),
                                    cursor='hand2')  # 设置鼠标悬停时的光标样式为手型
         self.title_label.pack(side=tk.LEFT, padx=5)
-        self.title_label.bind('<Button-1>', lambda e: self.show_about_info())
+        self.title_label.bind('<Button-1>', self.on_title_click)
         
         # 检查是否首次运行
         self.check_first_run()
         
         # 添加编辑模式标志
         self.editing_mode = False
+        # 选中商品时读到的版本号，保存或删除时检查是否已被其他终端修改
+        self.editing_version = None
+        # 已读到版本号的商品ID：选中后在后台读取，读到之前不能修改或删除
+        self.editing_product_id = None
         
         # 创建数据库连接
+        self.db = Database(instrumentation=self.diagnostics)
         self.create_database()
+        self.startup.mark("打开数据库")
+        
+        # 业务逻辑（商品、出入库、统计、导入导出）
+        self.service = WarehouseService(self.db)
+        
+        # 后台查询线程，查询结果在主线程中回调
+        self.worker = BackgroundWorker(self.root, self.db, instrumentation=self.diagnostics)
+        
+        # 商品目录缓存（ID/名称互查和下拉列表）
+        self.catalog = ProductCatalog(self.db)
         
         # 创建主界面
         self.create_gui()
+        self.startup.mark("创建界面")
         
-    def create_database(self):
-        conn = sqlite3.connect('warehouse.db')
-        cursor = conn.cursor()
-        
-        # 创建商品表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            quantity INTEGER NOT NULL,
-            price REAL,
-            category TEXT
-        )
-        ''')
-        
-        # 修改交易记录表，添加经办人字段
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_id INTEGER,
-            type TEXT NOT NULL,
-            quantity INTEGER NOT NULL,
-            operator TEXT NOT NULL,
-            date TEXT NOT NULL,
-            FOREIGN KEY (product_id) REFERENCES products (id)
-        )
-        ''')
+        # 窗口第一次空闲（已经可以操作）时记录
+        self.root.after_idle(lambda: self.startup.mark("窗口可操作"))
         
-        conn.commit()
-        conn.close()
+    def create_database(self):
+        # 创建或升级数据库结构（建表、索引等）
+        migrate(self.db)
         
     def create_gui(self):
         # 创建菜单栏
         menubar = tk.Menu(self.root)
         self.root.config(menu=menubar)
         
+        # 数据维护菜单
+        data_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="数据", menu=data_menu)
+        data_menu.add_command(label="归档旧交易记录...", command=self.archive_transactions)
+        
         # 添加"关于"菜单
         help_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="帮助", menu=help_menu)
@@ -148,10 +566,25 @@ class WarehouseSystem:
         self.notebook.add(self.products_frame, text='     商品管理     ')  # 增加空格使标签更宽
         self.create_products_tab()
         
-        # 出入库管理选项卡
+        # 出入库管理选项卡：第一次切换到该选项卡时才创建内容并加载交易记录
         self.transactions_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.transactions_frame, text='     出入库管理     ')  # 增加空格使标签更宽
-        self.create_transactions_tab()
+        self.transactions_tab_created = False
+        self.trans_iids = {}  # 交易ID到表格行的映射
+        self.trans_filters = {}  # 出入库管理页的筛选条件
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+        
+        # 在后台加载商品目录（ID/名称互查），加载完成后初始化下拉列表的值
+        self.trans_product_id_generation = None
+        self.worker.submit(self.catalog.load, key='catalog',
+                           on_done=lambda result: self.update_catalog_lists(),
+                           on_error=lambda e: messagebox.showerror("错误", f"初始化商品列表失败：{str(e)}"))
+        
+    def on_tab_changed(self, event=None):
+        if not self.transactions_tab_created and self.notebook.select() == str(self.transactions_frame):
+            self.transactions_tab_created = True
+            self.create_transactions_tab()
+            self.update_catalog_lists()
         
     def create_products_tab(self):
         # 创建输入框框架
@@ -193,7 +626,28 @@ class WarehouseSystem:
         ttk.Button(button_frame, text="添加商品", style='Action.TButton', command=self.add_product).pack(side=tk.LEFT, padx=10)
         ttk.Button(button_frame, text="编辑商品", style='Action.TButton', command=self.edit_product).pack(side=tk.LEFT, padx=10)
         ttk.Button(button_frame, text="删除商品", style='Action.TButton', command=self.delete_product).pack(side=tk.LEFT, padx=10)
-        ttk.Button(button_frame, text="导出Excel", style='Action.TButton', command=lambda: self.export_to_excel("products")).pack(side=tk.LEFT, padx=10)
+        ttk.Button(button_frame, text="导出", style='Action.TButton', command=lambda: self.export_data("products")).pack(side=tk.LEFT, padx=10)
+        
+        # 搜索框：按名称或类别全文搜索，结果按相关度排序
+        search_frame = ttk.Frame(self.products_frame)
+        search_frame.pack(fill="x", padx=5)
+        ttk.Label(search_frame, text="搜索:", font=('微软雅黑', 10)).pack(side=tk.LEFT, padx=(5, 2))
+        self.product_search_entry = ttk.Entry(search_frame, width=30, font=('微软雅黑', 10))
+        self.product_search_entry.pack(side=tk.LEFT)
+        self.product_search_entry.bind('<KeyRelease>', self.on_product_search_key)
+        self.product_search_entry.bind('<Return>', lambda e: self.search_products())
+        ttk.Button(search_frame, text="清除", command=self.clear_product_search).pack(side=tk.LEFT, padx=5)
+        self.product_search = ''  # 当前的搜索内容，为空时显示全部商品
+        self.product_search_job = None
+        
+        # 历史库存：显示各商品在指定日期结束时的库存（与搜索互斥）
+        ttk.Button(search_frame, text="当前库存", command=self.show_current_stock).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(search_frame, text="查看", command=self.show_stock_as_of).pack(side=tk.RIGHT)
+        self.stock_date_entry = ttk.Entry(search_frame, width=11, justify='center', font=('微软雅黑', 10))
+        self.stock_date_entry.pack(side=tk.RIGHT, padx=2)
+        self.stock_date_entry.bind('<Return>', lambda e: self.show_stock_as_of())
+        ttk.Label(search_frame, text="库存日期:", font=('微软雅黑', 10)).pack(side=tk.RIGHT)
+        self.stock_as_of = None  # 显示历史库存时为日期（YYYY-MM-DD）
         
         # 创建表格
         self.tree = ttk.Treeview(self.products_frame, columns=("序列", "ID", "名称", "数量", "价格", "类别"), show="headings")
@@ -218,6 +672,11 @@ class WarehouseSystem:
         self.tree.tag_configure('oddrow', background='#E8E8E8')  # 更深的灰色
         self.tree.tag_configure('evenrow', background='#F8F8F8')  # 较浅的灰色
         
+        # 商品ID到表格行的映射，以及按ID排序的商品ID列表（与表格行顺序一致）
+        self.product_iids = {}
+        self.product_ids = []
+        self.products_loading = False
+        
         # 绑定选择事件
         self.tree.bind('<<TreeviewSelect>>', self.item_selected)
         
@@ -245,32 +704,14 @@ class WarehouseSystem:
         self.trans_product_name = ttk.Combobox(input_frame, width=22, justify='center', font=('微软雅黑', 10))
         self.trans_product_name.grid(row=0, column=3, padx=(5, 10), pady=8)
         
-        # 初始化下拉列表的值
-        try:
-            conn = sqlite3.connect('warehouse.db')
-            cursor = conn.cursor()
-            
-            # 初始化商品ID列表
-            cursor.execute('SELECT id FROM products ORDER BY id')
-            ids = [str(row[0]) for row in cursor.fetchall()]
-            self.trans_product_id['values'] = ids
-            
-            # 初始化商品名称列表
-            cursor.execute('SELECT name FROM products ORDER BY name')
-            names = [row[0] for row in cursor.fetchall()]
-            self.trans_product_name['values'] = names
-            
-            conn.close()
-        except Exception as e:
-            messagebox.showerror("错误", f"初始化商品列表失败：{str(e)}")
-        
         # 绑定事件
         self.trans_product_id.bind('<FocusIn>', self.update_product_id_list)
         self.trans_product_name.bind('<FocusIn>', self.update_product_name_list)
         self.trans_product_id.bind('<<ComboboxSelected>>', self.on_product_id_selected)
         self.trans_product_name.bind('<<ComboboxSelected>>', self.on_product_name_selected)
         self.trans_product_id.bind('<KeyRelease>', self.update_product_name)
-        self.trans_product_name.bind('<KeyRelease>', self.update_product_id)
+        self.trans_product_name.bind('<KeyRelease>', self.on_product_name_key)
+        self.name_search_job = None
         
         # 第二行：数量和经办人
         ttk.Label(input_frame, text="数量:", font=('微软雅黑', 10)).grid(row=1, column=0, padx=(10, 0), pady=8, sticky='e')
@@ -296,10 +737,59 @@ class WarehouseSystem:
         
         ttk.Button(button_frame, text="入库", style='Action.TButton', command=lambda: self.add_transaction("入库")).pack(side=tk.LEFT, padx=10)
         ttk.Button(button_frame, text="出库", style='Action.TButton', command=lambda: self.add_transaction("出库")).pack(side=tk.LEFT, padx=10)
-        ttk.Button(button_frame, text="导出Excel", style='Action.TButton', command=lambda: self.export_to_excel("transactions")).pack(side=tk.LEFT, padx=10)
+        ttk.Button(button_frame, text="批量导入", style='Action.TButton', command=self.import_transactions_file).pack(side=tk.LEFT, padx=10)
+        ttk.Button(button_frame, text="扫码模式", style='Action.TButton', command=self.open_scan_window).pack(side=tk.LEFT, padx=10)
+        ttk.Button(button_frame, text="导出", style='Action.TButton', command=lambda: self.export_data("transactions")).pack(side=tk.LEFT, padx=10)
+        
+        # 筛选栏：条件在数据库中按索引查询，结果同样分页加载
+        filter_frame = ttk.LabelFrame(self.transactions_frame, text="筛选")
+        filter_frame.pack(fill="x", padx=5, pady=(0, 5))
+        
+        ttk.Label(filter_frame, text="日期:").grid(row=0, column=0, padx=(10, 2), pady=4, sticky='e')
+        self.filter_start = ttk.Entry(filter_frame, width=11, justify='center')
+        self.filter_start.grid(row=0, column=1, pady=4)
+        ttk.Label(filter_frame, text="至").grid(row=0, column=2, padx=2)
+        self.filter_end = ttk.Entry(filter_frame, width=11, justify='center')
+        self.filter_end.grid(row=0, column=3, pady=4)
+        
+        ttk.Label(filter_frame, text="类型:").grid(row=0, column=4, padx=(10, 2), sticky='e')
+        self.filter_type = ttk.Combobox(filter_frame, width=6, state='readonly', justify='center',
+                                        values=("全部", "入库", "出库"))
+        self.filter_type.current(0)
+        self.filter_type.grid(row=0, column=5)
+        
+        ttk.Label(filter_frame, text="经办人:").grid(row=0, column=6, padx=(10, 2), sticky='e')
+        self.filter_operator = ttk.Entry(filter_frame, width=12, justify='center')
+        self.filter_operator.grid(row=0, column=7)
+        
+        ttk.Label(filter_frame, text="商品:").grid(row=1, column=0, padx=(10, 2), pady=4, sticky='e')
+        self.filter_product = ttk.Entry(filter_frame, width=11, justify='center')  # 商品ID或名称
+        self.filter_product.grid(row=1, column=1, pady=4)
+        
+        ttk.Label(filter_frame, text="数量:").grid(row=1, column=2, padx=(10, 2), sticky='e')
+        self.filter_min_quantity = ttk.Entry(filter_frame, width=11, justify='center')
+        self.filter_min_quantity.grid(row=1, column=3)
+        ttk.Label(filter_frame, text="至").grid(row=1, column=4, padx=2)
+        self.filter_max_quantity = ttk.Entry(filter_frame, width=8, justify='center')
+        self.filter_max_quantity.grid(row=1, column=5)
+        
+        filter_buttons = ttk.Frame(filter_frame)
+        filter_buttons.grid(row=1, column=6, columnspan=2, padx=(10, 0))
+        ttk.Button(filter_buttons, text="查询", command=self.apply_transaction_filters).pack(side=tk.LEFT, padx=2)
+        ttk.Button(filter_buttons, text="清除", command=self.clear_transaction_filters).pack(side=tk.LEFT, padx=2)
+        
+        for entry in (self.filter_start, self.filter_end, self.filter_operator, self.filter_product,
+                      self.filter_min_quantity, self.filter_max_quantity):
+            entry.bind('<Return>', lambda e: self.apply_transaction_filters())
+        self.filter_type.bind('<<ComboboxSelected>>', lambda e: self.apply_transaction_filters())
+        self.trans_filters = {}  # 当前的筛选条件，见 WarehouseService.check_transaction_filters
+        
+        # 创建表格框架
+        trans_tree_frame = ttk.Frame(self.transactions_frame)
+        trans_tree_frame.pack(fill="both", expand=True, padx=5, pady=5)
         
         # 创建表格
-        self.trans_tree = ttk.Treeview(self.transactions_frame, 
+        self.trans_tree = ttk.Treeview(trans_tree_frame, 
                                      columns=("序列", "商品ID", "商品名称", "类型", "数量", "经办人", "日期"), 
                                      show="headings")
         self.trans_tree.heading("序列", text="序列")
@@ -319,7 +809,29 @@ class WarehouseSystem:
         self.trans_tree.column("经办人", width=100)
         self.trans_tree.column("日期", width=100)
         
-        self.trans_tree.pack(fill="both", expand=True, padx=5, pady=5)
+        # 添加垂直滚动条，滚动到底部时自动加载下一页
+        self.trans_scrollbar = ttk.Scrollbar(trans_tree_frame, orient="vertical", command=self.trans_tree.yview)
+        self.trans_tree.configure(yscrollcommand=self.on_transactions_scroll)
+        
+        # 布局表格和滚动条
+        self.trans_tree.grid(row=0, column=0, sticky="nsew")
+        self.trans_scrollbar.grid(row=0, column=1, sticky="ns")
+        trans_tree_frame.grid_columnconfigure(0, weight=1)
+        trans_tree_frame.grid_rowconfigure(0, weight=1)
+        
+        # 记录数标签
+        self.trans_count_label = ttk.Label(self.transactions_frame, text="", font=('微软雅黑', 9))
+        self.trans_count_label.pack(anchor='e', padx=10, pady=(0, 5))
+        
+        # 分页状态
+        self.trans_iids = {}  # 交易ID到表格行的映射
+        self.trans_keys = []  # 已加载行的 (ts, id)，与表格行顺序一致
+        self.trans_last_key = None  # 已加载的最后一行的 (ts, id)
+        self.trans_loaded = 0
+        self.trans_total = 0
+        self.trans_has_more = False
+        self.trans_load_pending = False
+        self.trans_reloads = 0  # 重新加载的次数，后台读取新增记录期间重新加载过时丢弃读到的结果
         
         # 设置标签样式 - 使用更深的颜色
         self.trans_tree.tag_configure('oddrow', background='#E8E8E8')  # 更深的灰色
@@ -354,29 +866,6 @@ class WarehouseSystem:
                 messagebox.showerror("错误", "请输入商品名称")
                 return
             
-            # 检查商品ID是否已存在
-            conn = sqlite3.connect('warehouse.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT id FROM products WHERE id=?', (product_id,))
-            existing_id = cursor.fetchone()
-            
-            cursor.execute('SELECT id FROM products WHERE name=?', (name,))
-            existing_name = cursor.fetchone()
-            
-            if existing_id:
-                messagebox.showerror("错误", "该商品ID已存在，请使用其他ID")
-                conn.close()
-                return
-            
-            if existing_name:
-                messagebox.showerror("错误", "该商品名称已存在，请使用其他名称")
-                conn.close()
-                return
-            
-            # 新商品的数量默认为0
-            quantity = 0
-            
             try:
                 price = float(self.price_entry.get()) if self.price_entry.get().strip() else None
             except ValueError:
@@ -384,20 +873,26 @@ class WarehouseSystem:
                 return
             
             category = self.category_entry.get() if self.category_entry.get().strip() else None
+            product_id = int(product_id)
             
-            cursor.execute('''
-            INSERT INTO products (id, name, quantity, price, category)
-            VALUES (?, ?, ?, ?, ?)
-            ''', (product_id, name, quantity, price, category))
-            conn.commit()
-            conn.close()
+            def on_done(result):
+                self.catalog.put(product_id, name)
+                self.refresh_product_row(product_id)
+                self.clear_entries()
+                messagebox.showinfo("成功", "商品添加成功！")
             
-            self.refresh_products()
-            self.clear_entries()
-            messagebox.showinfo("成功", "商品添加成功！")
+            def on_error(error):
+                if isinstance(error, WarehouseError):
+                    messagebox.showerror("错误", str(error))
+                elif isinstance(error, sqlite3.IntegrityError):
+                    messagebox.showerror("错误", "商品ID已存在，请使用其他ID")
+                else:
+                    messagebox.showerror("错误", f"添加商品时出错：{str(error)}")
+            
+            # 写事务在工作线程中执行，数据库被其他终端占用时重试等待也不会卡住窗口
+            self.worker.submit(self.service.add_product, product_id, name, price, category,
+                               on_done=on_done, on_error=on_error)
             
-        except sqlite3.IntegrityError:
-            messagebox.showerror("错误", "商品ID已存在，请使用其他ID")
         except ValueError:
             messagebox.showerror("错误", "输入格式错误，请检查输入内容")
         except Exception as e:
@@ -410,20 +905,23 @@ class WarehouseSystem:
                 messagebox.showerror("错误", "请选择要删除的商品")
                 return
                 
-            if not messagebox.askyesno("确认", "确定要删除选中的商品吗？"):
+            product_id = self.tree.item(selected[0])['values'][1]
+            if product_id != self.editing_product_id:
+                messagebox.showinfo("提示", "正在读取商品信息，请稍后再试")
                 return
                 
-            product_id = self.tree.item(selected[0])['values'][1]
+            if not messagebox.askyesno("确认", "确定要删除选中的商品吗？"):
+                return
             
-            conn = sqlite3.connect('warehouse.db')
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM products WHERE id=?', (product_id,))
-            conn.commit()
-            conn.close()
+            def on_done(result):
+                self.catalog.remove(product_id)
+                self.refresh_product_row(product_id)
+                self.update_product_in_transactions(product_id, product_id, "")
+                self.clear_entries()
+                messagebox.showinfo("成功", "商品删除成功")
             
-            self.refresh_products()
-            self.clear_entries()
-            messagebox.showinfo("成功", "商品删除成功")
+            self.worker.submit(self.service.delete_product, product_id, self.editing_version, on_done=on_done,
+                               on_error=lambda error: self.on_product_write_error(product_id, error))
             
         except Exception as e:
             messagebox.showerror("错误", str(e))
@@ -435,108 +933,359 @@ class WarehouseSystem:
             operator = self.trans_operator.get()
             trans_date = self.trans_date.get()
             
-            # 只在出库时验证经办人
-            if trans_type == "出库" and not operator.strip():
-                messagebox.showerror("错误", "出库时请输入经办人")
-                return
-            
-            # 如果是入库且没有填写经办人，设为空字符串
-            if trans_type == "入库" and not operator.strip():
-                operator = ""
-            
-            # 验证日期格式
-            try:
-                datetime.strptime(trans_date, '%Y-%m-%d')
-            except ValueError:
-                messagebox.showerror("错误", "日期格式错误，请使用格式：YYYY-MM-DD")
-                return
-            
-            conn = sqlite3.connect('warehouse.db')
-            cursor = conn.cursor()
-            
-            # 检查商品是否存在
-            cursor.execute('SELECT quantity FROM products WHERE id=?', (product_id,))
-            result = cursor.fetchone()
-            
-            if not result:
-                messagebox.showerror("错误", "商品不存在")
-                return
-                
-            current_quantity = result[0]
-            
-            # 出库时检查库存
-            if trans_type == "出库" and quantity > current_quantity:
-                messagebox.showerror("错误", "库存不足")
-                return
-                
-            # 更新库存
-            new_quantity = current_quantity + quantity if trans_type == "入库" else current_quantity - quantity
-            cursor.execute('UPDATE products SET quantity=? WHERE id=?', (new_quantity, product_id))
-            
-            # 记录交易
-            cursor.execute('''
-            INSERT INTO transactions (product_id, type, quantity, operator, date)
-            VALUES (?, ?, ?, ?, ?)
-            ''', (product_id, trans_type, quantity, operator, trans_date))
-            
-            conn.commit()
-            conn.close()
+            def on_done(trans_id):
+                # 只更新受影响的商品行和新增的交易记录行
+                self.refresh_product_row(product_id)
+                self.insert_transaction_rows([trans_id])
+                self.clear_transaction_entries()
+                messagebox.showinfo("成功", f"{trans_type}操作成功")
             
-            self.refresh_products()
-            self.refresh_transactions()
-            self.clear_transaction_entries()
-            messagebox.showinfo("成功", f"{trans_type}操作成功")
+            # 校验、更新库存和记录交易都在业务层的一个写事务中完成，在工作线程中执行；
+            # 回调在事务结束后才执行，不会在对话框打开期间占用数据库锁
+            self.worker.submit(self.service.post_transaction, product_id, trans_type, quantity, operator,
+                               trans_date, on_done=on_done,
+                               on_error=lambda error: messagebox.showerror("错误", str(error)))
             
         except Exception as e:
             messagebox.showerror("错误", str(e))
             
     def refresh_products(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        """在后台查询商品列表（有搜索内容时查询搜索结果），查询完成后填充表格"""
+        self.products_loading = True
+        if self.stock_as_of:
+            self.worker.submit(self.service.stock_as_of, self.stock_as_of, key='products',
+                               on_done=self.fill_products, on_error=self.on_products_load_error)
+        elif self.product_search:
+            self.worker.submit(self.service.search_products, self.product_search, key='products',
+                               on_done=self.fill_products, on_error=self.on_products_load_error)
+        else:
+            self.worker.submit(self.service.list_products, key='products', on_done=self.fill_products,
+                               on_error=self.on_products_load_error)
+        
+    def on_product_search_key(self, event=None):
+        """搜索框输入时延迟搜索，连续输入只搜索一次"""
+        if self.product_search_job is not None:
+            self.root.after_cancel(self.product_search_job)
+        self.product_search_job = self.root.after(PRODUCT_SEARCH_DELAY, self.search_products)
+        
+    def search_products(self):
+        self.product_search_job = None
+        text = self.product_search_entry.get().strip()
+        if text != self.product_search:
+            self.product_search = text
+            if text and self.stock_as_of:
+                self.set_stock_as_of(None)
+            self.refresh_products()
+        
+    def show_stock_as_of(self):
+        """显示各商品在指定日期结束时的库存"""
+        date = self.stock_date_entry.get().strip()
+        try:
+            datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            messagebox.showerror("错误", "日期格式错误，请使用格式：YYYY-MM-DD")
+            return
+        self.product_search_entry.delete(0, tk.END)
+        self.product_search = ''
+        self.set_stock_as_of(date)
+        self.refresh_products()
+        
+    def show_current_stock(self):
+        self.stock_date_entry.delete(0, tk.END)
+        if self.stock_as_of:
+            self.set_stock_as_of(None)
+            self.refresh_products()
+        
+    def set_stock_as_of(self, date):
+        self.stock_as_of = date
+        self.tree.heading("数量", text=f"数量（{date}）" if date else "数量")
+        
+    def clear_product_search(self):
+        self.product_search_entry.delete(0, tk.END)
+        self.search_products()
+        
+    def on_products_load_error(self, error):
+        self.products_loading = False
+        messagebox.showerror("错误", f"加载商品列表失败：{str(error)}")
+        
+    def fill_products(self, rows):
+        self.products_loading = False
+        self.tree.delete(*self.tree.get_children())
+        self.product_iids = {}
+        self.product_ids = []
             
-        conn = sqlite3.connect('warehouse.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM products')
-        for i, row in enumerate(cursor.fetchall(), 1):
+        for i, row in enumerate(rows, 1):
             tag = 'evenrow' if i % 2 == 0 else 'oddrow'
             values = (i,) + row  # 添加序列号
-            self.tree.insert('', 'end', values=values, tags=(tag,))
-        conn.close()
+            self.product_iids[row[0]] = self.tree.insert('', 'end', values=values, tags=(tag,))
+            self.product_ids.append(row[0])
+        
+        if not self.startup.reported:
+            self.startup.mark("商品列表加载")
+            self.report_startup_timing()
+        
+    def report_startup_timing(self):
+        """设置了 WAREHOUSE_STARTUP_TIMING 环境变量时打印启动耗时"""
+        self.startup.reported = True
+        if os.environ.get(STARTUP_TIMING_ENV):
+            print("启动耗时：")
+            print(self.startup.report())
+        
+    def refresh_product_row(self, product_id, old_id=None):
+        """商品新增、修改或删除后只更新对应的一行：在后台读取商品，读取完成后更新表格
+
+        old_id 为修改前的商品ID（ID被修改时传入）。
+        """
+        # 商品列表还在加载时重新加载，保证包含这次修改；
+        # 显示的是搜索结果（按相关度排序）或历史库存时重新查询
+        if self.products_loading or self.product_search or self.stock_as_of:
+            self.refresh_products()
+            return
+        
+        if old_id is None:
+            old_id = product_id
+        # 同一商品连续刷新时只用最后一次读到的内容
+        self.worker.submit(self.service.get_product, product_id, key=('product_row', product_id),
+                           on_done=lambda row: self.update_product_row(product_id, old_id, row),
+                           on_error=self.on_product_row_error)
+        
+    def update_product_row(self, product_id, old_id, row):
+        """用读到的商品（已删除时为 None）更新表格中的一行"""
+        # 读取期间商品列表开始了重新加载：新的列表已经包含这次修改
+        if self.products_loading or self.product_search or self.stock_as_of:
+            return
+        iid = self.product_iids.get(old_id)
+        
+        # ID未变的商品直接原地更新
+        if iid and row and old_id == product_id:
+            index = self.tree.index(iid)
+            self.tree.item(iid, values=(index + 1,) + row)
+            return
+        
+        # 删除修改前和修改后ID对应的行（修改后ID的行可能已由较早完成的刷新插入），再按ID顺序插入
+        start = None
+        for stale_id in {old_id, product_id}:
+            iid = self.product_iids.pop(stale_id, None)
+            if iid:
+                index = self.tree.index(iid)
+                self.tree.delete(iid)
+                del self.product_ids[index]
+                start = index if start is None else min(start, index)
+        if row:
+            index = bisect.bisect_left(self.product_ids, row[0])
+            self.product_iids[row[0]] = self.tree.insert('', index, values=(index + 1,) + row)
+            self.product_ids.insert(index, row[0])
+            start = index if start is None else min(start, index)
+        if start is not None:
+            self.renumber_rows(self.tree, start)
+        
+    def on_product_row_error(self, error):
+        messagebox.showerror("错误", f"刷新商品信息失败：{str(error)}")
+        
+    def renumber_rows(self, tree, start):
+        """从第 start 行开始重新设置序列号和斑马纹"""
+        children = tree.get_children()
+        for i in range(start, len(children)):
+            values = list(tree.item(children[i], 'values'))
+            values[0] = i + 1
+            tag = 'evenrow' if (i + 1) % 2 == 0 else 'oddrow'
+            tree.item(children[i], values=values, tags=(tag,))
+        
+    def apply_transaction_filters(self):
+        """按筛选栏的条件重新加载交易记录"""
+        product = self.filter_product.get().strip()
+        product_id = None
+        if product:
+            if product.isdecimal():
+                product_id = int(product)
+            else:
+                product_id = self.catalog.id_of(product)
+                if product_id is None:
+                    product_id = self.service.find_product_id(product)
+                if product_id is None:
+                    messagebox.showerror("错误", f"商品不存在：{product}")
+                    return
+        trans_type = self.filter_type.get()
+        filters = {
+            'start': self.filter_start.get().strip(),
+            'end': self.filter_end.get().strip(),
+            'trans_type': trans_type if trans_type != "全部" else None,
+            'operator': self.filter_operator.get().strip(),
+            'product_id': product_id,
+            'min_quantity': self.filter_min_quantity.get().strip(),
+            'max_quantity': self.filter_max_quantity.get().strip(),
+        }
+        try:
+            self.trans_filters = self.service.check_transaction_filters(filters)
+        except WarehouseError as e:
+            messagebox.showerror("错误", str(e))
+            return
+        self.refresh_transactions()
+        
+    def clear_transaction_filters(self):
+        for entry in (self.filter_start, self.filter_end, self.filter_operator, self.filter_product,
+                      self.filter_min_quantity, self.filter_max_quantity):
+            entry.delete(0, tk.END)
+        self.filter_type.current(0)
+        self.trans_filters = {}
+        self.refresh_transactions()
         
     def refresh_transactions(self):
-        for item in self.trans_tree.get_children():
-            self.trans_tree.delete(item)
-            
-        conn = sqlite3.connect('warehouse.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-        SELECT t.id, t.product_id, p.name, t.type, t.quantity, t.operator, t.date 
-        FROM transactions t 
-        LEFT JOIN products p ON t.product_id = p.id 
-        ORDER BY t.date DESC
-        ''')
-        for i, row in enumerate(cursor.fetchall(), 1):
+        """重新加载交易记录，只加载第一页"""
+        self.trans_tree.delete(*self.trans_tree.get_children())
+        
+        self.trans_iids = {}
+        self.trans_keys = []
+        self.trans_last_key = None
+        self.trans_loaded = 0
+        self.trans_total = 0
+        self.trans_has_more = True
+        self.trans_reloads += 1
+        self.load_more_transactions()
+        
+    def load_more_transactions(self):
+        """在后台按 (ts, id) 倒序查询下一页交易记录"""
+        if not self.trans_has_more:
+            return
+        self.trans_load_pending = True
+        self.worker.submit(self.query_transactions_page, self.trans_last_key, self.trans_filters,
+                           key='transactions', on_done=self.append_transactions,
+                           on_error=self.on_transactions_load_error)
+        
+    def query_transactions_page(self, last_key, filters):
+        """查询 last_key 之后的一页符合筛选条件的交易记录（在工作线程中执行）
+
+        返回 (last_key, 筛选条件, 记录, 总数)，只有第一页才统计总数。
+        """
+        total = self.service.count_transactions(filters) if last_key is None else None
+        rows = self.service.transactions_page(last_key, TRANSACTION_PAGE_SIZE, filters)
+        return last_key, filters, rows, total
+        
+    def on_transactions_load_error(self, error):
+        self.trans_load_pending = False
+        messagebox.showerror("错误", f"加载交易记录失败：{str(error)}")
+        
+    def append_transactions(self, result):
+        """把查询到的一页交易记录追加到表格末尾"""
+        last_key, filters, rows, total = result
+        self.trans_load_pending = False
+        # 表格已经重新加载过（或者筛选条件已经改变），这一页已经过期
+        if last_key != self.trans_last_key or filters is not self.trans_filters:
+            return
+        if total is not None:
+            self.trans_total = total
+        
+        for i, row in enumerate(rows, self.trans_loaded + 1):
             tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            values = (i,) + row[1:]  # 用序列号替换ID
-            self.trans_tree.insert('', 'end', values=values, tags=(tag,))
-        conn.close()
+            values = (i,) + row[1:7]  # 用序列号替换ID
+            self.trans_iids[row[0]] = self.trans_tree.insert('', 'end', values=values, tags=(tag,))
+            self.trans_keys.append((row[7], row[0]))
+        
+        if rows:
+            self.trans_last_key = (rows[-1][7], rows[-1][0])
+        self.trans_loaded += len(rows)
+        self.trans_has_more = len(rows) == TRANSACTION_PAGE_SIZE
+        self.update_transactions_count()
+        
+    def update_transactions_count(self):
+        # 加载的行数超过统计时的总数（期间有新记录）时以实际为准
+        self.trans_total = max(self.trans_total, self.trans_loaded)
+        filtered = "（已筛选）" if self.trans_filters else ""
+        self.trans_count_label.config(text=f"已加载 {self.trans_loaded} 条 / 共 {self.trans_total} 条{filtered}")
+        
+    def insert_transaction_rows(self, trans_ids):
+        """在后台读取新增的交易记录，读取完成后插入到表格中对应的位置（通常是最前面）"""
+        # 第一页还在加载时重新加载，保证包含这些记录
+        if self.trans_load_pending and self.trans_last_key is None:
+            self.refresh_transactions()
+            return
+        self.worker.submit(self.query_transactions, trans_ids, self.trans_filters, self.trans_reloads,
+                           on_done=self.add_transaction_rows, on_error=self.on_transactions_load_error)
+        
+    def query_transactions(self, trans_ids, filters, reloads):
+        """读取符合筛选条件的交易记录（在工作线程中执行），返回 (重新加载次数, 记录)"""
+        rows = [self.service.get_transaction(trans_id, filters) for trans_id in trans_ids]
+        return reloads, [row for row in rows if row]
+        
+    def add_transaction_rows(self, result):
+        reloads, rows = result
+        # 读取期间表格重新加载过（或者筛选条件已经改变），重新加载的结果已经包含这些记录
+        if reloads != self.trans_reloads:
+            return
+        for row in rows:
+            key = (row[7], row[0])
+            self.trans_total += 1
+            
+            # 比已加载的最后一行还早的记录留给后续分页加载
+            if self.trans_has_more and self.trans_last_key is not None and key < self.trans_last_key:
+                continue
+            
+            index = 0
+            while index < len(self.trans_keys) and self.trans_keys[index] > key:
+                index += 1
+            self.trans_iids[row[0]] = self.trans_tree.insert('', index, values=(index + 1,) + row[1:7])
+            self.trans_keys.insert(index, key)
+            self.trans_loaded += 1
+            self.renumber_rows(self.trans_tree, index)
+        self.update_transactions_count()
+        
+    def update_product_in_transactions(self, old_id, new_id, name):
+        """商品ID或名称变化后，更新已加载的交易记录行"""
+        for iid in self.trans_iids.values():
+            values = list(self.trans_tree.item(iid, 'values'))
+            if str(values[1]) == str(old_id):
+                values[1] = new_id
+                values[2] = name
+                self.trans_tree.item(iid, values=values)
+        
+    def on_transactions_scroll(self, first, last):
+        """表格滚动时更新滚动条，接近底部时加载下一页"""
+        self.trans_scrollbar.set(first, last)
+        if float(last) >= 0.9 and self.trans_has_more and not self.trans_load_pending:
+            self.load_more_transactions()
         
     def item_selected(self, event):
         selected = self.tree.selection()
         if selected:
-            # 进入编辑模式
-            self.editing_mode = True
+            product_id = self.tree.item(selected[0])['values'][1]
             
-            item = self.tree.item(selected[0])
-            values = item['values']
-            self.id_entry.delete(0, tk.END)
-            self.id_entry.insert(0, values[1])  # 商品ID
-            self.name_entry.delete(0, tk.END)
-            self.name_entry.insert(0, values[2])  # 商品名称
-            self.price_entry.delete(0, tk.END)
-            self.price_entry.insert(0, values[4])  # 价格
-            self.category_entry.delete(0, tk.END)
-            self.category_entry.insert(0, values[5])  # 类别
+            # 表格中的内容可能已被其他终端修改：在后台重新读取商品信息和版本号，
+            # 读到之前不进入编辑模式，也不能修改或删除
+            self.editing_mode = False
+            self.editing_version = None
+            self.editing_product_id = None
+            self.worker.submit(self.service.get_product_version, product_id, key='product_version',
+                               on_done=lambda current: self.show_selected_product(selected[0], product_id, current),
+                               on_error=self.on_product_row_error)
+            
+    def show_selected_product(self, iid, product_id, current):
+        """读到选中商品的最新信息和版本号后填入输入框，进入编辑模式"""
+        # 读取期间选中了其他行，或者这一行已被刷新
+        if self.tree.selection()[:1] != (iid,):
+            return
+        values = self.tree.item(iid)['values']
+        if current is None:
+            messagebox.showinfo("提示", "该商品已被其他终端删除")
+            self.refresh_product_row(product_id)
+            return
+        row, self.editing_version = current
+        self.editing_product_id = product_id
+        # 数量列保持表格中的值（查看历史库存时不是当前库存）
+        values = (values[0], row[0], row[1], values[3], row[3], row[4])
+        self.tree.item(iid, values=values)
+        values = self.tree.item(iid)['values']
+        
+        # 进入编辑模式
+        self.editing_mode = True
+        
+        self.id_entry.delete(0, tk.END)
+        self.id_entry.insert(0, values[1])  # 商品ID
+        self.name_entry.delete(0, tk.END)
+        self.name_entry.insert(0, values[2])  # 商品名称
+        self.price_entry.delete(0, tk.END)
+        self.price_entry.insert(0, values[4])  # 价格
+        self.category_entry.delete(0, tk.END)
+        self.category_entry.insert(0, values[5])  # 类别
 
     def clear_entries(self):
         self.id_entry.delete(0, tk.END)
@@ -561,15 +1310,11 @@ class WarehouseSystem:
                 messagebox.showwarning("提示", "商品ID只能输入数字")
                 return
             
-            conn = sqlite3.connect('warehouse.db')
-            cursor = conn.cursor()
-            cursor.execute('SELECT name FROM products WHERE id=?', (product_id,))
-            result = cursor.fetchone()
-            conn.close()
+            name = self.catalog.name_of(product_id)
             
             self.name_entry.delete(0, tk.END)
-            if result:
-                self.name_entry.insert(0, result[0])
+            if name is not None:
+                self.name_entry.insert(0, name)
         except Exception as e:
             messagebox.showerror("错误", f"查询商品信息时出错：{str(e)}")
 
@@ -581,15 +1326,11 @@ class WarehouseSystem:
         try:
             product_name = self.name_entry.get()
             if product_name:
-                conn = sqlite3.connect('warehouse.db')
-                cursor = conn.cursor()
-                cursor.execute('SELECT id FROM products WHERE name = ?', (product_name,))
-                result = cursor.fetchone()
-                conn.close()
+                product_id = self.catalog.id_of(product_name)
                 
-                if result:
+                if product_id is not None:
                     self.id_entry.delete(0, tk.END)
-                    self.id_entry.insert(0, str(result[0]))
+                    self.id_entry.insert(0, str(product_id))
         except:
             pass
 
@@ -604,6 +1345,9 @@ class WarehouseSystem:
             item = self.tree.item(selected[0])
             values = item['values']
             product_id = values[1]
+            if product_id != self.editing_product_id:
+                messagebox.showinfo("提示", "正在读取商品信息，请稍后再试")
+                return
             original_name = values[2]
             original_price = values[4] if values[4] is not None else ""
             original_category = values[5] if values[5] is not None else ""
@@ -615,73 +1359,46 @@ class WarehouseSystem:
             current_id = self.id_entry.get().strip()
             
             # 检查哪些字段被修改了
-            updates = []
-            update_values = []
+            changes = {}
             
             # 检查ID是否被修改
             if str(current_id) != str(product_id):
-                # 检查新ID是否已存在
-                conn = sqlite3.connect('warehouse.db')
-                cursor = conn.cursor()
-                cursor.execute('SELECT id FROM products WHERE id=?', (current_id,))
-                if cursor.fetchone():
-                    messagebox.showerror("错误", "该商品ID已存在")
-                    conn.close()
-                    return
-                conn.close()
-                
                 if not current_id:
                     messagebox.showerror("错误", "商品ID不能为空")
                     return
                 try:
-                    int(current_id)
+                    changes['id'] = int(current_id)
                 except ValueError:
                     messagebox.showerror("错误", "商品ID必须为数字")
                     return
-                updates.append("id=?")
-                update_values.append(current_id)
             
             # 检查名称是否被修改
             if current_name != str(original_name):
                 if not current_name:
                     messagebox.showerror("错误", "商品名称不能为空")
                     return
-                # 检查新名称是否已存在（排除当前商品）
-                conn = sqlite3.connect('warehouse.db')
-                cursor = conn.cursor()
-                cursor.execute('SELECT id FROM products WHERE name=? AND id!=?', (current_name, product_id))
-                if cursor.fetchone():
-                    messagebox.showerror("错误", "该商品名称已存在")
-                    conn.close()
-                    return
-                conn.close()
-                updates.append("name=?")
-                update_values.append(current_name)
+                changes['name'] = current_name
             
             # 只有当价格字段被修改时才验证
             if current_price != str(original_price):
                 if current_price:  # 只有当用户输入了新价格时才验证
                     try:
-                        price = float(current_price)
-                        if price < 0:
-                            messagebox.showerror("错误", "价格不能为负数")
-                            return
-                        updates.append("price=?")
-                        update_values.append(price)
+                        changes['price'] = float(current_price)
                     except ValueError:
                         messagebox.showerror("错误", "价格必须是数字")
                         return
+                    if changes['price'] < 0:
+                        messagebox.showerror("错误", "价格不能为负数")
+                        return
                 else:  # 如果用户清空了价格
-                    updates.append("price=?")
-                    update_values.append(None)
+                    changes['price'] = None
             
             # 检查类别是否被修改
             if current_category != str(original_category):
-                updates.append("category=?")
-                update_values.append(current_category if current_category else None)
+                changes['category'] = current_category if current_category else None
             
             # 如果没有任何修改，直接返回
-            if not updates:
+            if not changes:
                 messagebox.showinfo("提示", "没有检测到任何修改")
                 return
             
@@ -689,44 +1406,41 @@ class WarehouseSystem:
             if not messagebox.askyesno("确认", "确定要更新商品信息吗？"):
                 return
             
-            conn = sqlite3.connect('warehouse.db')
-            cursor = conn.cursor()
+            version = self.editing_version
             
-            try:
-                # 开始事务
-                conn.execute("BEGIN TRANSACTION")
-                
-                # 构建更新SQL语句
-                update_sql = "UPDATE products SET " + ", ".join(updates) + " WHERE id=?"
-                update_values.append(product_id)
+            def on_done(new_id):
+                # 保存成功说明版本号正是 editing_version，保存后加一；这一行仍然选中，
+                # 接着删除时要用新的版本号。不重新读取，以免把其他终端随后的修改当作已看过
+                if version is not None and self.editing_product_id == product_id:
+                    self.editing_version = version + 1
                 
-                # 执行商品表更新
-                cursor.execute(update_sql, tuple(update_values))
-                
-                # 如果ID被修改了，更新交易记录表中的product_id
-                if str(current_id) != str(product_id):
-                    cursor.execute('UPDATE transactions SET product_id=? WHERE product_id=?', 
-                                 (current_id, product_id))
-                
-                # 提交事务
-                conn.commit()
-                
-                # 刷新显示
-                self.refresh_products()
-                self.refresh_transactions()
+                # 只刷新被修改的商品行和相关的交易记录行
+                self.catalog.put(new_id, current_name, old_id=product_id)
+                self.refresh_product_row(new_id, old_id=product_id)
+                self.update_product_in_transactions(product_id, new_id, current_name)
                 self.clear_entries()
                 messagebox.showinfo("成功", "商品信息已更新")
-                
-            except Exception as e:
-                # 如果出现错误，回滚事务
-                conn.rollback()
-                raise e
-            finally:
-                conn.close()
+            
+            # 在工作线程中用一个事务更新（ID被修改时同时更新交易记录），出现错误时自动回滚
+            self.worker.submit(self.service.update_product, product_id, changes, version, on_done=on_done,
+                               on_error=lambda error: self.on_product_write_error(product_id, error))
             
         except Exception as e:
             messagebox.showerror("错误", str(e))
 
+    def on_product_write_error(self, product_id, error):
+        """后台修改或删除商品失败：已被其他终端修改或删除时重新加载这一行，其他错误直接提示"""
+        if isinstance(error, ProductConflictError):
+            self.show_product_conflict(product_id, error)
+        else:
+            messagebox.showerror("错误", str(error))
+
+    def show_product_conflict(self, product_id, error):
+        """商品已被其他终端修改或删除：提示并重新加载这一行"""
+        messagebox.showerror("错误", str(error))
+        self.clear_entries()
+        self.refresh_product_row(product_id)
+
     def on_product_double_click(self, event):
         # 获取双击的项目和列
         item = self.tree.selection()[0]
@@ -797,46 +1511,25 @@ class WarehouseSystem:
                                font=('Arial', 10, 'bold'))
         total_label.pack(side="right", padx=5)
         
-        # 查询数据
-        conn = sqlite3.connect('warehouse.db')
-        cursor = conn.cursor()
-        
-        # 查询每个经办人的出库统计
-        cursor.execute('''
-        SELECT 
-            t.operator,
-            SUM(t.quantity) as total_quantity,
-            COUNT(*) as transaction_count
-        FROM transactions t
-        WHERE t.product_id = ? 
-            AND t.type = '出库'
-            AND t.operator != ""
-        GROUP BY t.operator
-        ORDER BY total_quantity DESC
-        ''', (product_id,))
-        
-        # 填充数据
-        for i, row in enumerate(cursor.fetchall()):
-            tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            stats_tree.insert('', 'end', values=row, tags=(tag,))
-        
-        # 更新总计信息
-        cursor.execute('''
-        SELECT 
-            SUM(quantity) as total_quantity,
-            COUNT(*) as total_count
-        FROM transactions
-        WHERE product_id = ? 
-            AND type = '出库'
-            AND operator != ""
-        ''', (product_id,))
-        total_stats = cursor.fetchone()
-        
-        total_label.config(
-            text=f"总计 - 出库次数: {total_stats[1] or 0} 次    总出库数量: {total_stats[0] or 0} 件"
-        )
+        # 在后台查询每个经办人的出库统计
+        def show(result):
+            # 窗口已经关闭
+            if not stats_tree.winfo_exists():
+                return
+            rows, total_stats = result
+            
+            # 填充数据
+            for i, row in enumerate(rows):
+                tag = 'evenrow' if i % 2 == 0 else 'oddrow'
+                stats_tree.insert('', 'end', values=row, tags=(tag,))
+            
+            total_label.config(
+                text=f"总计 - 出库次数: {total_stats[1] or 0} 次    总出库数量: {total_stats[0] or 0} 件"
+            )
         
-        conn.close()
+        self.worker.submit(self.service.product_outbound_stats, product_id,
+                           key=str(stats_tree), on_done=show,
+                           on_error=lambda e: messagebox.showerror("错误", f"查询数据时出错：{str(e)}"))
 
     def on_tree_double_click(self, event):
         # 获取双击的项目和列
@@ -932,51 +1625,33 @@ class WarehouseSystem:
                 # 验证日期格式
                 datetime.strptime(start_date.get(), '%Y-%m-%d')
                 datetime.strptime(end_date.get(), '%Y-%m-%d')
-                
-                # 清空现有数据
-                for item in stats_tree.get_children():
-                    stats_tree.delete(item)
-                
-                # 查询数据
-                conn = sqlite3.connect('warehouse.db')
-                cursor = conn.cursor()
-                cursor.execute('''
-                SELECT 
-                    t.operator,
-                    SUM(t.quantity) as total_quantity,
-                    COUNT(*) as transaction_count
-                FROM transactions t
-                WHERE t.product_id = ? 
-                    AND t.type = '出库'
-                    AND t.date BETWEEN ? AND ?
-                GROUP BY t.operator
-                ORDER BY total_quantity DESC
-                ''', (product_id, start_date.get(), end_date.get()))
-                
-                # 填充数据
-                for i, row in enumerate(cursor.fetchall()):
-                    tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-                    stats_tree.insert('', 'end', values=row, tags=(tag,))
-                
-                # 更新总计信息
-                cursor.execute('''
-                SELECT 
-                    SUM(quantity) as total_quantity,
-                    COUNT(*) as total_count
-                FROM transactions
-                WHERE product_id = ? 
-                    AND type = '出库'
-                    AND date BETWEEN ? AND ?
-                ''', (product_id, start_date.get(), end_date.get()))
-                total_stats = cursor.fetchone()
-                
-                total_label.config(
-                    text=f"总计 - 出库次数: {total_stats[1] or 0} 次    总出库数量: {total_stats[0] or 0} 件"
-                )
-                
-                conn.close()
             except ValueError:
                 messagebox.showerror("错误", "日期格式错误，请使用YYYY-MM-DD格式")
+                return
+            
+            # 在后台查询，重复点击时只显示最后一次查询的结果
+            self.worker.submit(self.service.product_outbound_stats, product_id, start_date.get(), end_date.get(),
+                               key=str(stats_tree), on_done=show_stats,
+                               on_error=lambda e: messagebox.showerror("错误", f"查询数据时出错：{str(e)}"))
+        
+        def show_stats(result):
+            # 窗口已经关闭
+            if not stats_tree.winfo_exists():
+                return
+            rows, total_stats = result
+            
+            # 清空现有数据
+            stats_tree.delete(*stats_tree.get_children())
+            
+            # 填充数据
+            for i, row in enumerate(rows):
+                tag = 'evenrow' if i % 2 == 0 else 'oddrow'
+                stats_tree.insert('', 'end', values=row, tags=(tag,))
+            
+            # 更新总计信息
+            total_label.config(
+                text=f"总计 - 出库次数: {total_stats[1] or 0} 次    总出库数量: {total_stats[0] or 0} 件"
+            )
         
         # 添加查询按钮
         ttk.Button(date_frame, text="查询", command=refresh_stats).pack(side=tk.LEFT, padx=20)
@@ -985,6 +1660,10 @@ class WarehouseSystem:
         refresh_stats()
 
     def show_operator_stats(self, operator):
+        DateEntry = load_date_entry()
+        if DateEntry is None:
+            return
+        
         # 创建新窗口
         stats_window = tk.Toplevel(self.root)
         stats_window.title(f"经办人 {operator} 的出库统计")
@@ -1078,53 +1757,33 @@ class WarehouseSystem:
                 # 获取日期字符串
                 start_date_str = start_date.get_date().strftime('%Y-%m-%d')
                 end_date_str = end_date.get_date().strftime('%Y-%m-%d')
-                
-                # 清空现有数据
-                for item in stats_tree.get_children():
-                    stats_tree.delete(item)
-                
-                # 查询数据
-                conn = sqlite3.connect('warehouse.db')
-                cursor = conn.cursor()
-                cursor.execute('''
-                SELECT 
-                    t.product_id,
-                    p.name,
-                    SUM(t.quantity) as total_quantity,
-                    COUNT(*) as transaction_count
-                FROM transactions t
-                LEFT JOIN products p ON t.product_id = p.id
-                WHERE t.operator = ? 
-                    AND t.type = '出库'
-                    AND t.date BETWEEN ? AND ?
-                GROUP BY t.product_id, p.name
-                ORDER BY total_quantity DESC
-                ''', (operator, start_date_str, end_date_str))
-                
-                # 填充数据
-                for i, row in enumerate(cursor.fetchall()):
-                    tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-                    stats_tree.insert('', 'end', values=row, tags=(tag,))
-                
-                # 更新总计信息
-                cursor.execute('''
-                SELECT 
-                    SUM(quantity) as total_quantity,
-                    COUNT(*) as total_count
-                FROM transactions
-                WHERE operator = ? 
-                    AND type = '出库'
-                    AND date BETWEEN ? AND ?
-                ''', (operator, start_date_str, end_date_str))
-                total_stats = cursor.fetchone()
-                
-                total_label.config(
-                    text=f"总计 - 出库次数: {total_stats[1] or 0} 次    总出库数量: {total_stats[0] or 0} 件"
-                )
-                
-                conn.close()
             except Exception as e:
                 messagebox.showerror("错误", f"查询数据时出错：{str(e)}")
+                return
+            
+            # 在后台查询，重复点击时只显示最后一次查询的结果
+            self.worker.submit(self.service.operator_stats, operator, start_date_str, end_date_str,
+                               key=str(stats_tree), on_done=show_stats,
+                               on_error=lambda e: messagebox.showerror("错误", f"查询数据时出错：{str(e)}"))
+        
+        def show_stats(result):
+            # 窗口已经关闭
+            if not stats_tree.winfo_exists():
+                return
+            rows, total_stats = result
+            
+            # 清空现有数据
+            stats_tree.delete(*stats_tree.get_children())
+            
+            # 填充数据
+            for i, row in enumerate(rows):
+                tag = 'evenrow' if i % 2 == 0 else 'oddrow'
+                stats_tree.insert('', 'end', values=row, tags=(tag,))
+            
+            # 更新总计信息
+            total_label.config(
+                text=f"总计 - 出库次数: {total_stats[1] or 0} 次    总出库数量: {total_stats[0] or 0} 件"
+            )
         
         # 添加查询按钮
         ttk.Button(date_frame, text="查询", command=refresh_stats).pack(side=tk.LEFT, padx=20)
@@ -1132,73 +1791,113 @@ class WarehouseSystem:
         # 初始加载数据
         refresh_stats()
 
-    def export_to_excel(self, table_type):
-        try:
-            # 选择保存位置
-            file_path = filedialog.asksaveasfilename(
-                defaultextension='.xlsx',
-                filetypes=[("Excel files", "*.xlsx")],
-                title="保存Excel文件"
-            )
-            
-            if not file_path:
+    def export_data(self, table_type):
+        # 选择保存位置，格式由扩展名决定（记录超过Excel的行数上限时可以选CSV或Parquet）
+        file_path = filedialog.asksaveasfilename(
+            defaultextension='.xlsx',
+            filetypes=[("Excel files", "*.xlsx"), ("CSV files (UTF-8)", "*.csv"),
+                       ("Parquet files", "*.parquet"), ("Feather files", "*.feather")],
+            title="导出数据"
+        )
+        
+        if not file_path:
+            return
+        
+        # 在后台导出，显示进度并可以取消
+        progress = ProgressWindow(self.root, "导出", "正在导出数据...")
+        
+        def on_done(count):
+            progress.close()
+            messagebox.showinfo("成功", f"数据已成功导出，共 {count} 行！")
+        
+        def on_error(error):
+            progress.close()
+            messagebox.showerror("错误", f"导出失败：{str(error)}")
+        
+        # 交易记录按出入库管理页当前的筛选条件导出
+        filters = self.trans_filters if table_type == 'transactions' else None
+        progress.task = self.worker.submit(lambda task: self.service.export(table_type, file_path, filters,
+                                                                            progress=task.report),
+                                           pass_task=True, on_done=on_done, on_error=on_error,
+                                           on_progress=progress.update)
+
+    def open_scan_window(self):
+        """打开扫码模式窗口，先在后台检查商品目录是否需要重新加载"""
+        self.update_product_id_list()
+        ScanWindow(self)
+
+    def import_transactions_file(self):
+        """从CSV或Excel文件批量导入出入库记录"""
+        file_path = filedialog.askopenfilename(
+            filetypes=[("CSV或Excel文件", "*.csv *.xlsx"), ("CSV files", "*.csv"), ("Excel files", "*.xlsx")],
+            title="选择要导入的文件"
+        )
+        
+        if not file_path:
+            return
+        
+        # 在后台校验和导入，显示进度并可以取消
+        progress = ProgressWindow(self.root, "批量导入", "正在校验数据...")
+        
+        def run(task):
+            return self.service.import_transactions(file_path, progress=task.report)
+        
+        def on_done(result):
+            progress.close()
+            if result.errors:
+                # 错误报告保存在导入文件旁边
+                report_path = os.path.splitext(file_path)[0] + "_错误报告.csv"
+                write_error_report(result, report_path)
+                details = "\n".join(f"第 {line_no} 行：{message}" for line_no, message in sorted(result.errors)[:10])
+                messagebox.showerror("导入失败",
+                                     f"共 {result.total} 行，发现 {len(result.errors)} 处错误，未导入任何数据。\n\n"
+                                     f"{details}\n\n完整的错误报告已保存到：\n{report_path}")
                 return
             
-            conn = sqlite3.connect('warehouse.db')
-            
-            if table_type == "products":
-                # 导出商品列表
-                df = pd.read_sql_query('''
-                    SELECT id as 商品ID, name as 商品名称, 
-                           quantity as 数量, price as 价格, 
-                           category as 类别 
-                    FROM products
-                ''', conn)
-            else:
-                # 导出交易记录
-                df = pd.read_sql_query('''
-                    SELECT t.id as 交易ID, p.name as 商品名称,
-                           t.type as 类型, t.quantity as 数量,
-                           t.operator as 经办人, t.date as 日期
-                    FROM transactions t
-                    LEFT JOIN products p ON t.product_id = p.id
-                    ORDER BY t.date DESC
-                ''', conn)
-            
-            # 保存到Excel
-            df.to_excel(file_path, index=False, sheet_name='数据')
-            
-            # 调整Excel格式
-            from openpyxl import load_workbook
-            from openpyxl.styles import Alignment, Font
-            
-            wb = load_workbook(file_path)
-            ws = wb.active
-            
-            # 设置列宽和格式
-            for column in ws.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = (max_length + 2)
-                ws.column_dimensions[column_letter].width = adjusted_width
-                
-                # 设置标题行格式
-                ws[f"{column_letter}1"].font = Font(bold=True)
-                ws[f"{column_letter}1"].alignment = Alignment(horizontal="center")
-            
-            wb.save(file_path)
-            conn.close()
-            
-            messagebox.showinfo("成功", "数据已成功导出到Excel文件！")
-            
-        except Exception as e:
-            messagebox.showerror("错误", f"导出失败：{str(e)}")
+            # 批量导入影响的行较多，直接重新加载两个表格
+            self.refresh_products()
+            self.refresh_transactions()
+            messagebox.showinfo("成功", f"成功导入 {result.imported} 条出入库记录")
+        
+        def on_error(error):
+            progress.close()
+            messagebox.showerror("错误", f"导入失败：{str(error)}")
+        
+        progress.task = self.worker.submit(run, pass_task=True, on_done=on_done, on_error=on_error,
+                                           on_progress=progress.update)
+
+    def archive_transactions(self):
+        """把已经结束的年份的交易记录移到按年份的归档文件"""
+        archives = self.service.list_archives()
+        current = "\n".join(f"{year}年：{rows} 条" for year, path, rows in archives) or "（无）"
+        year = simpledialog.askinteger(
+            "归档旧交易记录",
+            f"已归档的年份：\n{current}\n\n"
+            "归档以下年份之前（不含该年）的交易记录。\n归档后这些年份不能再登记或导入交易记录：",
+            parent=self.root, initialvalue=datetime.now().year - 1,
+            minvalue=1970, maxvalue=datetime.now().year)
+        if year is None:
+            return
+        
+        progress = ProgressWindow(self.root, "归档", "正在归档交易记录...")
+        
+        def on_done(results):
+            progress.close()
+            if not results:
+                messagebox.showinfo("归档", f"{year}年以前没有需要归档的交易记录")
+                return
+            if self.transactions_tab_created:
+                self.refresh_transactions()
+            details = "\n".join(f"{archive_year}年：{rows} 条" for archive_year, rows in results)
+            messagebox.showinfo("成功", f"归档完成：\n{details}")
+        
+        def on_error(error):
+            progress.close()
+            messagebox.showerror("错误", f"归档失败：{str(error)}")
+        
+        progress.task = self.worker.submit(lambda task: self.service.archive_before(year, progress=task.report),
+                                           pass_task=True, on_done=on_done, on_error=on_error,
+                                           on_progress=progress.update)
 
     def on_transaction_click(self, event):
         # 获取当前选中的项目
@@ -1225,28 +1924,45 @@ class WarehouseSystem:
                 self.show_operator_stats(operator)
 
     def update_product_id_list(self, event=None):
-        try:
-            conn = sqlite3.connect('warehouse.db')
-            cursor = conn.cursor()
-            cursor.execute('SELECT id FROM products ORDER BY id')
-            ids = [str(row[0]) for row in cursor.fetchall()]
-            conn.close()
-            
-            # 更新下拉列表的值
-            self.trans_product_id['values'] = ids
-        except:
-            pass
+        # 在后台检查其他终端是否修改过商品，修改过时重新加载缓存
+        self.worker.submit(self.catalog.refresh, key='catalog',
+                           on_done=lambda changed: self.update_catalog_lists(),
+                           on_error=lambda e: None)
 
     def update_product_name_list(self, event=None):
+        self.update_product_id_list()
+
+    def update_catalog_lists(self):
+        """用商品目录缓存更新下拉列表的值"""
+        # 出入库选项卡还没有创建时，创建时再更新
+        if not self.transactions_tab_created:
+            return
+        
+        # 缓存有变化时才更新ID下拉列表
+        if self.trans_product_id_generation != self.catalog.generation:
+            self.trans_product_id['values'] = self.catalog.id_strings()
+            self.trans_product_id_generation = self.catalog.generation
+        
+        # 按当前输入内容更新名称下拉列表
+        self.update_name_suggestions()
+
+    def on_product_name_key(self, event=None):
+        """输入商品名称时：精确匹配立即填充ID，下拉列表在停止输入后再搜索"""
+        # 方向键、回车等用于操作下拉列表，不触发搜索
+        if event is not None and event.keysym in ('Up', 'Down', 'Return', 'Escape', 'Tab'):
+            return
+        self.update_product_id()
+        
+        if self.name_search_job is not None:
+            self.root.after_cancel(self.name_search_job)
+        self.name_search_job = self.root.after(NAME_SEARCH_DELAY, self.update_name_suggestions)
+
+    def update_name_suggestions(self):
+        """用与输入内容最匹配的商品名称更新下拉列表"""
+        self.name_search_job = None
         try:
-            conn = sqlite3.connect('warehouse.db')
-            cursor = conn.cursor()
-            cursor.execute('SELECT name FROM products ORDER BY name')
-            names = [row[0] for row in cursor.fetchall()]
-            conn.close()
-            
-            # 更新下拉列表的值
-            self.trans_product_name['values'] = names
+            self.trans_product_name['values'] = self.catalog.search(self.trans_product_name.get(),
+                                                                    NAME_SUGGESTION_LIMIT)
         except:
             pass
 
@@ -1254,21 +1970,14 @@ class WarehouseSystem:
         try:
             product_id = self.trans_product_id.get()
             if product_id:
-                conn = sqlite3.connect('warehouse.db')
-                cursor = conn.cursor()
-                cursor.execute('SELECT name FROM products WHERE id=?', (product_id,))
-                result = cursor.fetchone()
-                conn.close()
+                name = self.catalog.name_of(product_id)
                 
                 # 清空名称输入框
                 self.trans_product_name.delete(0, tk.END)
                 
                 # 只有在找到对应商品时才填充名称
-                if result:
-                    self.trans_product_name.insert(0, result[0])
-                    
-                    # 更新下拉列表
-                    self.update_product_name_list()
+                if name is not None:
+                    self.trans_product_name.insert(0, name)
         except:
             pass
 
@@ -1276,18 +1985,11 @@ class WarehouseSystem:
         try:
             product_name = self.trans_product_name.get()
             if product_name:
-                conn = sqlite3.connect('warehouse.db')
-                cursor = conn.cursor()
-                cursor.execute('SELECT id FROM products WHERE name = ?', (product_name,))
-                result = cursor.fetchone()
-                conn.close()
+                product_id = self.catalog.id_of(product_name)
                 
-                if result:
+                if product_id is not None:
                     self.trans_product_id.delete(0, tk.END)
-                    self.trans_product_id.insert(0, str(result[0]))
-                    
-                    # 更新下拉列表
-                    self.update_product_id_list()
+                    self.trans_product_id.insert(0, str(product_id))
         except:
             pass
 
@@ -1295,15 +1997,11 @@ class WarehouseSystem:
         try:
             product_id = self.trans_product_id.get()
             if product_id:
-                conn = sqlite3.connect('warehouse.db')
-                cursor = conn.cursor()
-                cursor.execute('SELECT name FROM products WHERE id=?', (product_id,))
-                result = cursor.fetchone()
-                conn.close()
+                name = self.catalog.name_of(product_id)
                 
-                if result:
+                if name is not None:
                     self.trans_product_name.delete(0, tk.END)
-                    self.trans_product_name.insert(0, result[0])
+                    self.trans_product_name.insert(0, name)
         except:
             pass
 
@@ -1311,15 +2009,11 @@ class WarehouseSystem:
         try:
             product_name = self.trans_product_name.get()
             if product_name:
-                conn = sqlite3.connect('warehouse.db')
-                cursor = conn.cursor()
-                cursor.execute('SELECT id FROM products WHERE name=?', (product_name,))
-                result = cursor.fetchone()
-                conn.close()
+                product_id = self.catalog.id_of(product_name)
                 
-                if result:
+                if product_id is not None:
                     self.trans_product_id.delete(0, tk.END)
-                    self.trans_product_id.insert(0, str(result[0]))
+                    self.trans_product_id.insert(0, str(product_id))
         except:
             pass
 
@@ -1332,6 +2026,13 @@ class WarehouseSystem:
         self.trans_date.delete(0, tk.END)
         self.trans_date.insert(0, datetime.now().strftime('%Y-%m-%d'))
 
+    def on_title_click(self, event):
+        """点击标题显示关于信息，按住 Ctrl+Shift 点击打开运行诊断窗口"""
+        if event.state & 0x0005 == 0x0005 and self.diagnostics is not None:
+            DiagnosticsWindow(self.root, self.diagnostics)
+        else:
+            self.show_about_info()
+
     def show_about_info(self):
         """显示关于信息"""
         about_text = """
@@ -1381,7 +2082,9 @@ if __name__ == "__main__":
         root = tk.Tk()
         app = WarehouseSystem(root)
         root.mainloop()
+        app.worker.shutdown()
+        app.db.close()
     except Exception as e:
         print("程序启动时发生错误：")
         print("详细错误信息:", str(e))
-        input("按回车键退出...")
\ No newline at end of file
+        input("按回车键退出...")
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""后台任务
+
+耗时的数据库查询、统计和导出在工作线程中执行，结果放入队列，
+由 Tk 主线程通过 root.after 定时取出后再调用回调，窗口不会卡住。
+
+同一个 key 的新任务会取消还在执行的旧任务，旧任务的结果直接丢弃，
+例如连续点击“查询”时只显示最后一次的结果。
+"""
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskCancelled(Exception):
+    """任务已被取消"""
+
+
+class Task:
+    def __init__(self, worker, key=None, on_done=None, on_error=None, on_progress=None):
+        self.worker = worker
+        self.key = key
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.cancelled = False
+        self._conn = None  # 任务执行期间所在线程的数据库连接，取消时用来中断查询
+        # 保护 _conn：连接是线程共用的，任务结束后不能再中断同一线程上的下一个任务
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """取消任务：正在执行的 SQL 会被中断，结果不再回调"""
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None:
+                self._conn.interrupt()
+
+    def check(self):
+        """在工作线程中检查任务是否已取消，已取消时抛出 TaskCancelled"""
+        if self.cancelled:
+            raise TaskCancelled()
+
+    def report(self, done, total=None):
+        """在工作线程中报告进度，on_progress 在主线程中以 (done, total) 调用"""
+        self.check()
+        if self.on_progress is not None:
+            self.worker._results.put((self, 'progress', (done, total)))
+
+
+class BackgroundWorker:
+    def __init__(self, root, db=None, max_workers=2, poll_interval=30, instrumentation=None):
+        self.root = root
+        self.db = db
+        self.instrumentation = instrumentation  # 记录每个回调的耗时（可选）
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='warehouse-worker')
+        self._results = queue.Queue()
+        self._latest = {}  # key -> 最新提交的任务
+        self._tasks = set()
+        self._poll_job = None
+
+    def submit(self, func, *args, key=None, on_done=None, on_error=None,
+               on_progress=None, pass_task=False):
+        """在工作线程中执行 func(*args)，返回 Task
+
+        pass_task=True 时以 func(task, *args) 调用，func 可以用
+        task.report() 报告进度、用 task.check() 响应取消。
+        回调都在主线程中执行。
+        """
+        task = Task(self, key, on_done, on_error, on_progress)
+        if key is not None:
+            previous = self._latest.get(key)
+            if previous is not None:
+                previous.cancel()
+            self._latest[key] = task
+        self._tasks.add(task)
+        self._executor.submit(self._run, task, func, args, pass_task)
+        self._schedule_poll()
+        return task
+
+    def _run(self, task, func, args, pass_task):
+        try:
+            if self.db is not None:
+                conn = self.db.connection()
+                with task._lock:
+                    task.check()
+                    task._conn = conn
+            else:
+                task.check()
+            result = func(task, *args) if pass_task else func(*args)
+            self._results.put((task, 'done', result))
+        except sqlite3.OperationalError as e:
+            if task.cancelled:
+                e = TaskCancelled()
+            self._results.put((task, 'error', e))
+        except BaseException as e:
+            self._results.put((task, 'error', e))
+        finally:
+            with task._lock:
+                task._conn = None
+
+    def _schedule_poll(self):
+        if self._poll_job is None:
+            self._poll_job = self.root.after(self.poll_interval, self._poll)
+
+    def _poll(self):
+        self._poll_job = None
+        while True:
+            try:
+                task, kind, value = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if kind != 'progress':
+                self._tasks.discard(task)
+                if self._latest.get(task.key) is task:
+                    del self._latest[task.key]
+            # 已取消或已被同 key 的新任务取代的结果直接丢弃
+            if task.cancelled:
+                continue
+            if kind == 'done':
+                callback = task.on_done
+            elif kind == 'error':
+                callback = task.on_error
+                if callback is None:
+                    callback = self._report_error
+            else:
+                callback = task.on_progress
+            if callback is None:
+                continue
+            start = time.perf_counter()
+            try:
+                callback(value)
+            except Exception as e:
+                self._report_error(e)
+            if self.instrumentation is not None:
+                self.instrumentation.record_callback(callback, time.perf_counter() - start)
+        if self._tasks:
+            self._schedule_poll()
+
+    def _report_error(self, error):
+        self.root.report_callback_exception(type(error), error, error.__traceback__)
+
+    def cancel(self, key):
+        """取消指定 key 的任务"""
+        task = self._latest.get(key)
+        if task is not None:
+            task.cancel()
+
+    def shutdown(self):
+        """取消所有任务并停止工作线程"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._poll_job is not None:
+            self.root.after_cancel(self._poll_job)
+            self._poll_job = None
+        self._executor.shutdown(wait=False, cancel_futures=True)